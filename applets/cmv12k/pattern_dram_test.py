@@ -2,10 +2,10 @@
 
 # DEMO PROCEDURE:
 # 1. build the fatbitstream with `python3 applets/cmv12k/pattern_dram_test.py -b`
-# 2. copy the resulting build/pattern_dram_test_*/pattern_dram_test.zip file to the Beta
+# 2. copy the resulting build/pattern_dram_test_*/pattern_dram_test.fatbitstream file and the blobs directory to the Beta
 # 3. log into the Beta and get root access with e.g. `sudo su`
 # 4. power up the sensor with `axiom_power_init.sh && axiom_power_on.sh`
-# 5. load the fatbitstream with `./pattern_dram_test.zip --run`
+# 5. load the fatbitstream with `./pattern_dram_test.fatbitstream --run`
 # 6. run `design.capture_pattern()` function at the prompt
 # 7. `exit()` and check pattern.bin
 
@@ -73,7 +73,8 @@ class Top(Elaboratable):
         time.sleep(0.05)
 
         print("downloading pattern...")
-        # ../ puts the file outside the extracted zip
+        # ../ puts the file next to the fatbitstream instead of the fatbitstreams/<name>/ directory it is extracted to
+        # (which is replaced when the fatbitstream is run again)
         self.input_dram_packet_ringbuffer_cpu_reader.read_packet_to_file("../pattern.bin")
 
         # make sure we transferred the full image
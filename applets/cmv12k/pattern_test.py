@@ -2,10 +2,10 @@
 
 # DEMO PROCEDURE:
 # 1. build the fatbitstream with `python3 applets/cmv12k/pattern_test.py -b`
-# 2. copy the resulting build/pattern_test_*/pattern_test.zip file to the Beta
+# 2. copy the resulting build/pattern_test_*/pattern_test.fatbitstream file and the blobs directory to the Beta
 # 3. log into the Beta and get root access with e.g. `sudo su`
 # 4. power up the sensor with `axiom_power_init.sh && axiom_power_on.sh`
-# 5. load the fatbitstream with `./pattern_test.zip --run`
+# 5. load the fatbitstream with `./pattern_test.fatbitstream --run`
 # 6. run `pattern = design.capture_pattern()` function at the prompt
 
 from amaranth import *
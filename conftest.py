@@ -0,0 +1,95 @@
+# pytest hooks for the naps test suite (the tests are run in parallel by pytest-xdist, see pyproject.toml):
+# * tests whose simulation did not change since their last green run are skipped if pytest is run with --sim-cache (or
+#   NAPS_SIM_CACHE=1); see naps/util/result_cache.py
+# * the tests are started longest first (by their wall time in the last run) so that all workers finish together
+# * the wall time of the slowest tests is reported at the end of the run
+
+import hashlib
+
+import pytest
+
+from naps.util import result_cache
+from naps.util.env import naps_getenv
+
+_durations = {}  # nodeid -> wall time of setup, call and teardown in seconds
+_cached = set()  # the nodeids of the tests that were skipped because they did not change
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("naps")
+    group.addoption("--sim-cache", action="store_true", default=naps_getenv("SIM_CACHE") == "1",
+                    help="skip the tests whose simulation did not change since their last green run")
+    group.addoption("--test-times", type=int, default=15, metavar="N",
+                    help="report the wall time of the N slowest tests (0 for all tests)")
+
+
+def _cache(config):
+    return getattr(config, "cache", None)  # None if the cacheprovider plugin is disabled
+
+
+def _result_key(nodeid):
+    return "naps/results/" + hashlib.sha256(nodeid.encode()).hexdigest()[:32]
+
+
+def pytest_collection_modifyitems(config, items):
+    cache = _cache(config)
+    if cache is None:
+        return
+    # every worker collects the same order because the durations are only written by the controller at the end
+    durations = cache.get("naps/durations", {})
+    items.sort(key=lambda item: -durations.get(item.nodeid, float("inf")))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item):
+    cache = _cache(item.config)
+    if cache is None:
+        return
+    result_cache.start_test(result_cache.ResultRecord(
+        source_digest=result_cache.file_digest(item.path),
+        previous=cache.get(_result_key(item.nodeid), None),
+        skip_unchanged=item.config.getoption("sim_cache"),
+    ))
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    report = (yield).get_result()
+    cache = _cache(item.config)
+    if cache is None or report.when != "call":
+        return
+    record = result_cache.finish_test(report.passed)
+    if not report.skipped:
+        cache.set(_result_key(item.nodeid), record)
+
+
+def pytest_runtest_logreport(report):
+    _durations[report.nodeid] = _durations.get(report.nodeid, 0) + report.duration
+    if report.when == "call" and report.skipped and result_cache.SKIP_REASON in str(report.longrepr):
+        _cached.add(report.nodeid)
+
+
+def pytest_sessionfinish(session):
+    cache = _cache(session.config)
+    if cache is None or hasattr(session.config, "workerinput"):
+        return
+    durations = cache.get("naps/durations", {})
+    # skipped tests keep the duration of their last real run
+    durations.update({nodeid: duration for nodeid, duration in _durations.items() if nodeid not in _cached})
+    cache.set("naps/durations", durations)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    ran = sorted(((duration, nodeid) for nodeid, duration in _durations.items() if nodeid not in _cached), reverse=True)
+    if not ran or hasattr(config, "workerinput"):
+        return
+    terminalreporter.section("naps test times")
+    n = config.getoption("test_times")
+    for duration, nodeid in ran[:n or None]:
+        terminalreporter.write_line(f"{duration:8.2f}s {nodeid}")
+    summary = f"{len(ran)} tests took {sum(duration for duration, _ in ran):.1f}s (summed over all workers)"
+    if _cached:
+        durations = _cache(config).get("naps/durations", {})
+        saved = sum(durations.get(nodeid, 0) for nodeid in _cached)
+        summary += f"; {len(_cached)} unchanged tests were skipped (about {saved:.1f}s)"
+    terminalreporter.write_line(summary)
@@ -1,6 +1,7 @@
 from .axi_endpoint import *
 from .full_to_lite import *
 from .interconnect import *
+from .crossbar import *
 from .peripheral_connector import *
 from .sim_util import *
 from .stream_reader import *
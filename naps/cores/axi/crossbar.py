@@ -0,0 +1,312 @@
+from typing import List
+
+from amaranth import *
+from amaranth.lib.fifo import SyncFIFOBuffered
+
+from naps.soc.peripherals_aggregator import aligned_windows, window_patterns
+from .axi_endpoint import AxiEndpoint, AxiResponse
+
+__all__ = ["AxiCrossbar"]
+
+
+class AxiCrossbar(Elaboratable):
+    def __init__(self, masters: List[AxiEndpoint], max_outstanding=8, max_ids=4):
+        """
+        A full AXI crossbar that connects many masters to many slaves.
+
+        Every slave port gets an address window. Requests to addresses that are not covered by any window are
+        answered with DECERR. The index of the master is prepended to the transaction id on the slave ports so that
+        the responses can be routed back to the master that issued them (like it is done in most AXI interconnects).
+        Each master can have transactions with up to `max_ids` different ids in flight per direction and up to
+        `max_outstanding` transactions per id. Transactions with different ids can target different slaves at the same
+        time and their responses are returned in the order in which the slaves answer. To keep the responses of one id
+        in order, all outstanding transactions with the same id must target the same slave (a transaction that wants
+        to access another slave waits until they are done).
+        Bursts are passed through unchanged; the beats of a read burst are never interleaved with other responses.
+        Arbitration between masters that want to access the same slave and between slaves that answer the same master
+        is done with a fixed priority (the first master / slave wins).
+
+        :param masters: the AXI full masters that are connected to the crossbar.
+        :param max_outstanding: the number of transactions with the same id a master can have in flight per direction.
+        :param max_ids: the number of different ids a master can have in flight per direction.
+        """
+        assert masters
+        for master in masters:
+            assert not master.is_lite, "the AXI crossbar only supports full AXI masters"
+            assert (master.addr_bits, master.data_bits, master.id_bits) == \
+                   (masters[0].addr_bits, masters[0].data_bits, masters[0].id_bits)
+        self._masters = masters
+        self._slaves: List[(AxiEndpoint, range)] = []
+        self.max_outstanding = max_outstanding
+        self.max_ids = max_ids
+        self.master_bits = (len(masters) - 1).bit_length()
+
+    def get_port(self, address_range: range) -> AxiEndpoint:
+        """
+        Gets an AXI full port that receives all transactions to an address window.
+        The ids on the port are `master_bits` wider than the ids of the masters.
+
+        :param address_range: the address window of the slave. Use `peripheral.range()` to get it from the memorymap.
+        :return: A new AxiEndpoint shaped after the masters.
+        """
+        for _, other_range in self._slaves:
+            assert address_range.stop <= other_range.start or other_range.stop <= address_range.start, \
+                "address windows of the slaves must not overlap"
+        port = self._downstream_endpoint(name="axi_crossbar_downstream")
+        self._slaves.append((port, address_range))
+        return port
+
+    def _downstream_endpoint(self, name):
+        model = self._masters[0]
+        return AxiEndpoint(
+            addr_bits=model.addr_bits, data_bits=model.data_bits, lite=False,
+            id_bits=model.id_bits + self.master_bits, name=name
+        )
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # the last slave is the decode error slave that answers all transactions that hit no window
+        error_slave = m.submodules.error_slave = AxiDecodeErrorSlave(self._downstream_endpoint(name="axi_crossbar_error"))
+        slaves = [port for port, _ in self._slaves] + [error_slave.axi]
+        error_slave_index = len(slaves) - 1
+        max_in_flight = self.max_outstanding * self.max_ids  # per master and direction
+
+        def decode(address):
+            target = Signal(range(len(slaves)))
+            with m.Switch(address):
+                for i, (_, address_range) in enumerate(self._slaves):
+                    patterns = window_patterns(aligned_windows(address_range.start, address_range.stop), len(address))
+                    if patterns:
+                        with m.Case(*patterns):
+                            m.d.comb += target.eq(i)
+                with m.Default():
+                    m.d.comb += target.eq(error_slave_index)
+            return target
+
+        def master_of(id):
+            return id[len(id) - self.master_bits:] if self.master_bits else C(0)
+
+        def extend_id(id, master_index):
+            return Cat(id, C(master_index, self.master_bits)) if self.master_bits else id
+
+        def connect_address_channel(address_channel_name, response_channel_name, response_done, w_order_fifos=None,
+                                    master_w_order_fifos=None):
+            """
+            Builds the arbitration of one address channel and the tracking of the outstanding transactions.
+            Every master has `max_ids` slots that each remember the slave and the number of the outstanding
+            transactions of one id.
+            """
+            requests = []  # requests[master][slave]
+            for master_index, master in enumerate(self._masters):
+                address_channel = master[address_channel_name]
+                target = decode(address_channel.payload)
+                prefix = f"{address_channel_name}_{master_index}"
+                slots = range(self.max_ids)
+                slot_ids = Array(Signal.like(address_channel.id, name=f"{prefix}_slot_id_{i}") for i in slots)
+                slot_targets = Array(Signal(range(len(slaves)), name=f"{prefix}_slot_target_{i}") for i in slots)
+                slot_counts = Array(
+                    Signal(range(self.max_outstanding + 1), name=f"{prefix}_slot_count_{i}") for i in slots
+                )
+                hits = Cat((slot_counts[i] != 0) & (slot_ids[i] == address_channel.id) for i in slots)
+                free = Cat(slot_counts[i] == 0 for i in slots)
+
+                # the slot of the id of the request if it has transactions in flight or else the first free slot
+                slot = Signal(range(self.max_ids), name=f"{prefix}_slot")
+                for i in reversed(slots):
+                    with m.If(free[i]):
+                        m.d.comb += slot.eq(i)
+                for i in slots:
+                    with m.If(hits[i]):
+                        m.d.comb += slot.eq(i)
+                can_issue = Mux(
+                    hits.any(),
+                    (slot_targets[slot] == target) & (slot_counts[slot] < self.max_outstanding),
+                    free.any()
+                )
+                if master_w_order_fifos is not None:
+                    can_issue &= master_w_order_fifos[master_index].w_rdy
+                requests.append([address_channel.valid & can_issue & (target == i) for i in range(len(slaves))])
+
+                issued = address_channel.valid & address_channel.ready
+                done = response_done(master_index)
+                response_id = master[response_channel_name].id
+                for i in slots:
+                    slot_issued = issued & (slot == i)
+                    slot_done = done & (slot_counts[i] != 0) & (slot_ids[i] == response_id)
+                    with m.If(slot_issued):
+                        m.d.sync += slot_ids[i].eq(address_channel.id)
+                        m.d.sync += slot_targets[i].eq(target)
+                    with m.If(slot_issued & ~slot_done):
+                        m.d.sync += slot_counts[i].eq(slot_counts[i] + 1)
+                    with m.Elif(~slot_issued & slot_done):
+                        m.d.sync += slot_counts[i].eq(slot_counts[i] - 1)
+
+                if master_w_order_fifos is not None:
+                    # the write data of a master follows the order of its write addresses
+                    m.d.comb += master_w_order_fifos[master_index].w_data.eq(target)
+                    m.d.comb += master_w_order_fifos[master_index].w_en.eq(issued)
+
+            # every slave has a register stage on its address channel that is loaded by the master that wins the arbitration
+            for slave_index, slave in enumerate(slaves):
+                slave_channel = slave[address_channel_name]
+                granted = Signal(len(self._masters), name=f"{address_channel_name}_granted_{slave_index}")
+                load = ~slave_channel.valid | slave_channel.ready
+                if w_order_fifos is not None:
+                    load &= w_order_fifos[slave_index].w_rdy
+                with m.If(load):
+                    for master_index in range(len(self._masters)):
+                        earlier_requests = Cat(requests[i][slave_index] for i in range(master_index))
+                        m.d.comb += granted[master_index].eq(requests[master_index][slave_index] & ~earlier_requests.any())
+                    m.d.sync += slave_channel.valid.eq(granted.any())
+
+                for master_index, master in enumerate(self._masters):
+                    address_channel = master[address_channel_name]
+                    with m.If(granted[master_index]):
+                        m.d.comb += address_channel.ready.eq(1)
+                        m.d.sync += slave_channel.payload.eq(address_channel.payload)
+                        m.d.sync += slave_channel.id.eq(extend_id(address_channel.id, master_index))
+                        m.d.sync += slave_channel.burst_type.eq(address_channel.burst_type)
+                        m.d.sync += slave_channel.burst_len.eq(address_channel.burst_len)
+                        m.d.sync += slave_channel.beat_size_bytes.eq(address_channel.beat_size_bytes)
+                        m.d.sync += slave_channel.protection_type.eq(address_channel.protection_type)
+                        if w_order_fifos is not None:
+                            m.d.comb += w_order_fifos[slave_index].w_data.eq(master_index)
+                if w_order_fifos is not None:
+                    m.d.comb += w_order_fifos[slave_index].w_en.eq(granted.any())
+
+        def connect_response_channel(response_channel_name, fields, bursts):
+            """
+            Routes the responses of the slaves back to the masters by the master index in their id.
+            If more than one slave has a response for a master, the first one wins; bursts are not interrupted.
+            """
+            for master_index, master in enumerate(self._masters):
+                response_channel = master[response_channel_name]
+                pending = Cat(
+                    slave[response_channel_name].valid & (master_of(slave[response_channel_name].id) == master_index)
+                    for slave in slaves
+                )
+                selected = Signal(range(len(slaves)), name=f"{response_channel_name}_selected_{master_index}")
+                for slave_index in reversed(range(len(slaves))):
+                    with m.If(pending[slave_index]):
+                        m.d.comb += selected.eq(slave_index)
+                if bursts:
+                    in_burst = Signal(name=f"{response_channel_name}_in_burst_{master_index}")
+                    burst_slave = Signal(range(len(slaves)), name=f"{response_channel_name}_burst_slave_{master_index}")
+                    with m.If(in_burst):
+                        m.d.comb += selected.eq(burst_slave)
+                    with m.If(response_channel.valid & response_channel.ready):
+                        m.d.sync += in_burst.eq(~response_channel.last)
+                        m.d.sync += burst_slave.eq(selected)
+
+                with m.Switch(selected):
+                    for slave_index, slave in enumerate(slaves):
+                        with m.Case(slave_index):
+                            slave_channel = slave[response_channel_name]
+                            m.d.comb += response_channel.valid.eq(pending[slave_index])
+                            m.d.comb += response_channel.id.eq(slave_channel.id[:master.id_bits])
+                            for field in fields:
+                                m.d.comb += response_channel[field].eq(slave_channel[field])
+                            with m.If(pending[slave_index]):
+                                m.d.comb += slave_channel.ready.eq(response_channel.ready)
+
+        # read path
+        def read_done(master_index):
+            read_data = self._masters[master_index].read_data
+            return read_data.valid & read_data.ready & read_data.last
+        connect_address_channel("read_address", "read_data", read_done)
+        connect_response_channel("read_data", ["payload", "resp", "last"], bursts=True)
+
+        # write path
+        def write_done(master_index):
+            write_response = self._masters[master_index].write_response
+            return write_response.valid & write_response.ready
+        # the write data has no id in AXI4 so we have to remember the order in which the masters got access to a slave
+        # and the order of the slaves every master wrote to
+        w_order_fifos = []
+        for slave_index in range(len(slaves)):
+            fifo = SyncFIFOBuffered(width=max(self.master_bits, 1), depth=max_in_flight * len(self._masters))
+            m.submodules[f"w_order_fifo_{slave_index}"] = fifo
+            w_order_fifos.append(fifo)
+        master_w_order_fifos = []
+        for master_index in range(len(self._masters)):
+            fifo = SyncFIFOBuffered(width=max(Shape.cast(range(len(slaves))).width, 1), depth=max_in_flight)
+            m.submodules[f"master_w_order_fifo_{master_index}"] = fifo
+            master_w_order_fifos.append(fifo)
+        connect_address_channel("write_address", "write_response", write_done, w_order_fifos, master_w_order_fifos)
+        connect_response_channel("write_response", ["resp"], bursts=False)
+
+        for slave_index, slave in enumerate(slaves):
+            fifo = w_order_fifos[slave_index]
+            with m.If(fifo.r_rdy):
+                with m.Switch(fifo.r_data):
+                    for master_index, master in enumerate(self._masters):
+                        with m.Case(master_index):
+                            master_fifo = master_w_order_fifos[master_index]
+                            routed = master_fifo.r_rdy & (master_fifo.r_data == slave_index)
+                            write_data = master.write_data
+                            m.d.comb += slave.write_data.valid.eq(write_data.valid & routed)
+                            m.d.comb += slave.write_data.payload.eq(write_data.payload)
+                            m.d.comb += slave.write_data.byte_strobe.eq(write_data.byte_strobe)
+                            m.d.comb += slave.write_data.last.eq(write_data.last)
+                            m.d.comb += slave.write_data.id.eq(extend_id(write_data.id, master_index))
+                            with m.If(routed):
+                                m.d.comb += write_data.ready.eq(slave.write_data.ready)
+            m.d.comb += fifo.r_en.eq(slave.write_data.valid & slave.write_data.ready & slave.write_data.last)
+        for master_index, master in enumerate(self._masters):
+            write_data = master.write_data
+            master_fifo = master_w_order_fifos[master_index]
+            m.d.comb += master_fifo.r_en.eq(write_data.valid & write_data.ready & write_data.last)
+
+        return m
+
+
+class AxiDecodeErrorSlave(Elaboratable):
+    def __init__(self, axi: AxiEndpoint):
+        """An AXI full slave that answers every transaction with DECERR. Used for transactions to unmapped addresses."""
+        self.axi = axi
+
+    def elaborate(self, platform):
+        m = Module()
+        axi = self.axi
+
+        read_id = Signal.like(axi.read_address.id)
+        read_len = Signal.like(axi.read_address.burst_len)
+        read_beat = Signal.like(axi.read_address.burst_len)
+        with m.FSM(name="read"):
+            with m.State("ADDRESS"):
+                m.d.comb += axi.read_address.ready.eq(1)
+                with m.If(axi.read_address.valid):
+                    m.d.sync += read_id.eq(axi.read_address.id)
+                    m.d.sync += read_len.eq(axi.read_address.burst_len)
+                    m.d.sync += read_beat.eq(0)
+                    m.next = "DATA"
+            with m.State("DATA"):
+                m.d.comb += axi.read_data.valid.eq(1)
+                m.d.comb += axi.read_data.id.eq(read_id)
+                m.d.comb += axi.read_data.resp.eq(AxiResponse.DECERR)
+                m.d.comb += axi.read_data.last.eq(read_beat == read_len)
+                with m.If(axi.read_data.ready):
+                    m.d.sync += read_beat.eq(read_beat + 1)
+                    with m.If(axi.read_data.last):
+                        m.next = "ADDRESS"
+
+        write_id = Signal.like(axi.write_address.id)
+        with m.FSM(name="write"):
+            with m.State("ADDRESS"):
+                m.d.comb += axi.write_address.ready.eq(1)
+                with m.If(axi.write_address.valid):
+                    m.d.sync += write_id.eq(axi.write_address.id)
+                    m.next = "DATA"
+            with m.State("DATA"):
+                m.d.comb += axi.write_data.ready.eq(1)
+                with m.If(axi.write_data.valid & axi.write_data.last):
+                    m.next = "RESPONSE"
+            with m.State("RESPONSE"):
+                m.d.comb += axi.write_response.valid.eq(1)
+                m.d.comb += axi.write_response.id.eq(write_id)
+                m.d.comb += axi.write_response.resp.eq(AxiResponse.DECERR)
+                with m.If(axi.write_response.ready):
+                    m.next = "ADDRESS"
+
+        return m
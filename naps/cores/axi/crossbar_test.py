@@ -0,0 +1,171 @@
+import unittest
+
+from amaranth import *
+from amaranth.sim import Passive
+from naps import SimPlatform, write_to_stream, read_from_stream, do_nothing
+from . import AxiEndpoint, AxiCrossbar, AxiResponse, axi_read_burst, axi_write_burst
+
+
+class Dut(Elaboratable):
+    def __init__(self, crossbar):
+        self.crossbar = crossbar
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.crossbar = self.crossbar
+        return m
+
+
+def memory_slave_process(axi: AxiEndpoint, memory: dict, base, latency=0):
+    """A slave that answers one transaction after the other and echoes the transaction ids"""
+    def process():
+        yield Passive()
+        while True:
+            if (yield axi.read_address.valid):
+                addr, burst_len, id = yield from read_from_stream(axi.read_address, ("payload", "burst_len", "id"))
+                yield from do_nothing(latency)
+                for i in range(burst_len + 1):
+                    yield from write_to_stream(
+                        axi.read_data, payload=memory.get(addr - base + i * axi.data_bytes, 0), resp=AxiResponse.OKAY,
+                        last=(i == burst_len), id=id
+                    )
+            elif (yield axi.write_address.valid):
+                addr, burst_len, id = yield from read_from_stream(axi.write_address, ("payload", "burst_len", "id"))
+                for i in range(burst_len + 1):
+                    value, last = yield from read_from_stream(axi.write_data, ("payload", "last"))
+                    assert last == (i == burst_len)
+                    memory[addr - base + i * axi.data_bytes] = value
+                yield from write_to_stream(axi.write_response, resp=AxiResponse.OKAY, id=id)
+            else:
+                yield
+    return process
+
+
+class AxiCrossbarTest(unittest.TestCase):
+    def test_crossbar(self):
+        platform = SimPlatform()
+        masters = [AxiEndpoint(addr_bits=32, data_bits=32, lite=False, id_bits=12) for _ in range(2)]
+        crossbar = AxiCrossbar(masters, max_outstanding=4)
+        memories = [{}, {}]
+        for i, base in enumerate([0x1000, 0x2000]):
+            slave = crossbar.get_port(range(base, base + 0x100))
+            platform.add_process(memory_slave_process(slave, memories[i], base), "sync")
+
+        finished = []
+
+        def master_process(master_index):
+            def process():
+                master = masters[master_index]
+                for i, base in enumerate([0x1000, 0x2000]):
+                    data = [(master_index << 16) | (i << 8) | beat for beat in range(4)]
+                    addr = base + 0x40 * master_index
+                    self.assertEqual((yield from axi_write_burst(master, addr, data, id=7)), (AxiResponse.OKAY.value, 7))
+                    beats = yield from axi_read_burst(master, addr, 4, id=master_index + 1)
+                    self.assertEqual(beats, [(value, AxiResponse.OKAY.value, master_index + 1) for value in data])
+                finished.append(master_index)
+            return process
+        platform.add_process(master_process(0), "sync")
+        platform.add_process(master_process(1), "sync")
+
+        platform.add_sim_clock("sync", 100e6)
+        platform.sim(Dut(crossbar))
+        self.assertEqual(sorted(finished), [0, 1])
+        self.assertEqual(memories[0][0x44], (1 << 16) | 1)
+
+    def test_outstanding_reads(self):
+        platform = SimPlatform()
+        master = AxiEndpoint(addr_bits=32, data_bits=32, lite=False, id_bits=4)
+        crossbar = AxiCrossbar([master])
+        memory = {i * 4: i for i in range(64)}
+        slave = crossbar.get_port(range(0x0, 0x100))
+        platform.add_process(memory_slave_process(slave, memory, 0x0), "sync")
+
+        def testbench():
+            # issue two bursts before consuming any data
+            yield from write_to_stream(master.read_address, payload=0x0, id=1, burst_len=3)
+            yield from write_to_stream(master.read_address, payload=0x80, id=2, burst_len=1)
+            beats = []
+            for _ in range(6):
+                beats.append((yield from read_from_stream(master.read_data, ("payload", "id", "last"))))
+            self.assertEqual(beats, [(0, 1, 0), (1, 1, 0), (2, 1, 0), (3, 1, 1), (32, 2, 0), (33, 2, 1)])
+
+        platform.add_sim_clock("sync", 100e6)
+        platform.sim(Dut(crossbar), testbench)
+
+    def test_decode_error(self):
+        platform = SimPlatform()
+        master = AxiEndpoint(addr_bits=32, data_bits=32, lite=False, id_bits=4)
+        crossbar = AxiCrossbar([master])
+        slave = crossbar.get_port(range(0x1000, 0x1100))
+        platform.add_process(memory_slave_process(slave, {}, 0x1000), "sync")
+
+        def testbench():
+            beats = yield from axi_read_burst(master, 0x3000, 3, id=5)
+            self.assertEqual(beats, [(0, AxiResponse.DECERR.value, 5)] * 3)
+            self.assertEqual((yield from axi_write_burst(master, 0x0, [1, 2], id=3)), (AxiResponse.DECERR.value, 3))
+            beats = yield from axi_read_burst(master, 0x1004, 1, id=2)
+            self.assertEqual(beats, [(0, AxiResponse.OKAY.value, 2)])
+
+        platform.add_sim_clock("sync", 100e6)
+        platform.sim(Dut(crossbar), testbench)
+
+    def two_slaves(self, latencies):
+        platform = SimPlatform()
+        master = AxiEndpoint(addr_bits=32, data_bits=32, lite=False, id_bits=4)
+        crossbar = AxiCrossbar([master])
+        memories = [{i * 4: base + i for i in range(64)} for base in [0x1000, 0x2000]]
+        for memory, base, latency in zip(memories, [0x1000, 0x2000], latencies):
+            slave = crossbar.get_port(range(base, base + 0x100))
+            platform.add_process(memory_slave_process(slave, memory, base, latency), "sync")
+        platform.add_sim_clock("sync", 100e6)
+        return platform, master, crossbar, memories
+
+    def test_different_ids_overlap(self):
+        platform, master, crossbar, _ = self.two_slaves(latencies=[20, 0])
+
+        def testbench():
+            # the fast slave answers while the slow slave is still busy
+            yield from write_to_stream(master.read_address, payload=0x1000, id=1, burst_len=1)
+            yield from write_to_stream(master.read_address, payload=0x2000, id=2, burst_len=1)
+            beats = []
+            for _ in range(4):
+                beats.append((yield from read_from_stream(master.read_data, ("payload", "id", "last"))))
+            self.assertEqual(beats, [(0x2000, 2, 0), (0x2001, 2, 1), (0x1000, 1, 0), (0x1001, 1, 1)])
+
+        platform.sim(Dut(crossbar), testbench)
+
+    def test_same_id_stays_in_order(self):
+        platform, master, crossbar, _ = self.two_slaves(latencies=[20, 0])
+        beats = []
+
+        def reader():
+            for _ in range(2):
+                beats.append((yield from read_from_stream(master.read_data, ("payload", "id"))))
+        platform.add_process(reader, "sync")
+
+        def testbench():
+            # the second request waits until the response of the first one was delivered
+            yield from write_to_stream(master.read_address, payload=0x1000, id=1, burst_len=0)
+            yield from write_to_stream(master.read_address, payload=0x2000, id=1, burst_len=0)
+            self.assertEqual(beats, [(0x1000, 1)])
+            yield from do_nothing(10)
+            self.assertEqual(beats, [(0x1000, 1), (0x2000, 1)])
+
+        platform.sim(Dut(crossbar), testbench)
+
+    def test_outstanding_writes_to_different_slaves(self):
+        platform, master, crossbar, memories = self.two_slaves(latencies=[0, 0])
+
+        def testbench():
+            yield from write_to_stream(master.write_address, payload=0x1010, id=1, burst_len=1)
+            yield from write_to_stream(master.write_address, payload=0x2020, id=2, burst_len=0)
+            # the write data follows the order of the write addresses
+            for value, last in [(0xA, 0), (0xB, 1), (0xC, 1)]:
+                yield from write_to_stream(master.write_data, payload=value, byte_strobe=0xF, last=last)
+            responses = []
+            for _ in range(2):
+                responses.append((yield from read_from_stream(master.write_response, ("resp", "id"))))
+            self.assertEqual(sorted(responses), [(AxiResponse.OKAY.value, 1), (AxiResponse.OKAY.value, 2)])
+
+        platform.sim(Dut(crossbar), testbench)
+        self.assertEqual([memories[0][0x10], memories[0][0x14], memories[1][0x20]], [0xA, 0xB, 0xC])
@@ -3,7 +3,7 @@ from amaranth import *
 from .axi_endpoint import AxiResponse as AxiResponse, AxiEndpoint
 from naps.soc.peripheral import Response as BusSlaveResponse, Peripheral
 
-__all__ = ["AxiLitePeripheralConnector"]
+__all__ = ["AxiLitePeripheralConnector", "AxiPeripheralConnector"]
 
 
 class AxiLitePeripheralConnector(Elaboratable):
@@ -99,3 +99,102 @@ class AxiLitePeripheralConnector(Elaboratable):
                     m.next = "IDLE"
 
         return m
+
+
+class AxiPeripheralConnector(Elaboratable):
+    def __init__(self, peripheral: Peripheral, id_bits=12, bundle_name="axi"):
+        """
+        A full AXI `PeripheralConnector` for `Peripheral`s that implement `handle_read_pipelined` and
+        `handle_write_pipelined` (e.g. the `SocMemory`). Bursts are served with one beat per cycle.
+        Only INCR bursts with beats of the full bus width are supported. Beats outside of the range of the peripheral
+        are answered with SLVERR.
+        :param peripheral: The peripheral which this controller should handle
+        :param id_bits: the width of the transaction ids of the AXI bus
+        """
+        assert callable(peripheral.handle_read_pipelined) or callable(peripheral.handle_write_pipelined)
+        self.peripheral = peripheral
+
+        self.axi = AxiEndpoint(addr_bits=32, data_bits=32, lite=False, id_bits=id_bits, name=bundle_name)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        address_range = self.peripheral.range()
+        assert address_range is not None
+        assert address_range.start < address_range.stop
+
+        def in_range(signal):
+            return (signal >= address_range.start) & (signal < address_range.stop)
+
+        # read path
+        read_address = Signal.like(self.axi.read_address.payload)
+        read_id = Signal.like(self.axi.read_address.id)
+        beats_to_issue = Signal(range(17))
+        read_valid = Signal()
+        read_last = Signal()
+        read_error = Signal()
+
+        readable = callable(self.peripheral.handle_read_pipelined)
+        writable = callable(self.peripheral.handle_write_pipelined)
+
+        issue = (beats_to_issue != 0) & (~read_valid | self.axi.read_data.ready)
+        if readable:
+            read_data = self.peripheral.handle_read_pipelined(m, read_address - address_range.start, issue)
+        else:
+            read_data = C(0, 32)
+
+        m.d.comb += self.axi.read_address.ready.eq((beats_to_issue == 0) & ~read_valid)
+        with m.If(self.axi.read_address.valid & self.axi.read_address.ready):
+            m.d.sync += read_address.eq(self.axi.read_address.payload)
+            m.d.sync += read_id.eq(self.axi.read_address.id)
+            m.d.sync += beats_to_issue.eq(self.axi.read_address.burst_len + 1)
+
+        with m.If(issue):
+            m.d.sync += read_address.eq(read_address + 4)
+            m.d.sync += beats_to_issue.eq(beats_to_issue - 1)
+            m.d.sync += read_valid.eq(1)
+            m.d.sync += read_last.eq(beats_to_issue == 1)
+            m.d.sync += read_error.eq(~in_range(read_address) if readable else 1)
+        with m.Elif(self.axi.read_data.ready):
+            m.d.sync += read_valid.eq(0)
+
+        m.d.comb += self.axi.read_data.valid.eq(read_valid)
+        m.d.comb += self.axi.read_data.payload.eq(Mux(read_error, 0, read_data))
+        m.d.comb += self.axi.read_data.resp.eq(Mux(read_error, AxiResponse.SLVERR, AxiResponse.OKAY))
+        m.d.comb += self.axi.read_data.last.eq(read_last)
+        m.d.comb += self.axi.read_data.id.eq(read_id)
+
+        # write path
+        write_address = Signal.like(self.axi.write_address.payload)
+        write_id = Signal.like(self.axi.write_address.id)
+        write_error = Signal()
+        with m.FSM(name="write"):
+            with m.State("ADDRESS"):
+                m.d.comb += self.axi.write_address.ready.eq(1)
+                with m.If(self.axi.write_address.valid):
+                    m.d.sync += write_address.eq(self.axi.write_address.payload)
+                    m.d.sync += write_id.eq(self.axi.write_address.id)
+                    m.d.sync += write_error.eq(0)
+                    m.next = "DATA"
+            with m.State("DATA"):
+                m.d.comb += self.axi.write_data.ready.eq(1)
+                with m.If(self.axi.write_data.valid):
+                    m.d.sync += write_address.eq(write_address + 4)
+                    with m.If(~in_range(write_address) if writable else True):
+                        m.d.sync += write_error.eq(1)
+                    with m.If(self.axi.write_data.last):
+                        m.next = "RESPONSE"
+            with m.State("RESPONSE"):
+                m.d.comb += self.axi.write_response.valid.eq(1)
+                m.d.comb += self.axi.write_response.id.eq(write_id)
+                m.d.comb += self.axi.write_response.resp.eq(Mux(write_error, AxiResponse.SLVERR, AxiResponse.OKAY))
+                with m.If(self.axi.write_response.ready):
+                    m.next = "ADDRESS"
+
+        if writable:
+            write_beat = self.axi.write_data.valid & self.axi.write_data.ready & in_range(write_address)
+            self.peripheral.handle_write_pipelined(
+                m, write_address - address_range.start, self.axi.write_data.payload, write_beat
+            )
+
+        return m
@@ -5,7 +5,7 @@ from amaranth.sim import Passive
 from naps import SimPlatform, write_to_stream, read_from_stream
 from .axi_endpoint import AxiEndpoint, AxiResponse, AxiBurstType
 
-__all__ = ["axil_read", "axil_write", "answer_read_burst", "answer_write_burst", "axi_ram_sim_model"]
+__all__ = ["axil_read", "axil_write", "axi_read_burst", "axi_write_burst", "answer_read_burst", "answer_write_burst", "axi_ram_sim_model"]
 
 
 def axil_read(axi, addr, timeout=100):
@@ -22,6 +22,32 @@ def axil_write(axi, addr, data, timeout=100):
     assert AxiResponse.OKAY.value == response
 
 
+def axi_read_burst(axi: AxiEndpoint, addr, n_beats, id=0, timeout=100):
+    """Issues an INCR read burst on a full AXI master and returns a list of (data, resp, id) tuples of its beats"""
+    yield from write_to_stream(
+        axi.read_address, payload=addr, id=id, burst_len=n_beats - 1, burst_type=AxiBurstType.INCR, timeout=timeout
+    )
+    beats = []
+    for i in range(n_beats):
+        value, resp, beat_id, last = yield from read_from_stream(axi.read_data, ("payload", "resp", "id", "last"), timeout)
+        assert last == (i == n_beats - 1)
+        beats.append((value, resp, beat_id))
+    return beats
+
+
+def axi_write_burst(axi: AxiEndpoint, addr, data, id=0, timeout=100):
+    """Issues an INCR write burst on a full AXI master and returns the (resp, id) of the write response"""
+    yield from write_to_stream(
+        axi.write_address, payload=addr, id=id, burst_len=len(data) - 1, burst_type=AxiBurstType.INCR, timeout=timeout
+    )
+    for i, value in enumerate(data):
+        yield from write_to_stream(
+            axi.write_data, payload=value, byte_strobe=(1 << axi.data_bytes) - 1, last=(i == len(data) - 1), id=id,
+            timeout=timeout
+        )
+    return (yield from read_from_stream(axi.write_response, ("resp", "id"), timeout))
+
+
 def answer_read_burst(axi: AxiEndpoint, memory: Dict[int, int], timeout=100):
     addr, burst_len, burst_type, beat_size_bytes = yield from read_from_stream(axi.read_address, ("payload", "burst_len", "burst_type", "beat_size_bytes"), timeout)
     assert 2 ** beat_size_bytes == axi.data_bytes
@@ -60,6 +60,7 @@ class Ila(Elaboratable):
         self.running = StatusSignal()
         self.write_ptr = StatusSignal(range(trace_length))
         self.trigger_since = StatusSignal(range(trace_length + 1))
+        self.triggered = StatusSignal(interrupt=True)
         self.probes = []
         self.decoders = []
 
@@ -90,6 +91,8 @@ class Ila(Elaboratable):
         )
         write_port = self.mem.write_port(domain="sync")
 
+        m.d.comb += self.triggered.eq(~self.running & ~self.initial_)
+
         since_reset = Signal(range(self.trace_length + 1))
         with m.If(self.running):
             with m.If(self.write_ptr < (self.trace_length - 1)):
@@ -130,13 +133,16 @@ class Ila(Elaboratable):
         self.reset = not self.reset
 
 
+    @driver_method
+    async def wait_for_trigger(self, timeout=None):
+        return await self.wait_for("triggered", 1, timeout)
+
     @driver_method
     def get_values(self):
         assert (not self.running) and (not self.initial_), "ila didnt trigger yet"
-        r = list(range(self.trace_length))
-        addresses = r[self.write_ptr:] + r[:self.write_ptr]
-        for address in addresses:
-            value = self.mem[address]
+        values = self.mem[0:self.trace_length]
+        write_ptr = self.write_ptr
+        for value in values[write_ptr:] + values[:write_ptr]:
             current_offset = 0
             current_row = []
             for name, (size, _) in self.probes:
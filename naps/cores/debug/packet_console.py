@@ -19,7 +19,7 @@ class ConsolePacketSource(Elaboratable):
         self.reset = ControlSignal()
         self.packet_length = ControlSignal(range(max_packet_size))
         self.read_ptr = StatusSignal(range(max_packet_size))
-        self.done = StatusSignal(init=1)
+        self.done = StatusSignal(init=1, interrupt=True)
         self.memory = SocMemory(
             shape=data_width, depth=self.max_packet_size,
             soc_read=False, init=[], attrs=dict(syn_ramstyle="block_ram")
@@ -55,15 +55,9 @@ class ConsolePacketSource(Elaboratable):
         return m
 
     @driver_method
-    def write_packet(self, packet, timeout=0):
-        from time import sleep
-        for i in range(int(timeout * 10)):
-            if self.done:
-                break
-            sleep(0.1)
-        assert self.done
-        for i, word in enumerate(packet):
-            self.memory[i] = word
+    async def write_packet(self, packet, timeout=0):
+        assert await self.wait_for("done", 1, timeout)
+        self.memory[0:len(packet)] = packet
         self.packet_length = len(packet) - 1
         self.reset = not self.reset
 
@@ -75,7 +69,7 @@ class ConsolePacketSink(Elaboratable):
 
         self.reset = ControlSignal()
         self.write_pointer = StatusSignal(range(self.max_packet_size))
-        self.packet_done = StatusSignal()
+        self.packet_done = StatusSignal(interrupt=True)
         self.memory = SocMemory(
             shape=len(input.payload), depth=self.max_packet_size,
             soc_write=False, init=[], attrs=dict(syn_ramstyle="block_ram")
@@ -108,16 +102,11 @@ class ConsolePacketSink(Elaboratable):
         return m
 
     @driver_method
-    def read_packet(self, timeout=0):
-        from time import sleep
-        for i in range(int(timeout * 10)):
-            if self.packet_done:
-                break
-            sleep(0.1)
-        if not self.packet_done:
+    async def read_packet(self, timeout=0):
+        if not await self.wait_for("packet_done", 1, timeout):
             return None
 
-        to_return = [self.memory[i] for i in range(self.write_pointer)]
+        to_return = self.memory[0:self.write_pointer]
         self.reset = not self.reset
         return to_return
 
@@ -24,7 +24,44 @@ class DramPacketRingbufferCpuWriter(Elaboratable):
     def elaborate(self, platform):
         return Module()
 
-    # TODO: implement driver methods
+    @driver_method
+    def _buffers(self):
+        # a persistent writable mapping of all buffers; it is only created once per driver instance
+        if getattr(self, "_buffers_view", None) is None:
+            import os, mmap
+            fd = os.open("/dev/mem", os.O_RDWR | os.O_SYNC)
+            mapping = mmap.mmap(fd, self.n_buffers * self.max_packet_size, mmap.MAP_SHARED,
+                                mmap.PROT_READ | mmap.PROT_WRITE, offset=self.base_address)
+            os.close(fd)
+            self._buffers_view = memoryview(mapping)
+        return self._buffers_view
+
+    @driver_method
+    def next_buffer(self):
+        """
+        A memoryview of the buffer that is written next. Fill it in place and hand it to the gateware with submit().
+        """
+        offset = self.current_write_buffer * self.max_packet_size
+        return self._buffers()[offset:offset + self.max_packet_size]
+
+    @driver_method
+    def submit(self, length):
+        """Hand the first `length` bytes of the buffer returned by next_buffer() to the gateware."""
+        assert length < self.max_packet_size
+        buffer = self.current_write_buffer
+        setattr(self, f"buffer{buffer}_level", length)
+        # the gateware always reads the buffer before the current write buffer
+        self.current_write_buffer = (buffer + 1) % self.n_buffers
+
+    @driver_method
+    def write_packet(self, data):
+        """
+        Copy a packet into the next buffer and hand it to the gateware.
+        :param data: a bytes like object (bytes, memoryview, numpy array, ...) that is shorter than max_packet_size
+        """
+        data = memoryview(data).cast("B")
+        self.next_buffer()[:len(data)] = data
+        self.submit(len(data))
 
 
 class DramPacketRingbufferCpuReader(Elaboratable):
@@ -32,7 +69,13 @@ class DramPacketRingbufferCpuReader(Elaboratable):
         self.writer = writer
         self.n_buffers = writer.n_buffers
 
+        self.base_address = writer.base_address
+        self.max_packet_size = writer.max_packet_size
+
         self.current_write_buffer = StatusSignal(range(self.n_buffers))
+        # these belong to the writer and are only aliased here to be able to detect dropped and truncated buffers
+        self.buffers_written = writer.buffers_written
+        self.overflowed_buffers = writer.overflowed_buffers
 
         # note the base and level StatusSignals generated in elaborate()
 
@@ -51,15 +94,134 @@ class DramPacketRingbufferCpuReader(Elaboratable):
         return m
 
     @driver_method
-    def read_packet_to_file(self, filename="packet.bin"):
-        import os, mmap
+    def _buffers(self):
+        # a persistent mapping of all buffers; it is only created once per driver instance
+        if getattr(self, "_buffers_view", None) is None:
+            import os, mmap
+            fd = os.open("/dev/mem", os.O_RDONLY | os.O_SYNC)
+            mapping = mmap.mmap(fd, self.n_buffers * self.max_packet_size, mmap.MAP_SHARED, mmap.PROT_READ,
+                                offset=self.base_address)
+            os.close(fd)
+            self._buffers_view = memoryview(mapping)
+        return self._buffers_view
+
+    @driver_method
+    def _buffer_view(self, buffer):
+        offset = getattr(self, f"buffer{buffer}_base") - self.base_address
+        return self._buffers()[offset:offset + getattr(self, f"buffer{buffer}_level")]
+
+    @driver_method
+    def _completed_buffers(self):
+        # current_write_buffer follows buffers_written one cycle later. both cannot be read atomically, so we retry
+        # until current_write_buffer did not change while we read buffers_written.
+        while True:
+            current = self.current_write_buffer
+            written = self.buffers_written
+            if self.current_write_buffer == current:
+                return written, current
+
+    @driver_method
+    def completed_buffer_batches(self, timeout=None, raise_on_drop=False):
+        """
+        Returns a generator that yields lists of (packet_number, memoryview) of all the buffers that the gateware
+        completed since the last batch, starting with the buffers completed after this call.
+        The memoryviews point directly into the ringbuffer and are only valid until the gateware wraps around to
+        that buffer again; copy them (e.g. with bytes()) if they are needed for longer.
+        Buffers that were overwritten before they were consumed are counted in self.dropped_buffers and packets
+        that did not fit into a buffer are counted in self.truncated_buffers.
+        :param timeout: stop if the gateware did not complete a buffer for that many seconds
+        :param raise_on_drop: raise an OverflowError instead of only counting dropped buffers
+        """
+        from time import sleep, time
+        mask = 0xFFFF_FFFF
+        # the buffer the gateware currently writes to is incomplete, so at most n_buffers - 1 buffers can be read
+        readable = self.n_buffers - 1
+
+        self.dropped_buffers = 0
+        self.truncated_buffers = 0
+        overflowed_start = self.overflowed_buffers
+        next_packet, _ = self._completed_buffers()
+        last_progress = time()
+
+        def drop(n):
+            self.dropped_buffers += n
+            if raise_on_drop:
+                raise OverflowError(f"{n} buffers were overwritten before they were consumed")
+            print(f"dropped {n} buffers")
+
+        def batches(next_packet, last_progress):
+            while True:
+                written, current = self._completed_buffers()
+                available = (written - next_packet) & mask
+                if available == 0:
+                    if timeout is not None and time() - last_progress > timeout:
+                        return
+                    sleep(0.0001)
+                    continue
+                last_progress = time()
+                if available > readable:
+                    drop(available - readable)
+                    next_packet = (written - readable) & mask
+                    available = readable
+                batch = [
+                    ((next_packet + i) & mask, self._buffer_view((current - available + i) % self.n_buffers))
+                    for i in range(available)
+                ]
+                self.truncated_buffers = (self.overflowed_buffers - overflowed_start) & mask
+                yield batch
+
+                # check if the gateware wrapped around while the batch was consumed
+                written, _ = self._completed_buffers()
+                overwritten = min(((written - next_packet) & mask) - readable, available)
+                if overwritten > 0:
+                    drop(overwritten)
+                next_packet = (next_packet + available) & mask
+
+        return batches(next_packet, last_progress)
 
-        buf = (self.current_write_buffer - 1) % self.n_buffers
-        base = getattr(self, f"buffer{buf}_base")
-        length = getattr(self, f"buffer{buf}_level")
+    @driver_method
+    def completed_buffers(self, timeout=None, raise_on_drop=False):
+        """
+        Returns a generator that yields (packet_number, memoryview) for every buffer the gateware completes from now on.
+        See completed_buffer_batches() for the parameters and the lifetime of the memoryviews.
+        """
+        batches = self.completed_buffer_batches(timeout, raise_on_drop)
+        return (buffer for batch in batches for buffer in batch)
+
+    @driver_method
+    def record_to_file(self, filename="recording.bin", n_packets=None, timeout=1):
+        """
+        Append every completed buffer to a file until n_packets were recorded or no buffer arrived for timeout seconds.
+        All buffers that are ready at once are written with a single writev() call straight from the ringbuffer.
+        (sendfile() can not be used since /dev/mem does not support it)
+        :return: the number of recorded packets
+        """
+        import os
+        recorded = 0
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        try:
+            for batch in self.completed_buffer_batches(timeout=timeout):
+                if n_packets is not None:
+                    batch = batch[:n_packets - recorded]
+                views = [view for _, view in batch]
+                to_write = sum(len(view) for view in views)
+                while to_write > 0:  # writev() may write less than requested
+                    written = os.writev(fd, views)
+                    to_write -= written
+                    while views and written >= len(views[0]):
+                        written -= len(views[0])
+                        views.pop(0)
+                    if views:
+                        views[0] = views[0][written:]
+                recorded += len(batch)
+                if recorded == n_packets:
+                    break
+        finally:
+            os.close(fd)
+        return recorded
 
-        fd = os.open("/dev/mem", os.O_RDONLY)
-        with mmap.mmap(fd, length, prot=mmap.PROT_READ, offset=base) as mm:
-            with open(filename, "wb") as f:
-                f.write(mm)
-        os.close(fd)
+    @driver_method
+    def read_packet_to_file(self, filename="packet.bin"):
+        buffer = (self.current_write_buffer - 1) % self.n_buffers
+        with open(filename, "wb") as f:
+            f.write(self._buffer_view(buffer))
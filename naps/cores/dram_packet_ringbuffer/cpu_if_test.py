@@ -0,0 +1,67 @@
+import unittest
+from . import DramPacketRingbufferCpuReader
+
+
+class FakeCpuReaderDriver:
+    """Emulates the pydriver of a DramPacketRingbufferCpuReader and the gateware that writes into the ringbuffer"""
+    n_buffers = 4
+    base_address = 0x1000
+    max_packet_size = 16
+
+    def __init__(self):
+        self.memory = bytearray(self.n_buffers * self.max_packet_size)
+        self.buffers_written = 0
+        self.current_write_buffer = 0
+        self.overflowed_buffers = 0
+        for i in range(self.n_buffers):
+            setattr(self, f"buffer{i}_base", self.base_address + i * self.max_packet_size)
+            setattr(self, f"buffer{i}_level", 0)
+
+    def complete_packet(self, data):
+        offset = self.current_write_buffer * self.max_packet_size
+        self.memory[offset:offset + len(data)] = data
+        setattr(self, f"buffer{self.current_write_buffer}_level", len(data))
+        self.current_write_buffer = (self.current_write_buffer + 1) % self.n_buffers
+        self.buffers_written += 1
+
+    def _buffers(self):
+        return memoryview(self.memory)
+
+
+for name in ["_buffer_view", "_completed_buffers", "completed_buffer_batches", "completed_buffers"]:
+    setattr(FakeCpuReaderDriver, name, getattr(DramPacketRingbufferCpuReader, name).function)
+
+
+class CpuReaderTest(unittest.TestCase):
+    def test_completed_buffers(self):
+        driver = FakeCpuReaderDriver()
+        driver.complete_packet(b"old")  # packets before the generator was started are not yielded
+        batches = driver.completed_buffer_batches(timeout=0)
+        driver.complete_packet(b"a")
+        driver.complete_packet(b"bb")
+        self.assertEqual([(n, bytes(view)) for n, view in next(batches)], [(1, b"a"), (2, b"bb")])
+        driver.complete_packet(b"c")
+        self.assertEqual([(n, bytes(view)) for n, view in next(batches)], [(3, b"c")])
+        self.assertEqual(list(batches), [])
+        self.assertEqual(driver.dropped_buffers, 0)
+
+    def test_dropped_buffers(self):
+        driver = FakeCpuReaderDriver()
+        batches = driver.completed_buffer_batches(timeout=0)
+        for i in range(6):
+            driver.complete_packet(bytes([i]))
+        # only n_buffers - 1 buffers survive; the oldest ones were overwritten
+        self.assertEqual([(n, bytes(view)) for n, view in next(batches)], [(3, b"\x03"), (4, b"\x04"), (5, b"\x05")])
+        self.assertEqual(driver.dropped_buffers, 3)
+
+        driver.complete_packet(b"x")  # this overwrites the buffer of packet 3 while the batch is still being used
+        self.assertEqual([(n, bytes(view)) for n, view in next(batches)], [(6, b"x")])
+        self.assertEqual(driver.dropped_buffers, 4)
+
+    def test_raise_on_drop(self):
+        driver = FakeCpuReaderDriver()
+        buffers = driver.completed_buffers(timeout=0, raise_on_drop=True)
+        for i in range(5):
+            driver.complete_packet(bytes([i]))
+        with self.assertRaises(OverflowError):
+            next(buffers)
@@ -122,10 +122,10 @@ class HdmiStreamSource(Elaboratable):
         return m
 
     @driver_method
-    def train(self):
+    async def train(self):
         print("training hdmi")
         print("tranining lane b...")
-        _, delay, alignment = self.lane_b.train()
+        _, delay, alignment = await self.lane_b.train()
         self.set_delay(delay)
         self.lane_g.select.offset = alignment
         self.lane_r.select.offset = alignment
@@ -191,9 +191,9 @@ class HdmiRxLane(Elaboratable):
         return m
 
     @driver_method
-    def train(self, start=0, step=10, n=13, fine_training=False):
+    async def train(self, start=0, step=10, n=13, fine_training=False):
         self.delayf.set_delay(start)
-        from time import sleep
+        from asyncio import sleep
         best = (0.0, 0, 0)
         for i in range(n):
             delay = i * step + start
@@ -202,7 +202,7 @@ class HdmiRxLane(Elaboratable):
             for alignment in range(9):
                 self.select.offset = alignment
                 hit_before = self.blankings_hit
-                sleep(0.1)
+                await sleep(0.1)
                 hit = self.blankings_hit - hit_before
                 if hit > best[0]:
                     best = (hit, delay, alignment)
@@ -216,7 +216,7 @@ class HdmiRxLane(Elaboratable):
         self.select.offset = alignment
         if fine_training:
             if hits != 0:
-                return self.train(start=delay - 10, step=1, n=20, fine_training=False)
+                return await self.train(start=delay - 10, step=1, n=20, fine_training=False)
             else:
                 print("failed training")
         else:
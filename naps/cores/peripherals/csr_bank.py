@@ -4,6 +4,7 @@ from amaranth import *
 from amaranth import Signal
 from naps.soc import MemoryMap, Response, Peripheral
 from naps.soc.csr_types import StatusSignal, ControlSignal, EventReg, _Csr
+from naps.util.past import NewHere
 
 __all__ = ["CsrBank"]
 
@@ -18,54 +19,67 @@ class CsrBank(Elaboratable):
         writable = not isinstance(signal, StatusSignal)
         self.memorymap.allocate(name, writable, bits=len(signal), address=signal._address, obj=signal)
 
+    def word_table(self):
+        """
+        Precompute which fields live in which bus word.
+        :return: a dict of word_address -> [(row, word_range, signal_range), ...] sorted by the word address
+        """
+        table = {}
+        word_bytes = self.memorymap.bus_word_width_bytes
+        for row in self.memorymap.direct_children:
+            if not isinstance(row.obj, (ControlSignal, StatusSignal, EventReg)):
+                raise NotImplementedError()
+            address_range = row.address.range()
+            first_word = address_range.start // word_bytes * word_bytes
+            for word_address in range(first_word, address_range.stop, word_bytes):
+                bits_of_word = row.address.bits_of_word(word_address)
+                if bits_of_word:
+                    table.setdefault(word_address, []).append((row, *bits_of_word))
+        return dict(sorted(table.items()))
+
     def elaborate(self, platform):
-        handled = Signal()
+        word_table = self.word_table()
 
         def handle_read(m, addr, data, read_done):
-            for iter_addr in range(0, self.memorymap.byte_len + 1, self.memorymap.bus_word_width_bytes):
-                with m.If(iter_addr == addr):
-                    for row in self.memorymap.direct_children:
-                        bits_of_word = row.address.bits_of_word(iter_addr)
-                        if bits_of_word:
-                            word_range, signal_range = bits_of_word
+            # the selected word is captured into read_word in the first cycle of the access and handed to the bus
+            # in the next one. this keeps the address decoding out of the path of the bus data.
+            read_word = Signal(self.memorymap.bus_word_width)
+            first_cycle = NewHere(m)
+            with m.Switch(addr):
+                for word_address, fields in word_table.items():
+                    with m.Case(word_address):
+                        for row, word_range, signal_range in fields:
                             if isinstance(row.obj, (ControlSignal, StatusSignal)):
-                                m.d.sync += data[word_range.start:word_range.stop].eq(
+                                m.d.sync += read_word[word_range.start:word_range.stop].eq(
                                     row.obj[signal_range.start:signal_range.stop]
                                 )
-                                read_done(Response.OK)
-                                m.d.comb += handled.eq(1)
+                                with m.If(~first_cycle):
+                                    m.d.sync += data[word_range.start:word_range.stop].eq(
+                                        read_word[word_range.start:word_range.stop]
+                                    )
+                                    read_done(Response.OK)
                             elif isinstance(row.obj, EventReg):
                                 row.obj.handle_read(m, data[word_range.start:word_range.stop], read_done)
-                                m.d.comb += handled.eq(1)
-                            else:
-                                raise NotImplementedError()
-            with m.If(~handled):
-                read_done(Response.ERR)
+                with m.Default():
+                    read_done(Response.ERR)
 
         def handle_write(m, addr, data, write_done):
-            handled = Signal()
-            for iter_addr in range(0, self.memorymap.byte_len + 1, self.memorymap.bus_word_width_bytes):
-                with m.If(iter_addr == addr):
-                    for row in self.memorymap.direct_children:
-                        bits_of_word = row.address.bits_of_word(iter_addr)
-                        if bits_of_word and row.writable:
-                            word_range, signal_range = bits_of_word
+            with m.Switch(addr):
+                for word_address, fields in word_table.items():
+                    writable_fields = [field for field in fields if field[0].writable]
+                    if not writable_fields:
+                        continue
+                    with m.Case(word_address):
+                        for row, word_range, signal_range in writable_fields:
                             if isinstance(row.obj, ControlSignal):
                                 m.d.sync += row.obj[signal_range.start:signal_range.stop].eq(
                                     data[word_range.start:word_range.stop]
                                 )
                                 write_done(Response.OK)
-                                m.d.comb += handled.eq(1)
-                            elif isinstance(row.obj, StatusSignal):
-                                write_done(Response.OK)
-                                m.d.comb += handled.eq(1)
                             elif isinstance(row.obj, EventReg):
                                 row.obj.handle_write(m, data[word_range.start:word_range.stop], write_done)
-                                m.d.comb += handled.eq(1)
-                            else:
-                                raise NotImplementedError()
-            with m.If(~handled):
-                write_done(Response.ERR)
+                with m.Default():
+                    write_done(Response.ERR)
 
         m = Module()
         m.submodules += Peripheral(handle_read, handle_write, self.memorymap, self.name)
@@ -0,0 +1,60 @@
+import unittest
+
+from amaranth import *
+from naps import SimPlatform, SimSocPlatform, ControlSignal, StatusSignal, CsrBank, do_nothing
+from naps.soc.tracing_elaborate import get_module
+
+
+class CsrBankTest(unittest.TestCase):
+    def test_with_driver(self):
+        platform = SimSocPlatform(SimPlatform())
+
+        class Top(Elaboratable):
+            def __init__(self):
+                self.wide = ControlSignal(48)
+                self.narrow = ControlSignal(4)
+                self.sum = StatusSignal(49)
+
+            def elaborate(self, platform):
+                m = Module()
+                m.d.comb += self.sum.eq(self.wide + self.narrow)
+                return m
+
+        def driver(design):
+            design.wide = 0xABCD_1234_5678
+            design.narrow = 0x5
+            yield from do_nothing(10)
+            self.assertEqual(design.wide, 0xABCD_1234_5678)
+            self.assertEqual(design.narrow, 0x5)
+            self.assertEqual(design.sum, 0xABCD_1234_567D)
+            design.narrow = 0xF
+            yield from do_nothing(10)
+            self.assertEqual(design.sum, 0xABCD_1234_5687)
+        platform.add_driver(driver)
+
+        platform.sim(Top())
+
+    def test_word_table(self):
+        csr_bank = CsrBank(["test"])
+        csr_bank.reg("wide", ControlSignal(48))
+        csr_bank.reg("status", StatusSignal(8))
+        table = csr_bank.word_table()
+        self.assertEqual(list(table.keys()), [0x0, 0x4, 0x8])
+        self.assertEqual([row.name for row, _, _ in table[0x4]], ["wide"])
+        self.assertEqual([row.name for row, _, _ in table[0x8]], ["status"])
+
+    def test_many_csrs(self):
+        csr_bank = CsrBank(["test"])
+        for i in range(2000):
+            csr_bank.reg(f"csr{i}", ControlSignal(32) if i % 2 else StatusSignal(32))
+        table = csr_bank.word_table()
+        self.assertEqual(list(table.keys()), [i * 4 for i in range(2000)])
+        self.assertEqual([row.name for row, _, _ in table[0x4 * 1999]], ["csr1999"])
+
+        # the read and write handlers of all the words elaborate
+        fragment = Fragment.get(csr_bank, None)
+        peripheral = next(get_module(f).peripheral for f, _name, _src_loc in fragment.subfragments)
+        m = Module()
+        peripheral.handle_read(m, Signal(32), Signal(32), lambda response: None)
+        peripheral.handle_write(m, Signal(32), Signal(32), lambda response: None)
+        Fragment.get(m, None)
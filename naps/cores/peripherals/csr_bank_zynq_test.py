@@ -1,5 +1,5 @@
 import unittest
-from naps import AxiEndpoint, axil_read, axil_write, CsrBank, ControlSignal, ZynqSocPlatform, SimPlatform, do_nothing
+from naps import AxiEndpoint, axil_read, axil_write, axi_read_burst, axi_write_burst, AxiResponse, CsrBank, ControlSignal, ZynqSocPlatform, SimPlatform, do_nothing
 
 
 class TestAxiSlave(unittest.TestCase):
@@ -24,6 +24,20 @@ class TestAxiSlave(unittest.TestCase):
     def test_csr_bank_interconnect(self):
         self.check_csr_bank(use_axi_interconnect=True)
 
+    def test_csr_bank_crossbar(self, num_csr=10, testdata=0x12345678):
+        platform = ZynqSocPlatform(SimPlatform(), use_axi_crossbar=True)
+        csr_bank = CsrBank("test")
+        for i in range(num_csr):
+            csr_bank.reg("csr#{}".format(i), ControlSignal(32))
+
+        def testbench():
+            axi = platform.axi_full_master
+            for addr in [0x4000_0000 + (i * 4) for i in range(num_csr)]:
+                self.assertEqual((yield from axi_write_burst(axi, addr, [testdata])), (AxiResponse.OKAY.value, 0))
+                self.assertEqual((yield from axi_read_burst(axi, addr, 1)), [(testdata, AxiResponse.OKAY.value, 0)])
+
+        platform.sim(csr_bank, (testbench, "axi_lite"))
+
     def test_simple_test_csr_bank(self):
         platform = ZynqSocPlatform(SimPlatform())
         csr_bank = CsrBank("test")
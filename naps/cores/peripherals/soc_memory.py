@@ -60,6 +60,28 @@ class SocMemory(Elaboratable):
         else:
             write_done(Response.ERR)
 
+    def handle_read_pipelined(self, m, addr, en):
+        addr = addr[2:]
+        m.d.comb += self.read_port.addr.eq(addr // self.split_stages)
+        m.d.comb += self.read_port.en.eq(en)
+        if self.split_stages == 1:
+            return self.read_port.data
+        lane = Signal(range(self.split_stages))
+        with m.If(en):
+            m.d.sync += lane.eq(addr % self.split_stages)
+        padded = Cat(self.read_port.data, C(0, 32 * self.split_stages - len(self.read_port.data)))
+        return padded.word_select(lane, 32)
+
+    def handle_write_pipelined(self, m, addr, data, en):
+        addr = addr[2:]
+        m.d.comb += self.write_port.addr.eq(addr // self.split_stages)
+        m.d.comb += self.write_port.data.eq(data.replicate(self.split_stages))
+        with m.If(en):
+            if self.split_stages == 1:
+                m.d.comb += self.write_port.en.eq(1)
+            else:
+                m.d.comb += self.write_port.en.eq(C(1, self.split_stages) << (addr % self.split_stages))
+
     def elaborate(self, platform):
         if not isinstance(platform, SocPlatform):
             return self.memory
@@ -71,7 +93,9 @@ class SocMemory(Elaboratable):
         m.submodules += Peripheral(
             self.handle_read,
             self.handle_write,
-            memorymap
+            memorymap,
+            handle_read_pipelined=self.handle_read_pipelined if self.soc_read else None,
+            handle_write_pipelined=self.handle_write_pipelined if self.soc_write else None,
         )
         m.submodules.backing = self.memory
 
@@ -83,8 +107,37 @@ class SocMemory(Elaboratable):
     def write_port(self, *args, **kwargs):
         return self.memory.write_port(*args, **kwargs)
 
+    @driver_method
+    def read_range(self, start, stop):
+        """Read the memory words start..stop-1 with one block transfer"""
+        n = max(stop - start, 0)
+        base_address = self.memory.address - self._memory_accessor.base + 4*start * self.split_stages
+        words = self._memory_accessor.read_block(base_address, n * self.split_stages).tolist()
+        if self.split_stages == 1:
+            return words
+        return [
+            sum(words[i * self.split_stages + j] << (32 * j) for j in range(self.split_stages))
+            for i in range(n)
+        ]
+
+    @driver_method
+    def write_range(self, start, values):
+        """Write the values to the memory words starting at start with one block transfer"""
+        assert start + len(values) <= self.depth, "the written values do not fit into the memory"
+        base_address = self.memory.address - self._memory_accessor.base + 4*start * self.split_stages
+        if self.split_stages == 1:
+            words = values
+        else:
+            words = [(v >> (32 * j)) & 0xFFFFFFFF for v in values for j in range(self.split_stages)]
+        self._memory_accessor.write_block(base_address, words)
+
     @driver_method
     def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.depth)
+            assert step == 1, "only contiguous slices of SocMemory can be read"
+            return self.read_range(start, stop)
+
         base_address = self.memory.address - self._memory_accessor.base + 4*item * self.split_stages
         value = 0
         for i in range(self.split_stages):
@@ -94,6 +147,13 @@ class SocMemory(Elaboratable):
 
     @driver_method
     def __setitem__(self, item, value):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.depth)
+            assert step == 1, "only contiguous slices of SocMemory can be written"
+            assert len(value) == max(stop - start, 0), "the length of the written values must match the slice"
+            self.write_range(start, value)
+            return
+
         base_address = self.memory.address - self._memory_accessor.base + 4*item * self.split_stages
         for i in range(self.split_stages):
             write = (value >> (32 * i)) & 0xFFFFFFFF
@@ -1,6 +1,8 @@
 import unittest
 
-from naps import SimPlatform, SocMemory, axil_read, axil_write, do_nothing, SimSocPlatform
+from amaranth import *
+from naps import SimPlatform, SocMemory, axil_read, axil_write, axi_read_burst, axi_write_burst, do_nothing, SimSocPlatform
+from naps import AxiPeripheralConnector, AxiResponse, PERIPHERAL_DOMAIN
 from naps.soc.platform.zynq import ZynqSocPlatform
 
 
@@ -54,3 +56,49 @@ class SocMemoryTest(unittest.TestCase):
         platform.add_driver(driver)
 
         platform.sim(dut)
+
+    def test_block_access_with_driver(self):
+        platform = SimSocPlatform(SimPlatform())
+
+        memory_depth = 16
+        dut = SocMemory(shape=64, depth=memory_depth, init=[])
+
+        def driver(design):
+            design[2:10] = [i * i << 30 for i in range(8)]
+            yield from do_nothing(10)
+            self.assertEqual(design[2:10], [i * i << 30 for i in range(8)])
+            self.assertEqual(design[4], 4 << 30)
+            self.assertEqual(design[14:], [0, 0])
+        platform.add_driver(driver)
+
+        platform.sim(dut)
+
+    def test_axi_burst(self):
+        platform = SimPlatform()
+        memory_depth = 16
+        dut = SocMemory(shape=64, depth=memory_depth, init=[])
+
+        class BurstPeripheral:
+            handle_read_pipelined = dut.handle_read_pipelined
+            handle_write_pipelined = dut.handle_write_pipelined
+
+            def range(self):
+                return range(0x1000, 0x1000 + memory_depth * 8)
+
+        connector = DomainRenamer(PERIPHERAL_DOMAIN)(AxiPeripheralConnector(BurstPeripheral(), id_bits=4))
+        m = Module()
+        m.submodules.memory = dut
+        m.submodules.connector = connector
+
+        def testbench():
+            axi = connector.axi
+            data = [i * 0x0101_0101 for i in range(2 * memory_depth)]
+            self.assertEqual((yield from axi_write_burst(axi, 0x1000, data, id=3)), (AxiResponse.OKAY.value, 3))
+            beats = yield from axi_read_burst(axi, 0x1000, 16, id=2)
+            self.assertEqual(beats, [(value, AxiResponse.OKAY.value, 2) for value in data[:16]])
+            beats = yield from axi_read_burst(axi, 0x1000 + memory_depth * 8 - 8, 3, id=1)
+            self.assertEqual([resp for _, resp, _ in beats], [AxiResponse.OKAY.value] * 2 + [AxiResponse.SLVERR.value])
+            self.assertEqual([value for value, _, _ in beats[:2]], data[-2:])
+
+        platform.add_sim_clock(PERIPHERAL_DOMAIN, 10e6)
+        platform.sim(m, (testbench, PERIPHERAL_DOMAIN))
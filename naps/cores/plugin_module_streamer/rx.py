@@ -58,20 +58,16 @@ class PluginModuleStreamerRx(Elaboratable):
         return DomainRenamer(domain)(m)
 
     @driver_method
-    def train(self, timeout=32):
+    async def train(self, timeout=32):
+        from asyncio import gather
         self.lane0.delay = 15
         print("doing word alignment...")
         for i in range(timeout):
             if self.lane0.output == 0b00010110:
                 print("-> {} slips".format(i))
-                print("training lane 0...")
-                self.lane0.train()
-                print("training lane 1...")
-                self.lane1.train()
-                print("training lane 2...")
-                self.lane2.train()
-                print("training lane 3...")
-                self.lane3.train()
+                print("training lanes...")
+                # the lanes are independent of each other so we can train them concurrently
+                await gather(self.lane0.train(), self.lane1.train(), self.lane2.train(), self.lane3.train())
                 self.trained = True
                 return
             else:
@@ -148,8 +144,8 @@ class LaneBitAligner(Elaboratable):
         return m
 
     @driver_method
-    def train(self):
-        from time import sleep
+    async def train(self):
+        from asyncio import sleep
         start_current = 0
         start_longest = 0
         len_longest = 0
@@ -157,7 +153,7 @@ class LaneBitAligner(Elaboratable):
         for i in range(32):
             self.delay = i
             e_start = self.error
-            sleep(0.01)
+            await sleep(0.01)
             difference = self.error - e_start
             if difference == 0 and not was_good:
                 start_current = i
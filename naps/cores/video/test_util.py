@@ -1,38 +1,50 @@
-from random import Random
-from naps import write_to_stream, read_from_stream, do_nothing
-
-__all__ = ["write_frame_to_stream", "read_frame_from_stream", "to_8bit_rgb", "crop"]
-
-
-def write_frame_to_stream(stream, frame, timeout=100, pause=False):
-    random = Random(0)
-    for y, line in enumerate(frame):
-        for x, px in enumerate(line):
-            if (random.random() < 0.3) and pause:
-                yield from do_nothing()
-            yield from write_to_stream(
-                stream, payload=int(px),
-                timeout=timeout,
-                line_last=(x == (len(line) - 1)),
-                frame_last=(y == (len(frame) - 1)) & (x == (len(line) - 1)),
-            )
-        if (random.random() < 0.3) and pause:
-            yield from do_nothing()
-
-
-def read_frame_from_stream(stream, timeout=100, pause=False):
-    random = Random(1)
-    frame = [[]]
-    while True:
-        if (random.random() < 0.3) and pause:
-            yield from do_nothing()
-        px, line_last, frame_last = (yield from read_from_stream(stream, timeout=timeout,
-                                                                 extract=("payload", "line_last", "frame_last")))
-        frame[-1].append(px)
-        if frame_last:
-            return frame
-        if line_last:
-            frame.append([])
+from naps import write_arrays_to_stream, read_arrays_from_stream
+
+__all__ = ["write_frame_to_stream", "read_frame_from_stream", "read_frame_array_from_stream", "to_8bit_rgb", "crop"]
+
+PAUSE_PROBABILITY = 0.3
+
+
+def write_frame_to_stream(stream, frame, timeout=100, pause=False, seed=0):
+    """Writes a frame (a 2d numpy array or a list of lines) to an ImageStream. Returns the StreamTransfers."""
+    import numpy as np
+    frame = np.asarray(frame)
+    height, width = frame.shape[:2]
+    line_last = np.zeros((height, width), dtype=bool)
+    line_last[:, -1] = True
+    frame_last = np.zeros((height, width), dtype=bool)
+    frame_last[-1, -1] = True
+    return (yield from write_arrays_to_stream(
+        stream, timeout=timeout, pause_probability=PAUSE_PROBABILITY if pause else 0, seed=seed,
+        payload=frame.reshape(height * width), line_last=line_last.ravel(), frame_last=frame_last.ravel(),
+    ))
+
+
+def _read_frame(stream, timeout, pause, seed):
+    transfers = yield from read_arrays_from_stream(
+        stream, fields=("payload", "line_last"), until="frame_last", timeout=timeout,
+        pause_probability=PAUSE_PROBABILITY if pause else 0, seed=seed,
+    )
+    line_ends = transfers["line_last"].nonzero()[0] + 1
+    if len(line_ends) == 0 or line_ends[-1] != len(transfers):
+        line_ends = [*line_ends, len(transfers)]
+    return transfers["payload"], line_ends
+
+
+def read_frame_from_stream(stream, timeout=100, pause=False, seed=1):
+    """Reads a frame from an ImageStream as a list of lines (which can have different lengths)"""
+    payload, line_ends = yield from _read_frame(stream, timeout, pause, seed)
+    line_starts = [0, *line_ends[:-1]]
+    return [payload[start:end].tolist() for start, end in zip(line_starts, line_ends)]
+
+
+def read_frame_array_from_stream(stream, timeout=100, pause=False, seed=1):
+    """Reads a frame from an ImageStream as a 2d numpy array; all lines must have the same length"""
+    payload, line_ends = yield from _read_frame(stream, timeout, pause, seed)
+    width = line_ends[0]
+    if any(end != (i + 1) * width for i, end in enumerate(line_ends)):
+        raise ValueError(f"the lines of the frame have different lengths (line ends at {list(line_ends)})")
+    return payload.reshape(len(line_ends), width)
 
 
 def to_8bit_rgb(image_24bit):
@@ -0,0 +1,153 @@
+# Elaborates (or builds) many applet / device / soc combinations in parallel.
+#
+# The applets are imported once in the orchestrating process. Every target is then elaborated in a freshly forked
+# worker so that the interpreter and the (expensive) imports of amaranth, naps and the applets are reused, while global
+# state (e.g. the FatbitstreamContext or the profiler) stays private to each target. The targets use the same build
+# directories as the cli, so the gateware cache is shared between both.
+
+import argparse
+import importlib.util
+import multiprocessing
+import sys
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from dataclasses import dataclass, field
+from io import StringIO
+from pathlib import Path
+from time import time
+from typing import List
+
+from .cli import SOC_PLATFORMS, make_platform, cli_build
+from ..util import profiler
+
+__all__ = ["BuildTarget", "BuildResult", "load_applet", "discover_targets", "batch_build"]
+
+
+@dataclass(frozen=True)
+class BuildTarget:
+    path: Path
+    device: str
+    soc: str
+
+    def __str__(self):
+        return f"{self.path.stem}_{self.device}_{self.soc}"
+
+
+@dataclass
+class BuildResult:
+    target: BuildTarget
+    success: bool
+    output: str
+    spans: List[profiler.SpanRecord] = field(default_factory=list)
+    elapsed: float = 0
+
+
+def _module_name(path: Path):
+    return f"_naps_applet_{path.resolve().as_posix().replace('/', '_').replace('.', '_')}"
+
+
+def load_applet(path: Path):
+    """Imports an applet (without running its cli) or returns the already imported module"""
+    name = _module_name(path)
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[name]
+            raise
+    return sys.modules[name]
+
+
+def discover_targets(paths) -> List[BuildTarget]:
+    """Finds all device / soc combinations (including the plain platform without soc) an applet can be built for"""
+    targets = []
+    for path in paths:
+        top = load_applet(Path(path)).Top
+        for hardware_platform in top.runs_on:
+            device = hardware_platform.__name__.replace("Platform", "")
+            for soc_name in ["Plain", *SOC_PLATFORMS.keys()]:
+                if not isinstance(make_platform(top, hardware_platform, soc_name), str):
+                    targets.append(BuildTarget(Path(path), device, soc_name))
+    return targets
+
+
+def _run_target(target: BuildTarget, build: bool, no_cache: bool, applet_modules: List[str]) -> BuildResult:
+    # the other applets are not part of this target and would otherwise change the source cache key of the cli
+    for name in applet_modules:
+        if name != _module_name(target.path):
+            sys.modules.pop(name, None)
+
+    output = StringIO()
+    profiler.reset()
+    start = time()
+    success = True
+    with redirect_stdout(output), redirect_stderr(output):
+        try:
+            top = load_applet(target.path).Top
+            hardware_platform = {p.__name__.replace("Platform", ""): p for p in top.runs_on}[target.device]
+            platform = make_platform(top, hardware_platform, target.soc)
+            if isinstance(platform, str):
+                raise ValueError(platform)
+            cli_build(
+                top, target.path, platform, target.device, target.soc, elaborate=True, build=build, no_cache=no_cache
+            )
+        except BaseException:
+            traceback.print_exc()
+            success = False
+        finally:
+            profiler.end_task()
+    return BuildResult(target, success, output.getvalue(), profiler.records(), time() - start)
+
+
+def batch_build(targets: List[BuildTarget], build=False, no_cache=False, jobs=None, report=True) -> List[BuildResult]:
+    """
+    Elaborates (and with build=True builds) all targets in a pool of forked worker processes.
+    The spans recorded by the profiler in the workers are added to the profiler of this process (nested under the
+    name of the target) so that e.g. a chrome trace of the whole batch can be written with profiler.write_chrome_trace().
+    :param no_cache: elaborate and build the targets even if their sources or gateware did not change
+    :param jobs: the number of parallel workers. Defaults to the number of cpus.
+    :param report: print a per target timing report
+    :return: the results in the order of the targets
+    """
+    applet_modules = [_module_name(target.path) for target in targets]
+    for target in targets:
+        load_applet(target.path)
+
+    # every target gets a freshly forked worker (maxtasksperchild=1) that inherits the already imported modules
+    context = multiprocessing.get_context("fork")
+    with context.Pool(processes=jobs, maxtasksperchild=1) as pool:
+        results = pool.starmap(
+            _run_target, [(target, build, no_cache, applet_modules) for target in targets], chunksize=1
+        )
+
+    for result in results:
+        profiler.add_records(result.spans, prefix=(str(result.target),))
+        if report:
+            print(f"\n### {result.target}: {'ok' if result.success else 'FAILED'} after {result.elapsed:.2f} s")
+            print(profiler.format_summary(result.spans))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="elaborates or builds many applets for all their targets in parallel")
+    parser.add_argument('applets', nargs="+", type=Path, help='the applet files or directories containing applets')
+    parser.add_argument('-b', '--build', help='also build the gateware & assemble the fatbitstreams', action="store_true")
+    parser.add_argument('--no_cache', help='elaborate & build even if nothing changed since the last build',
+                        action="store_true")
+    parser.add_argument('-j', '--jobs', help='the number of parallel workers', type=int, default=None)
+    parser.add_argument('--profile', help='write a chrome trace of all targets to the given file', type=Path)
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.applets:
+        paths += sorted(p for p in path.glob("**/*.py") if not p.stem.startswith("_")) if path.is_dir() else [path]
+    results = batch_build(discover_targets(paths), build=args.build, no_cache=args.no_cache, jobs=args.jobs)
+    if args.profile:
+        profiler.write_chrome_trace(args.profile)
+    for result in results:
+        if not result.success:
+            print(f"\n### {result.target} failed:\n{result.output}")
+    exit(0 if all(result.success for result in results) else 1)
@@ -0,0 +1,43 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+
+from .batch_build import discover_targets, batch_build, BuildTarget
+from ..util import profiler
+
+APPLET = dedent("""
+    from amaranth import *
+    from naps import *
+
+
+    class Top(Elaboratable):
+        runs_on = [BetaRFWPlatform]
+
+        def elaborate(self, platform):
+            m = Module()
+            {body}
+            return m
+""")
+
+
+class BatchBuildTest(unittest.TestCase):
+    def test_elaborate(self):
+        self.addCleanup(profiler.reset)
+        with TemporaryDirectory() as dir:
+            good = Path(dir) / "good.py"
+            good.write_text(APPLET.format(body="m.d.sync += Signal().eq(1)"))
+            bad = Path(dir) / "bad.py"
+            bad.write_text(APPLET.format(body="raise RuntimeError('broken applet')"))
+
+            targets = discover_targets([good, bad])
+            self.assertEqual(
+                targets,
+                [BuildTarget(path, "BetaRFW", soc) for path in [good, bad] for soc in ["Plain", "JTAG"]]
+            )
+
+            results = batch_build(targets, jobs=2, report=False)
+            self.assertEqual([result.target for result in results], targets)
+            self.assertEqual([result.success for result in results], [True, True, False, False])
+            self.assertIn("broken applet", results[-1].output)
+            self.assertIn(("elaboration",), [record.path for record in results[0].spans])
@@ -4,41 +4,99 @@ import inspect
 import sys
 import os
 import shlex
+import subprocess
 import hashlib
+import sysconfig
+from importlib.metadata import version, PackageNotFoundError
 from pathlib import Path
-from shutil import rmtree
-from textwrap import indent
+from shutil import rmtree, copyfile
 from datetime import timedelta
 
 from amaranth import Fragment
+from amaranth.back import rtlil, verilog
 from amaranth.vendor import LatticePlatform
-from amaranth.build.run import LocalBuildProducts, BuildPlan
+from amaranth.build.run import BuildPlan
 
 __all__ = ["cli"]
 
-from . import FatbitstreamContext
+from . import FatbitstreamContext, read_fatbitstream_manifest, missing_blobs, BuildDirProducts
 from .soc_platform import SocPlatform, soc_platform_name
 from .platform import JTAGSocPlatform, ZynqSocPlatform
-from ..util import timer
-
-
-def fragment_repr(original: Fragment):
-    attrs_str = "\n"
-    for attr in ['statements', 'attrs', 'generated']:
-        attrs_str += f"{attr}={repr(getattr(original, attr))},\n"
-
-    domains_str = "\n"
-    for name, domain in original.domains.items():
-        # TODO: this is not really sound because domains could be non local
-        domains_str += f"{name}: {domain.name}\n"
-    attrs_str += f"domains={{{indent(domains_str, '  ')}}},\n"
-
-    children_str = "\n"
-    for child, name, _src_loc in original.subfragments:
-        children_str += f"[{name}, {fragment_repr(child)}]\n"
-    attrs_str += f"children=[{indent(children_str, '  ')}],\n"
-
-    return f"Fragment({indent(attrs_str, '  ')})"
+from ..util import profiler
+from ..util.fragment_hash import fragment_hash, FragmentHash
+
+
+def print_gateware_changes(design_hash: FragmentHash, gateware_dir: Path, max_lines=10):
+    """Tells which fragments changed compared to the most recently used gateware build (if any)"""
+    previous_builds = sorted(
+        gateware_dir.glob("*/cache_key.txt") if gateware_dir.exists() else [], key=lambda p: p.stat().st_atime
+    )
+    if not previous_builds:
+        print("no previous build. rebuilding...")
+        return
+    try:
+        changes = design_hash.changed_fragments(FragmentHash.deserialize(previous_builds[-1].read_text()))
+    except ValueError:  # cache keys of older naps versions
+        changes = []
+    print("gateware changed. rebuilding...")
+    for path, change in changes[:max_lines]:
+        print(f"  {change}: {path}")
+    if len(changes) > max_lines:
+        print(f"  ... and {len(changes) - max_lines} more")
+
+
+def source_cache_key(caller_file: Path, *build_args):
+    """
+    Computes a cache key for a build without elaborating the design. It covers all files of naps, all loaded
+    modules that are not part of python or an installed package (e.g. the applet), the versions of the amaranth
+    packages and the arguments of the build.
+    """
+    import naps
+
+    hasher = hashlib.sha256()
+    hasher.update(f"python={sys.version}\n".encode())
+    for package in ["amaranth", "amaranth-boards"]:
+        try:
+            package_version = version(package)
+        except PackageNotFoundError:
+            package_version = None
+        hasher.update(f"{package}={package_version}\n".encode())
+    hasher.update(f"{build_args!r}\n".encode())
+
+    installed = [Path(path).resolve() for name, path in sysconfig.get_paths().items() if name.endswith("lib")]
+    naps_dir = Path(naps.__file__).parent.resolve()
+    files = {caller_file.resolve()}
+    files |= {  # we include the files that are not python modules (e.g. yosys sources or memorymap definitions)
+        path for path in naps_dir.rglob("*")
+        if path.is_file() and not any(part.startswith((".", "__")) for part in path.relative_to(naps_dir).parts[:-1])
+    }
+    for module in list(sys.modules.values()):
+        if (module_file := getattr(module, "__file__", None)) is not None and module_file.endswith(".py"):
+            module_path = Path(module_file).resolve()
+            if not any(module_path.is_relative_to(path) for path in installed):
+                files.add(module_path)
+
+    for path in sorted(files):
+        if path.exists():
+            hasher.update(f"{path}\n".encode())
+            hasher.update(path.read_bytes())
+    return hasher.hexdigest()
+
+
+def execute_build_plan_profiled(build_plan: BuildPlan, root):
+    """
+    Like BuildPlan.execute_local() but runs every command of the build script on its own to profile it in a span.
+    """
+    build_dir = Path(build_plan.extract(root))
+    script = (build_dir / f"{build_plan.script}.sh").read_text().splitlines()
+    # the first lines of the script set up the environment; they are repeated before every command
+    preamble = [line for line in script if line.startswith(("#", "set ", "[ -n ", ": ${"))]
+    commands = [line for line in script if line.strip() and line not in preamble]
+    for command in commands:
+        tool = command.split()[0].strip('"${}').lower()
+        with profiler.span(f"toolchain {tool}", command=command):
+            subprocess.check_call(["sh", "-c", "\n".join([*preamble, command])], cwd=build_dir)
+    return BuildDirProducts(build_dir)
 
 
 def cli(top_class):
@@ -53,6 +111,7 @@ def cli(top_class):
     parser.add_argument('-r', '--run', help='run the pydriver shell after programming', action="store_true")
     parser.add_argument('-g', '--gc', help='oldest cached bitstream to keep', type=str, default="14d",
                         dest="gc_interval")
+    parser.add_argument('--profile', help='write a chrome trace of the build steps to the given file', type=Path)
 
     platform_choices = {plat.__name__.replace("Platform", ""): plat for plat in top_class.runs_on}
     default = list(platform_choices.keys())[0] if len(platform_choices) == 1 else None
@@ -90,115 +149,184 @@ def cli(top_class):
                 )
                 for c in cache_keys[3:]:
                     if c[1] < gc_cutoff:
-                        rmtree(c[0])
-
-    hardware_platform = platform_choices[args.device]
-    hardware_platform_args = {}
-    platform = hardware_platform(**hardware_platform_args)
-
-    if args.soc == "None" or args.soc == "Plain" or args.soc is None:
-        pass
-    else:
-        socs = {"Zynq": ZynqSocPlatform, "JTAG": JTAGSocPlatform}
-        if args.soc not in socs:
-            print(f"{args.soc} is not a known SoC type")
-            exit(-1)
-        soc = socs[args.soc]
-        if not soc.can_wrap(platform):
-            print(f"{args.soc} cannot wrap platform {hardware_platform.__name__}")
-            exit(-1)
-        if hasattr(top_class, "soc_platform") and top_class.soc_platform != soc:
-            print(f"applet needs {top_class.soc_platform.__name__}")
-            exit(-1)
-        platform = soc(platform)
-    
-    caller_file = Path(inspect.stack()[1].filename)
-    name = caller_file.stem
-    build_dir = "build" / Path(f"{name}_{args.device}_{args.soc}")
-    fatbitstream_name = build_dir / f"{name}.zip"
+                        rmtree(c[0].parent)
+            sources_dir = dir / "sources"
+            if sources_dir.exists():
+                for source_key_path in sources_dir.iterdir():
+                    gateware_cache_key = gateware_dir / source_key_path.read_text().strip() / "cache_key.txt"
+                    if not gateware_cache_key.exists():
+                        source_key_path.unlink()
+            blob_dir = dir / "blobs"
+            if blob_dir.exists():
+                # blobs are shared between builds; we only keep the ones referenced by a surviving fatbitstream
+                referenced = set()
+                for fatbitstream in [*dir.glob("*.fatbitstream"), *dir.glob("gateware/*/fatbitstream")]:
+                    referenced.update(read_fatbitstream_manifest(fatbitstream).values())
+                for blob in blob_dir.iterdir():
+                    if blob.name not in referenced:
+                        blob.unlink()
 
     if not (args.program or args.build or args.elaborate or args.run):
         print("no action specified")
         parser.print_help(sys.stderr)
         exit(-1)
 
-    if args.elaborate or args.build:
-        timer.start_task("elaboration")
-        if isinstance(platform, SocPlatform):
-            elaborated = platform.prepare_soc(top_class())
-        else:
-            elaborated = Fragment.get(top_class(), platform)
+    hardware_platform = platform_choices[args.device]
+    platform = make_platform(top_class, hardware_platform, args.soc)
+    if isinstance(platform, str):
+        print(platform)
+        exit(-1)
+
+    caller_file = Path(inspect.stack()[1].filename)
+    cli_build(
+        top_class, caller_file, platform, args.device, args.soc,
+        elaborate=args.elaborate, build=args.build, program=args.program, run=args.run,
+        force_cache=args.force_cache, no_cache=args.no_cache,
+    )
+    if args.profile:
+        profiler.write_chrome_trace(args.profile)
+
+
+SOC_PLATFORMS = {"Zynq": ZynqSocPlatform, "JTAG": JTAGSocPlatform}
+
+
+def make_platform(top_class, hardware_platform, soc_name, hardware_platform_args=None):
+    """
+    Instantiates the hardware platform and wraps it in the requested soc platform.
+    :return: the platform or a string that describes why the combination is not possible
+    """
+    platform = hardware_platform(**(hardware_platform_args or {}))
+    if soc_name == "None" or soc_name == "Plain" or soc_name is None:
+        if hasattr(top_class, "soc_platform"):
+            return f"applet needs {top_class.soc_platform.__name__}"
+        return platform
+    if soc_name not in SOC_PLATFORMS:
+        return f"{soc_name} is not a known SoC type"
+    soc = SOC_PLATFORMS[soc_name]
+    if not soc.can_wrap(platform):
+        return f"{soc_name} cannot wrap platform {hardware_platform.__name__}"
+    if hasattr(top_class, "soc_platform") and top_class.soc_platform != soc:
+        return f"applet needs {top_class.soc_platform.__name__}"
+    return soc(platform)
+
+
+def cli_build(
+        top_class, caller_file: Path, platform, device: str, soc_name: str, *,
+        elaborate=False, build=False, program=False, run=False, force_cache=False, no_cache=False,
+        hardware_platform_args=None,
+):
+    """
+    Elaborates, builds and programs a design like the cli does. The build directory (and with it the gateware cache)
+    is `build/<caller_file stem>_<device>_<soc_name>` relative to the current working directory.
+    """
+    hardware_platform_args = hardware_platform_args or {}
+    name = caller_file.stem
+    build_dir = "build" / Path(f"{name}_{device}_{soc_name}")
+    fatbitstream_name = build_dir / f"{name}.fatbitstream"
+    blob_dir = build_dir / "blobs"
+
+    # if nothing changed since the last build we can skip the elaboration entirely and reuse the last fatbitstream
+    source_key_path = None
+    cached_gateware_dir = None
+    if build:
+        profiler.start_task("source hashing")
+        source_key = source_cache_key(caller_file, name, top_class.__qualname__, device, soc_name, hardware_platform_args)
+        source_key_path = build_dir / "sources" / source_key
+        if source_key_path.exists() and not no_cache:
+            gateware_build_dir = build_dir / "gateware" / source_key_path.read_text().strip()
+            cached_fatbitstream = gateware_build_dir / "fatbitstream"
+            if (gateware_build_dir / "cache_key.txt").exists() and cached_fatbitstream.exists() \
+                    and not missing_blobs(cached_fatbitstream, blob_dir):
+                cached_gateware_dir = gateware_build_dir
+
+    if (elaborate or build) and cached_gateware_dir is None:
+        profiler.start_task("elaboration")
+        # we profile the elaboration of the top level elaboratable and its direct submodules
+        with profiler.instrumented(Fragment, "get", lambda obj, platform: f"elaborate {type(obj).__name__}", max_depth=2):
+            if isinstance(platform, SocPlatform):
+                elaborated = platform.prepare_soc(top_class())
+            else:
+                elaborated = Fragment.get(top_class(), platform)
 
-    timer.end_task()
+    profiler.end_task()
 
-    if args.build:
+    if build and cached_gateware_dir is not None:
+        print("\n### skipping elaboration & build - sources did not change since the last build")
+        (cached_gateware_dir / "cache_key.txt").touch()  # mark the build as recently used for the garbage collection
+        copyfile(cached_gateware_dir / "fatbitstream", fatbitstream_name)
+        Path(fatbitstream_name).chmod(0o700)
+    elif build:
         needs_rebuild = True
-        elaborated_repr = fragment_repr(elaborated)
+        with profiler.span("design hashing"):
+            design_hash = fragment_hash(elaborated)
 
-        cache_hash = hashlib.sha256(elaborated_repr.encode()).hexdigest()
+        cache_hash = design_hash.digest
 
         gateware_build_dir = build_dir / "gateware" / cache_hash
         cache_key_path = gateware_build_dir / "cache_key.txt"
 
-        if cache_key_path.exists():
-            old_repr = cache_key_path.read_text()
-            if args.force_cache:
+        if cache_key_path.exists() and FragmentHash.deserialize(cache_key_path.read_text()).digest == cache_hash:
+            if force_cache:
                 print("not rebuilding gateware because of --force_cache")
-                needs_rebuild = False
             else:
-                if old_repr == elaborated_repr:
-                    print("\n### skipping build - gateware build is up to date")
-                    needs_rebuild = False
-                else:
-                    print("gateware changed. rebuilding...")
+                print("\n### skipping build - gateware build is up to date")
+            needs_rebuild = False
         else:
-            print("no previous build. rebuilding...")
+            print_gateware_changes(design_hash, build_dir / "gateware")
 
-        if args.no_cache:
+        if no_cache:
             needs_rebuild = True
 
         if needs_rebuild:
             if gateware_build_dir.exists():
                 rmtree(gateware_build_dir)
 
-            timer.start_task("platform.prepare (including rtlil generation & yosys verilog generation)")
-            build_plan: BuildPlan = platform.build(
-                elaborated,
-                name=name,
-                do_build=False,
-            )
+            profiler.start_task("platform.prepare (including rtlil generation & yosys verilog generation)")
+            with profiler.instrumented(rtlil, "convert_fragment", "rtlil generation"), \
+                    profiler.instrumented(verilog, "_convert_rtlil_text", "verilog generation"):
+                build_plan: BuildPlan = platform.build(
+                    elaborated,
+                    name=name,
+                    do_build=False,
+                )
 
             # build the gateware
-            timer.start_task("vendor toolchain build")
+            profiler.start_task("vendor toolchain build")
             
             if "NAPS_BUILD_DOCKER_IMAGE" in os.environ:
                 docker_image = os.environ["NAPS_BUILD_DOCKER_IMAGE"]
                 docker_args = shlex.split(os.environ["NAPS_BUILD_DOCKER_ARGS"])
-                build_products = build_plan.execute_local_docker(
-                    root=gateware_build_dir, image=docker_image, docker_args=docker_args
-                )
+                build_plan.execute_local_docker(root=gateware_build_dir, image=docker_image, docker_args=docker_args)
+                build_products = BuildDirProducts(gateware_build_dir)
             else:
-                build_products = build_plan.execute_local(gateware_build_dir)                
+                build_products = execute_build_plan_profiled(build_plan, gateware_build_dir)
 
             # we write the cache key file in the end also as a marking that the build was successful
-            cache_key_path.write_text(elaborated_repr)
+            cache_key_path.write_text(design_hash.serialize())
         else:
-            build_products = LocalBuildProducts(gateware_build_dir)
+            build_products = BuildDirProducts(gateware_build_dir)
 
-        # we always rebuild the fatbitstream
+        # we always regenerate the fatbitstream manifest; only the blobs that changed (e.g. the pydriver) are written
         with open(fatbitstream_name, "wb") as f:
             fc = FatbitstreamContext.get(platform)
             if isinstance(platform, SocPlatform):
-                fc.generate_fatbitstream(f, name, build_products)
+                fc.generate_fatbitstream(f, name, build_products, blob_dir)
         Path(fatbitstream_name).chmod(0o700)
 
-    timer.end_task()
+        # store the fatbitstream manifest alongside the gateware for the next build with the same sources.
+        # plain platforms have no fatbitstream, so their builds always elaborate (and use the gateware cache)
+        if isinstance(platform, SocPlatform):
+            copyfile(fatbitstream_name, gateware_build_dir / "fatbitstream")
+            source_key_path.parent.mkdir(exist_ok=True)
+            source_key_path.write_text(cache_hash)
+
+    profiler.end_task()
 
-    if args.program or args.run:
-        if not args.run:
-            timer.start_task("program")
+    if program or run:
+        if not run:
+            profiler.start_task("program")
         else:
             print("\n### programming & running design")
-        platform.program_fatbitstream(fatbitstream_name, run=args.run)
+        platform.program_fatbitstream(fatbitstream_name, run=run)
 
-    timer.end_task()
+    profiler.end_task()
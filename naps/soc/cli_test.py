@@ -0,0 +1,49 @@
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from amaranth import *
+from amaranth.build.run import BuildPlan
+
+from .cli import cli_build
+from ..util import profiler
+
+
+class Top(Elaboratable):
+    def __init__(self):
+        self.counter = Signal(8)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.sync += self.counter.eq(self.counter + 1)
+        return m
+
+
+class FakePlatform:
+    """A plain (non soc) platform whose toolchain build does nothing"""
+    def __init__(self):
+        self.builds = 0
+
+    def build(self, fragment, name, do_build):
+        self.builds += 1
+        plan = BuildPlan(script=f"build_{name}")
+        plan.add_file(f"build_{name}.sh", "true\n")
+        return plan
+
+
+class CliBuildTest(unittest.TestCase):
+    def test_plain_build_twice(self):
+        self.addCleanup(profiler.reset)
+        cwd = os.getcwd()
+        with TemporaryDirectory() as dir:
+            os.chdir(dir)
+            try:
+                platform = FakePlatform()
+                for _ in range(2):
+                    cli_build(Top, Path(__file__), platform, "Fake", "Plain", build=True)
+                # the second build hits the gateware cache
+                self.assertEqual(platform.builds, 1)
+                self.assertFalse((Path("build") / "cli_test_Fake_Plain" / "sources").exists())
+            finally:
+                os.chdir(cwd)
@@ -80,13 +80,16 @@ class ControlSignal(ValueCastable, _Csr):
 class StatusSignal(ValueCastable, _Csr):
     """ Just a Signal. Indicator, that it is for communicating the state to the outside world (i.e. can be read but not written from the outside)
         Is mapped as a CSR in case the design is build with a SocPlatform.
+        If interrupt is True, the platform raises an interrupt as long as the signal is not zero (if it supports that).
+        The pydriver can then wait for it without polling (see HardwareProxy.wait_for()).
     """
 
-    def __init__(self, shape=None, *, address=None, read_strobe=None, src_loc_at=0, **kwargs):
+    def __init__(self, shape=None, *, address=None, read_strobe=None, interrupt=False, src_loc_at=0, **kwargs):
         self._signal = Signal(shape, src_loc_at=src_loc_at+1, **kwargs, )
 
         self._address = Address.parse(address)
         self._read_strobe = read_strobe
+        self._interrupt = interrupt
 
     def as_value(self):
         return self._signal
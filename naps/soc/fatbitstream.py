@@ -1,13 +1,24 @@
 # Utils for generating "fatbitstreams" (files that contain loading-logic, a bitstream, initialization and maybe drivers)
+#
+# A fatbitstream is a small executable python script that contains a manifest of all the files it needs. The files
+# themselves are stored content-addressed (by their sha256) as blobs in a `blobs` directory next to the script. When
+# the script is executed, it materializes the files from the blobs into a directory named like the script and runs the
+# loading logic there. Blobs are shared between builds so only changed files have to be written or uploaded.
 import enum
+import hashlib
+import json
+import os
 import textwrap
 from enum import Enum
-from typing import BinaryIO, Union, Iterable
-from zipfile import ZipFile, ZIP_DEFLATED
+from pathlib import Path
+from typing import BinaryIO, TextIO, Union, Iterable, Dict
 
-__all__ = ["FatbitstreamContext", "File", "CommandPosition"]
+__all__ = [
+    "FatbitstreamContext", "File", "CommandPosition", "read_fatbitstream_manifest", "missing_blobs", "BuildDirProducts",
+    "build_product_file",
+]
 
-from amaranth.build.run import BuildProducts
+from amaranth.build.run import BuildProducts, LocalBuildProducts
 
 
 class CommandPosition(Enum):
@@ -17,11 +28,89 @@ class CommandPosition(Enum):
 
 
 class File:
-    def __init__(self, name, contents):
+    def __init__(self, name, contents: Union[str, bytes, Path]):
+        """
+        A file that is shipped with the fatbitstream.
+        :param contents: the contents as str or bytes or a Path of a file that is streamed into the blob store
+        """
         self.name = name
         self.contents = contents
 
 
+class BuildDirProducts(LocalBuildProducts):
+    """Build products in a local directory. Unlike amaranths LocalBuildProducts, the paths of the files are exposed."""
+    def __init__(self, root):
+        super().__init__(str(root))
+        self.root = Path(root)
+
+    def path(self, filename) -> Path:
+        return self.root / filename
+
+
+def build_product_file(build_products: BuildProducts, filename) -> Union[bytes, Path]:
+    """
+    :return: the Path of a build product if it is stored in a local directory (so that it is streamed into the blob
+             store without reading it into memory) or its contents otherwise
+    """
+    if isinstance(build_products, BuildDirProducts):
+        return build_products.path(filename)
+    return build_products.get(filename)
+
+
+BLOB_CHUNK_SIZE = 1 << 20
+
+
+def store_blob(blob_dir: Path, contents: Union[str, bytes, Path]) -> str:
+    """
+    Stores the contents in the content-addressed blob store if they are not already present.
+    :return: the sha256 hexdigest of the contents which is also the name of the blob
+    """
+    if isinstance(contents, str):
+        contents = contents.encode()
+    blob_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = blob_dir / f".tmp_{os.getpid()}"
+    if isinstance(contents, (bytes, bytearray, memoryview)):
+        digest = hashlib.sha256(contents).hexdigest()
+        if not (blob_dir / digest).exists():
+            tmp_path.write_bytes(contents)
+            tmp_path.replace(blob_dir / digest)
+        return digest
+
+    hasher = hashlib.sha256()
+    with open(contents, "rb") as source, open(tmp_path, "wb") as destination:
+        while chunk := source.read(BLOB_CHUNK_SIZE):
+            hasher.update(chunk)
+            destination.write(chunk)
+    digest = hasher.hexdigest()
+    if (blob_dir / digest).exists():
+        tmp_path.unlink()
+    else:
+        tmp_path.replace(blob_dir / digest)
+    return digest
+
+
+MANIFEST_PREFIX = "MANIFEST = "
+
+
+def read_fatbitstream_manifest(fatbitstream: Path, file: TextIO = None) -> Dict[str, str]:
+    """
+    :param file: an open text file to read the fatbitstream from instead of opening it (e.g. a file on a remote host)
+    :return: the manifest (a dict of filename -> blob hash) of a fatbitstream
+    """
+    with (open(fatbitstream) if file is None else file) as f:
+        for line in f:
+            if line.startswith(MANIFEST_PREFIX):
+                return json.loads(line[len(MANIFEST_PREFIX):])
+    raise ValueError(f"{fatbitstream} is not a fatbitstream")
+
+
+def missing_blobs(fatbitstream: Path, blob_dir: Path = None):
+    """:return: the set of blob hashes that are referenced by the fatbitstream but not present in the blob dir"""
+    if blob_dir is None:
+        blob_dir = fatbitstream.parent / "blobs"
+    return {digest for digest in read_fatbitstream_manifest(fatbitstream).values() if not (blob_dir / digest).exists()}
+
+
 class FatbitstreamContext:
     platform_to_context_dict = {}
 
@@ -76,17 +165,18 @@ class FatbitstreamContext:
         else:
             self.add_cmds(new_cmd, new_pos)
 
-    def generate_fatbitstream(self, file: BinaryIO, build_name: str, build_products: BuildProducts):
-        file.write(b'#!/usr/bin/env -S python3\n')
-
+    def generate_fatbitstream(self, file: BinaryIO, build_name: str, build_products: BuildProducts, blob_dir: Path):
+        """
+        Writes the fatbitstream script to file and stores all the files it references in blob_dir.
+        Files that are already present in blob_dir (e.g. the bitstream of a cached build) are not written again.
+        """
         def dedent(str):
             return "".join(textwrap.dedent(str).splitlines(keepends=True)[1:])
 
         main_script = dedent("""
-            #!/usr/bin/env python3
-            
             import os
             import sys
+            import shutil
             from pathlib import Path
 
 
@@ -97,17 +187,22 @@ class FatbitstreamContext:
                     if print_error:
                         print(f"{cmd} failed with exit code {exit_code}")
                     sys.exit(exit_code)
-            
-            
-            __dir__ = Path(__file__).parent
-            if __dir__.suffix == ".zip":
-                from zipfile import ZipFile                
-                dir_name = __dir__.stem
-                with ZipFile(sys.argv[0], "r") as f:
-                    f.extractall(dir_name)
-
-            os.chdir(__dir__.with_suffix(""))
-            
+
+
+            fatbitstream = Path(__file__).resolve()
+            blob_dir = fatbitstream.parent / "blobs"
+            missing = sorted(name for name, digest in MANIFEST.items() if not (blob_dir / digest).exists())
+            if missing:
+                print(f"the fatbitstream is incomplete. missing blobs for: {', '.join(missing)}")
+                sys.exit(1)
+
+            target_dir = fatbitstream.with_suffix("")
+            shutil.rmtree(target_dir, ignore_errors=True)
+            for name, digest in MANIFEST.items():
+                (target_dir / name).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(blob_dir / digest, target_dir / name)
+            os.chdir(target_dir)
+
         """)
 
         def py_quote(str):
@@ -122,10 +217,10 @@ class FatbitstreamContext:
         main_script += "\n".join(f"system('''{py_quote(cmd)}''')" for cmd in self._init_commands) + "\n"
         main_script += dedent("""
             if '--run' in sys.argv:
-                system('/usr/bin/env python3 pydriver.py')
+                system('/usr/bin/env python3 -m pydriver')  # unlike running the file directly, this uses the precompiled bytecode
         """)
 
-        with ZipFile(file, 'w', ZIP_DEFLATED) as f:
-            f.writestr("__main__.py", main_script)
-            for name, contents in self._files.items():
-                f.writestr(name, contents)
+        manifest = {name: store_blob(blob_dir, contents) for name, contents in self._files.items()}
+        file.write(b'#!/usr/bin/env -S python3\n')
+        file.write(f"{MANIFEST_PREFIX}{json.dumps(manifest, sort_keys=True)}\n".encode())
+        file.write(main_script.encode())
@@ -0,0 +1,147 @@
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+from .fatbitstream import FatbitstreamContext, File, read_fatbitstream_manifest, missing_blobs, BuildDirProducts, \
+    build_product_file
+from .program_fatbitstream_ssh import upload_fatbitstream
+
+
+class FakeSocPlatform:
+    def __init__(self, bitstream):
+        self.bitstream = bitstream
+
+    def pack_bitstream_fatbitstream(self, name, build_products):
+        yield File("bitstream.bin", self.bitstream)
+        yield "cat bitstream.bin driver/driver.py > ../programmed.txt"
+
+
+class FakePlatform:
+    def __init__(self, bitstream):
+        self._soc_platform = FakeSocPlatform(bitstream)
+
+
+def generate(build_dir: Path, bitstream, driver):
+    fc = FatbitstreamContext.get(FakePlatform(bitstream))
+    fc += File("driver/driver.py", driver)
+    fatbitstream = build_dir / "test.fatbitstream"
+    with open(fatbitstream, "wb") as f:
+        fc.generate_fatbitstream(f, "test", None, build_dir / "blobs")
+    return fatbitstream
+
+
+class FakeSftp:
+    """Emulates the subset of the paramiko SFTPClient that is needed for uploading fatbitstreams on a local directory"""
+    def __init__(self, root: Path):
+        self.cwd = root
+        self.uploaded = []
+
+    def mkdir(self, path):
+        try:
+            (self.cwd / path).mkdir()
+        except FileExistsError:
+            raise IOError()
+
+    def chdir(self, path):
+        self.cwd = self.cwd / path
+
+    def listdir_attr(self, path):
+        return [SimpleNamespace(filename=p.name, st_size=p.stat().st_size) for p in (self.cwd / path).iterdir()]
+
+    def put(self, localpath, remotepath):
+        self.uploaded.append(remotepath)
+        shutil.copyfile(localpath, self.cwd / remotepath)
+
+    def posix_rename(self, old, new):
+        os.replace(self.cwd / old, self.cwd / new)
+
+    def chmod(self, path, mode):
+        os.chmod(self.cwd / path, mode)
+
+    def listdir(self, path):
+        return [p.name for p in (self.cwd / path).iterdir()]
+
+    def open(self, path, mode):
+        return open(self.cwd / path, mode)
+
+    def remove(self, path):
+        (self.cwd / path).unlink()
+
+
+class FatbitstreamTest(unittest.TestCase):
+    def test_run(self):
+        with TemporaryDirectory() as build_dir:
+            build_dir = Path(build_dir)
+            fatbitstream = generate(build_dir, b"bitstream\n", "driver\n")
+            self.assertEqual(set(read_fatbitstream_manifest(fatbitstream)), {"bitstream.bin", "driver/driver.py"})
+            self.assertEqual(missing_blobs(fatbitstream), set())
+
+            subprocess.run([sys.executable, str(fatbitstream)], check=True, capture_output=True)
+            self.assertEqual((build_dir / "programmed.txt").read_text(), "bitstream\ndriver\n")
+            self.assertEqual((build_dir / "test" / "driver" / "driver.py").read_text(), "driver\n")
+
+    def test_deduplication(self):
+        with TemporaryDirectory() as build_dir:
+            build_dir = Path(build_dir)
+            bitstream = os.urandom(1 << 16)
+            generate(build_dir, bitstream, "driver_v1")
+            blobs = {p.name: p.stat().st_mtime_ns for p in (build_dir / "blobs").iterdir()}
+            generate(build_dir, bitstream, "driver_v2")
+            new_blobs = {p.name: p.stat().st_mtime_ns for p in (build_dir / "blobs").iterdir()}
+            self.assertEqual(len(new_blobs), 3)
+            for name, mtime in blobs.items():  # existing blobs are not written again
+                self.assertEqual(new_blobs[name], mtime)
+
+    def test_build_dir_products(self):
+        with TemporaryDirectory() as build_dir:
+            build_dir = Path(build_dir)
+            bitstream = os.urandom(1 << 16)
+            (build_dir / "test.bit").write_bytes(bitstream)
+            # files of local build products are streamed into the blob store from their path
+            contents = build_product_file(BuildDirProducts(build_dir), "test.bit")
+            self.assertEqual(contents, build_dir / "test.bit")
+            fatbitstream = generate(build_dir, contents, "driver")
+            manifest = read_fatbitstream_manifest(fatbitstream)
+            self.assertEqual((build_dir / "blobs" / manifest["bitstream.bin"]).read_bytes(), bitstream)
+
+    def test_upload_only_missing_blobs(self):
+        with TemporaryDirectory() as build_dir, TemporaryDirectory() as target_dir:
+            build_dir, target_dir = Path(build_dir), Path(target_dir)
+            bitstream = os.urandom(1 << 16)
+
+            fatbitstream = generate(build_dir, bitstream, "driver_v1")
+            sftp = FakeSftp(target_dir)
+            self.assertGreater(upload_fatbitstream(sftp, fatbitstream), len(bitstream))
+            self.assertEqual(len(sftp.uploaded), 3)
+
+            fatbitstream = generate(build_dir, bitstream, "driver_v2")
+            sftp = FakeSftp(target_dir)
+            self.assertLess(upload_fatbitstream(sftp, fatbitstream), len(bitstream))
+            manifest = read_fatbitstream_manifest(fatbitstream)
+            self.assertEqual(sftp.uploaded, [f"blobs/{manifest['driver/driver.py']}.tmp", "test.fatbitstream"])
+            self.assertEqual(missing_blobs(target_dir / "fatbitstreams" / "test.fatbitstream"), set())
+
+    def test_remove_unreferenced_blobs(self):
+        with TemporaryDirectory() as build_dir, TemporaryDirectory() as target_dir:
+            build_dir, target_dir = Path(build_dir), Path(target_dir)
+            remote_blobs = target_dir / "fatbitstreams" / "blobs"
+
+            upload_fatbitstream(FakeSftp(target_dir), generate(build_dir, b"bitstream", "driver_v1"))
+            (remote_blobs / "0123.tmp").write_bytes(b"interrupted upload")
+            fatbitstream = generate(build_dir, b"bitstream", "driver_v2")
+            upload_fatbitstream(FakeSftp(target_dir), fatbitstream)
+            # the blob of driver_v1 is only referenced by the replaced fatbitstream
+            manifest = read_fatbitstream_manifest(fatbitstream)
+            self.assertEqual({p.name for p in remote_blobs.iterdir()}, set(manifest.values()))
+
+            # blobs of other fatbitstreams in the same directory are kept
+            other = build_dir / "other.fatbitstream"
+            shutil.copyfile(fatbitstream, other)
+            upload_fatbitstream(FakeSftp(target_dir), other)
+            upload_fatbitstream(FakeSftp(target_dir), generate(build_dir, b"bitstream_v2", "driver_v2"))
+            self.assertEqual(len(list(remote_blobs.iterdir())), 3)
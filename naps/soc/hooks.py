@@ -12,94 +12,108 @@ from .pydriver.driver_items import DriverItem, DriverData
 from ..util.py_serialize import is_py_serializable
 
 
+def statement_csrs(statements, found):
+    """
+    Collects the csrs that are directly referenced in the given statements into `found` (a dict of id(csr) -> csr).
+    The statement trees are walked iteratively with an explicit stack.
+    """
+    stack = list(statements)
+    while stack:
+        stmt = stack.pop()
+        if stmt is None:
+            pass
+        # statements
+        elif isinstance(stmt, Assign):
+            stack.append(stmt.lhs)
+            stack.append(stmt.rhs)
+        elif isinstance(stmt, Property):
+            stack.append(stmt.message)
+            stack.append(stmt.test)
+        elif isinstance(stmt, Switch):
+            stack.append(stmt.test)
+            for _patterns, statements, _src_loc in stmt.cases:
+                stack.extend(statements)
+        elif isinstance(stmt, Print):
+            for chunk in stmt.message._chunks:
+                if isinstance(chunk, tuple):
+                    value, _format_spec = chunk
+                    stack.append(value)
+        # Values
+        elif isinstance(stmt, Operator):
+            stack.extend(stmt.operands)
+        elif isinstance(stmt, Slice):
+            stack.append(stmt.value)
+        elif isinstance(stmt, Part):
+            stack.append(stmt.value)
+            stack.append(stmt.offset)
+        elif isinstance(stmt, Concat):
+            stack.extend(stmt.parts)
+        elif isinstance(stmt, SwitchValue):
+            stack.append(stmt.test)
+            for pattern, value in stmt.cases:
+                stack.append(value)
+        elif isinstance(stmt, (ClockSignal, ResetSignal, Initial)):
+            pass
+        elif isinstance(stmt, _Csr):
+            found[id(stmt)] = stmt
+        elif isinstance(stmt, (Signal, Const, ValueCastable)):
+            pass
+        else:
+            raise AssertionError("unknown object {} of type {} in statement", stmt, type(stmt))
+    return found
+
+
+def elaboratable_members(elaboratable):
+    """
+    Finds the csrs and driver items of an elaboratable in a single pass over its attributes.
+    :return: a tuple of the list of (name, csr) and the list of (name, DriverItem); DriverData comes last
+    """
+    csrs = [(name, member) for name, member in elaboratable.__dict__.items() if isinstance(member, _Csr)]
+    driver_items = []
+    driver_data = []
+    for name in dir(elaboratable):
+        member = getattr(elaboratable, name)
+        if isinstance(member, DriverItem):
+            driver_items.append((name, member))
+        elif not name.startswith("_") and is_py_serializable(member):
+            driver_data.append((name, DriverData(member)))
+    return csrs, driver_items + driver_data
+
+
 def csr_and_driver_item_hook(platform, top_fragment: Fragment):
     from naps.cores.peripherals.csr_bank import CsrBank
-    already_done = []
+    already_done = {}  # id(csr) -> csr of the csrs that already got an address somewhere
+    members_cache = {}  # id(elaboratable) -> the result of elaboratable_members()
 
-    def inner(fragment, names):
+    # we do an iterative depth first traversal of the fragment hierarchy to not run into the recursion limit
+    to_visit = [(top_fragment, ["top"])]
+    while to_visit:
+        fragment, names = to_visit.pop()
         elaboratables = get_elaboratable(fragment) or ()
 
-        class_members = []
+        csr_signals = []
         driver_items = []
-
         for elaboratable in elaboratables:
-            class_members += list(elaboratable.__dict__.items())
-            driver_items += [
-                (name, getattr(elaboratable, name))
-                for name in dir(elaboratable)
-                if isinstance(getattr(elaboratable, name), DriverItem)
-            ]
-            driver_items += [
-                (name, DriverData(getattr(elaboratable, name)))
-                for name in dir(elaboratable)
-                if is_py_serializable(getattr(elaboratable, name)) and not name.startswith("_")
-            ]
-
-        csr_signals = [(name, member) for name, member in class_members if isinstance(member, _Csr)]
-
-        def get_statement_csrs(stmt):
-            csrs = set()
-            if stmt is None:
-                pass
-            # statements
-            elif isinstance(stmt, Assign):
-                csrs |= get_statement_csrs(stmt.lhs)
-                csrs |= get_statement_csrs(stmt.rhs)
-            elif isinstance(stmt, Property):
-                csrs |= get_statement_csrs(stmt.message)
-                csrs |= get_statement_csrs(stmt.test)
-            elif isinstance(stmt, Switch):
-                csrs |= get_statement_csrs(stmt.test)
-                for _patterns, statements, _src_loc  in stmt.cases:
-                    for statement in statements:
-                        csrs |= get_statement_csrs(statement)
-            elif isinstance(stmt, Print):
-                for chunk in stmt.message._chunks:
-                    if isinstance(chunk, tuple):
-                        value, _format_spec = chunk
-                        csrs |= get_statement_csrs(value)
-            # Values
-            elif isinstance(stmt, Operator):
-                for operand in stmt.operands:
-                    csrs |= get_statement_csrs(operand)
-            elif isinstance(stmt, Slice):
-                csrs |= get_statement_csrs(stmt.value)
-            elif isinstance(stmt, Part):
-                csrs |= get_statement_csrs(stmt.value)
-                csrs |= get_statement_csrs(stmt.offset)
-            elif isinstance(stmt, Concat):
-                for part in stmt.parts:
-                    csrs |= get_statement_csrs(part)
-            elif isinstance(stmt, SwitchValue):
-                csrs |= get_statement_csrs(stmt.test)
-                for pattern, value in stmt.cases:
-                    csrs |= get_statement_csrs(value)
-            elif isinstance(stmt, (ClockSignal, ResetSignal, Initial)):
-                pass
-            elif isinstance(stmt, _Csr):
-                csrs.add(stmt)
-            elif isinstance(stmt, (Signal, Const, ValueCastable)):
-                pass
-            else:
-                raise AssertionError("unknown object {} of type {} in statement", stmt, type(stmt))
-            return csrs
-
-        fragment_signals = set()
+            if id(elaboratable) not in members_cache:
+                members_cache[id(elaboratable)] = (elaboratable, elaboratable_members(elaboratable))
+            _, (elaboratable_csrs, elaboratable_driver_items) = members_cache[id(elaboratable)]
+            csr_signals += elaboratable_csrs
+            driver_items += elaboratable_driver_items
+
+        fragment_signals = {}  # the csrs referenced in the statements of the fragment
         for _domain, statements in fragment.statements.items():
-            for stmt in statements:
-                fragment_signals |= get_statement_csrs(stmt)
+            statement_csrs(statements, fragment_signals)
 
+        member_ids = {id(signal) for name, signal in csr_signals}
         csr_signals += [
-            (signal.name, signal) for signal in fragment_signals
-            if isinstance(signal, _Csr)
-                and signal.name != "$signal"
-                and not any(signal is cmp_signal for name, cmp_signal in csr_signals)
+            (signal.name, signal) for signal in fragment_signals.values()
+            if signal.name != "$signal" and id(signal) not in member_ids
         ]
 
-        new_csr_signals = [(name, signal) for name, signal in csr_signals if not any(signal is done for done in already_done)]
-        old_csr_signals = [(name, signal) for name, signal in csr_signals if any(signal is done for done in already_done)]
+        new_csr_signals = [(name, signal) for name, signal in csr_signals if id(signal) not in already_done]
+        old_csr_signals = [(name, signal) for name, signal in csr_signals if id(signal) in already_done]
         for name, signal in new_csr_signals:
-            already_done.append(signal)
+            already_done[id(signal)] = signal
 
         mmap = fragment.memorymap = MemoryMap()
 
@@ -121,11 +135,11 @@ def csr_and_driver_item_hook(platform, top_fragment: Fragment):
         for name, driver_item in driver_items:
             fragment.memorymap.add_driver_item(name, driver_item)
 
-        for subfragment, name, _src_loc in fragment.subfragments:
-            if isinstance(subfragment, RequirePosedge):
-                continue
-            inner(subfragment, [*names, str(name)])
-    inner(top_fragment, ["top"])
+        children = [
+            (subfragment, [*names, str(name)]) for subfragment, name, _src_loc in fragment.subfragments
+            if not isinstance(subfragment, RequirePosedge)
+        ]
+        to_visit.extend(reversed(children))
 
 
 def address_assignment_hook(platform, top_fragment: Fragment):
@@ -0,0 +1,68 @@
+import unittest
+from types import SimpleNamespace
+
+from amaranth import *
+from naps import SimPlatform, StatusSignal, ControlSignal, driver_method
+from naps.soc.hooks import csr_and_driver_item_hook
+
+
+class CsrHolder(Elaboratable):
+    def __init__(self, n_csrs):
+        self.n_csrs = n_csrs
+        for i in range(n_csrs):
+            setattr(self, f"status{i}", StatusSignal(16))
+        self.control = ControlSignal(16)
+
+    def elaborate(self, platform):
+        m = Module()
+        for i in range(self.n_csrs):
+            m.d.sync += getattr(self, f"status{i}").eq(getattr(self, f"status{i}") + self.control)
+        return m
+
+    @driver_method
+    def reset(self):
+        self.control = 0
+
+
+class CsrDesign(Elaboratable):
+    def __init__(self, n_holders, n_csrs):
+        self.holders = [CsrHolder(n_csrs) for _ in range(n_holders)]
+        self.shared = self.holders[0].control
+
+    def elaborate(self, platform):
+        m = Module()
+        for i, holder in enumerate(self.holders):
+            m.submodules[f"holder{i}"] = holder
+        return m
+
+
+class CsrAndDriverItemHookTest(unittest.TestCase):
+    def run_hook(self, n_holders, n_csrs):
+        fragment = Fragment.get(CsrDesign(n_holders, n_csrs), SimPlatform())
+        platform = SimpleNamespace(to_inject_subfragments=[])
+        csr_and_driver_item_hook(platform, fragment)
+        return fragment, platform
+
+    def test_csrs_are_collected_once(self):
+        fragment, platform = self.run_hook(n_holders=3, n_csrs=4)
+        self.assertEqual(len(platform.to_inject_subfragments), 4)  # one csr bank for the top and each holder
+        self.assertEqual([row.name for row in fragment.memorymap.direct_children], ["shared"])
+        holder = fragment.subfragments[0][0]
+        self.assertEqual(
+            [row.name for row in holder.memorymap.direct_children],
+            ["status0", "status1", "status2", "status3"]  # the control signal was already collected at the top
+        )
+        self.assertEqual(list(holder.memorymap.aliases), ["control"])
+        self.assertIn("reset", holder.memorymap.driver_items)
+        self.assertEqual(holder.memorymap.driver_items["n_csrs"].data, 4)
+
+    def test_many_holders(self):
+        n_holders, n_csrs = 1000, 10
+        fragment, platform = self.run_hook(n_holders, n_csrs)
+        self.assertEqual(len(platform.to_inject_subfragments), n_holders + 1)
+        holders = [subfragment for subfragment, *_ in fragment.subfragments]
+        self.assertEqual(
+            sum(len(holder.memorymap.direct_children) for holder in holders),
+            n_holders * (n_csrs + 1) - 1  # the control signal of the first holder is collected at the top
+        )
+        self.assertTrue(all(holder.memorymap.driver_items["n_csrs"].data == n_csrs for holder in holders))
@@ -1,6 +1,7 @@
 # TODO: add tests (a lot of them)
 
 import re
+from bisect import bisect_right
 from dataclasses import dataclass
 from math import ceil
 from typing import List
@@ -148,6 +149,19 @@ class MemoryMap(MustUse):
         self._inlined_offset = None
 
         self.entries: List[MemoryMapRow] = []
+        self._subranges: List[MemoryMapRow] = []
+        self._direct_children: List[MemoryMapRow] = []
+        # the occupied bit intervals sorted by their start. because they never overlap, the stops are sorted, too.
+        self._interval_starts: List[int] = []
+        self._interval_stops: List[int] = []
+        self._names = set()
+        self._real_size = 0
+        self._direct_children_real_size = 0
+        # id(obj) -> row and id(row) -> row for all own entries
+        self._row_index = {}
+        # id(obj) -> (memorymap, row) for the whole hierarchy below this memorymap; built lazily by _subtree_index()
+        self._subtree_index_cache = None
+
         self.aliases = {}
         self.driver_items = {}
         self.frozen = False
@@ -178,8 +192,7 @@ class MemoryMap(MustUse):
         if self.is_top:
             return ()
         elif self._parent is not None:
-            my_row: MemoryMapRow = next(row for row in self._parent.subranges if row.obj == self)
-            return (*self._parent.path, my_row.name)
+            return (*self._parent.path, self._parent._row_index[id(self)].name)
         else:
             raise ValueError("self is not the toplevel memorymap and is not assigned to one")
 
@@ -193,41 +206,31 @@ class MemoryMap(MustUse):
 
     @property
     def subranges(self):
-        return [row for row in self.entries if isinstance(row.obj, MemoryMap)]
+        return self._subranges
 
     @property
     def direct_children(self):
-        return [row for row in self.entries if not isinstance(row.obj, MemoryMap)]
+        return self._direct_children
+
+    def _align(self, real_size):
+        # automatically round up to the next word with self.access_with
+        return int(ceil(real_size / self.bus_word_width_bytes) * self.bus_word_width_bytes)
 
     @property
     def byte_len(self) -> int:
         """
-        Calculate the size (based on the resource with the highest address part) of the memorymap
+        The size (based on the resource with the highest address part) of the memorymap
         :return: the size of the memorymap in bytes (aligned to the bus word width)
         """
-        if not self.entries:
-            return 0
-        real_size = max(
-            row.address.address + ceil((row.address.bit_offset + row.address.bit_len) / 8)
-            for row in self.entries
-        )
-        # automatically round up to the next word with self.access_with
-        return int(ceil(real_size / self.bus_word_width_bytes) * self.bus_word_width_bytes)
+        return self._align(self._real_size)
 
     @property
     def direct_children_byte_len(self):
         """
-        Calculate the size (based on the _normal_ resource with the highest address part) of the memorymap
+        The size (based on the _normal_ resource with the highest address part) of the memorymap
         :return: the size of the memorymap in bytes (aligned to the bus word width)
         """
-        if not self.direct_children:
-            return 0
-        real_size = max(
-            row.address.address + ceil((row.address.bit_offset + row.address.bit_len) / 8)
-            for row in self.direct_children
-        )
-        # automatically round up to the next word with self.access_with
-        return int(ceil(real_size / self.bus_word_width_bytes) * self.bus_word_width_bytes)
+        return self._align(self._direct_children_real_size)
 
     @property
     def absolute_range_of_direct_children(self):
@@ -243,9 +246,7 @@ class MemoryMap(MustUse):
             if self._parent and self._inlined_offset:
                 return self._parent.own_offset.translate(self._inlined_offset)
             elif self._parent:
-                own_row_candidates = [row for row in self._parent.subranges if row.obj == self]
-                assert len(own_row_candidates) == 1
-                return self._parent.own_offset.translate(own_row_candidates[0].address)
+                return self._parent.own_offset.translate(self._parent._row_index[id(self)].address)
             else:
                 raise ValueError("the location of the memorymap cant be determined. "
                                  "self is not the toplevel memorymap and is not assigned to one")
@@ -261,10 +262,13 @@ class MemoryMap(MustUse):
         :param check_address: the address to check.
         :return: A boolean indicating if the address is free
         """
-        for row in self.entries:
-            if check_address.collides(row.address):
-                return False
-        return True
+        if check_address.bit_len is None:
+            raise ValueError("collision detection is impossible with addresses that dont have a length specified")
+        start = check_address.address * 8
+        stop = start + check_address.bit_len
+        # the first occupied interval that ends after our start is the only one that can collide with us
+        i = bisect_right(self._interval_stops, start)
+        return i == len(self._interval_starts) or self._interval_starts[i] >= stop
 
     def allocate(self, name, writable, bits=None, address=None, obj=None):
         """
@@ -278,7 +282,7 @@ class MemoryMap(MustUse):
         :return: the address of the resource
         """
         assert not self.frozen
-        assert not any(row.name == name for row in self.entries), name
+        assert name not in self._names, name
         assert bits is not None or address is not None
         if address:
             assert ((bits is None) or (
@@ -290,7 +294,29 @@ class MemoryMap(MustUse):
         assert address.bit_len
         if not self.is_free(address):
             raise ValueError("address {!r} is not free".format(address, bits))
-        self.entries.append(MemoryMapRow(name, address, writable, obj))
+        row = MemoryMapRow(name, address, writable, obj)
+        self.entries.append(row)
+        self._names.add(name)
+
+        start = address.address * 8
+        i = bisect_right(self._interval_starts, start)
+        self._interval_starts.insert(i, start)
+        self._interval_stops.insert(i, start + address.bit_len)
+
+        real_size = address.address + ceil((address.bit_offset + address.bit_len) / 8)
+        self._real_size = max(self._real_size, real_size)
+        if isinstance(obj, MemoryMap):
+            self._subranges.append(row)
+        else:
+            self._direct_children.append(row)
+            self._direct_children_real_size = max(self._direct_children_real_size, real_size)
+
+        self._row_index.setdefault(id(obj), row)
+        self._row_index[id(row)] = row
+        memorymap = self
+        while memorymap is not None:
+            memorymap._subtree_index_cache = None
+            memorymap = memorymap._parent
         return address
 
     def add_alias(self, name, obj):
@@ -346,27 +372,42 @@ class MemoryMap(MustUse):
         if go_up:
             return self.top_memorymap.find_recursive(obj, go_up=False)
 
-        for row in self.direct_children:
-            if row.obj is obj or row is obj:
-                return self.own_offset.translate(row.address)
-
-        for row in self.subranges:
-            sub_result = row.obj.find_recursive(obj)
-            if sub_result is not None:
-                return sub_result
+        found = self._subtree_index().get(id(obj))
+        if found is None:
+            return None
+        memorymap, row = found
+        return memorymap.own_offset.translate(row.address)
 
-        return None
+    def _subtree_index(self):
+        """
+        Build (or return the cached) index of all rows in the hierarchy below this memorymap.
+        Own direct children take precedence over the ones of subranges which are searched in allocation order.
+        :return: a dict of id(obj) -> (memorymap, row) that also contains id(row) -> (memorymap, row)
+        """
+        if self._subtree_index_cache is None:
+            index = {}
+            for row in self._direct_children:
+                index.setdefault(id(row.obj), (self, row))
+                index[id(row)] = (self, row)
+            for row in self._subranges:
+                for key, value in row.obj._subtree_index().items():
+                    index.setdefault(key, value)
+            self._subtree_index_cache = index
+        return self._subtree_index_cache
 
     @property
     def flattened(self):
         to_return = {}
-        for row in self.direct_children:
-            to_return[(*self.path, row.name)] = self.find_recursive(row, go_up=True)
+        self._flatten_into(to_return, self.path)
+        return to_return
+
+    def _flatten_into(self, to_return, path):
+        own_offset = self.own_offset
+        for row in self._direct_children:
+            to_return[(*path, row.name)] = own_offset.translate(row.address)
         for name, obj in self.aliases.items():
-            to_return[(*self.path, name)] = self.find_recursive(obj, go_up=True)
+            to_return[(*path, name)] = self.find_recursive(obj, go_up=True)
         for name, method in self.driver_items.items():
-            to_return[(*self.path, name)] = method
-        for row in self.subranges:
-            to_return.update(row.obj.flattened)
-
-        return to_return
+            to_return[(*path, name)] = method
+        for row in self._subranges:
+            row.obj._flatten_into(to_return, (*path, row.name))
@@ -0,0 +1,50 @@
+import unittest
+
+from naps.soc import MemoryMap, Address
+from naps.soc.test_util import big_memorymap
+
+
+class MemoryMapTest(unittest.TestCase):
+    def test_allocate_and_is_free(self):
+        memorymap = MemoryMap()
+        self.assertEqual(memorymap.allocate("a", writable=True, bits=8).address, 0)
+        memorymap.allocate("b", writable=True, address=Address(0x8, 0, 32))
+        self.assertEqual(memorymap.byte_len, 0xC)
+        self.assertFalse(memorymap.is_free(Address(0x0, 0, 1)))
+        self.assertTrue(memorymap.is_free(Address(0x4, 0, 32)))
+        self.assertFalse(memorymap.is_free(Address(0x4, 0, 33)))
+        self.assertTrue(memorymap.is_free(Address(0xC, 0, 32)))
+        with self.assertRaises(ValueError):
+            memorymap.allocate("c", writable=True, address=Address(0x8, 0, 8))
+        self.assertEqual(memorymap.allocate("c", writable=True, bits=32).address, 0xC)
+
+    def test_hierarchy(self):
+        top = MemoryMap(top=True)
+        inlined, named = MemoryMap(), MemoryMap()
+        a, b, c = object(), object(), object()
+        inlined.allocate("a", writable=True, bits=32, obj=a)
+        named.allocate("b", writable=True, bits=32)
+        named.allocate("c", writable=True, bits=8, obj=c)
+        named.add_alias("alias_of_a", a)
+        top.allocate_subrange(inlined)
+        top.allocate_subrange(named, name="named")
+        top.place_at = Address(0x4000_0000, 0, top.byte_len * 8)
+
+        self.assertEqual(named.path, ("named",))
+        self.assertEqual(named.own_offset.address, 0x4000_0004)
+        self.assertEqual(top.find_recursive(c).address, 0x4000_0008)
+        self.assertEqual(named.find_recursive(a, go_up=True).address, 0x4000_0000)
+        self.assertIsNone(named.find_recursive(a))
+        self.assertEqual(
+            {k: v.address for k, v in top.flattened.items()},
+            {("a",): 0x4000_0000, ("named", "b"): 0x4000_0004, ("named", "c"): 0x4000_0008,
+             ("named", "alias_of_a"): 0x4000_0000},
+        )
+
+    def test_many_banks(self):
+        n_banks, n_csrs = 2000, 10
+        top = big_memorymap(n_banks, n_csrs)
+        flattened = top.flattened
+        self.assertEqual(len(flattened), n_banks * n_csrs)
+        addresses = [address.address for address in flattened.values()]
+        self.assertEqual(len(set(addresses)), len(addresses))  # no two csrs share a word
@@ -15,6 +15,8 @@ class Response(Enum):
 
 HandleRead = Callable[[Module, Signal, Signal, Callable[[Response], None]], None]
 HandleWrite = Callable[[Module, Signal, Signal, Callable[[Response], None]], None]
+HandleReadPipelined = Callable[[Module, Signal, Signal], Value]
+HandleWritePipelined = Callable[[Module, Signal, Signal, Signal], None]
 
 
 class Peripheral(Elaboratable):
@@ -23,7 +25,9 @@ class Peripheral(Elaboratable):
             handle_read: HandleRead,
             handle_write: HandleWrite,
             memorymap: MemoryMap,
-            name: str | None = None
+            name: str | None = None,
+            handle_read_pipelined: HandleReadPipelined | None = None,
+            handle_write_pipelined: HandleWritePipelined | None = None,
     ):
         """
         A `Peripheral` is a thing that is memorymaped in the SOC.
@@ -35,9 +39,19 @@ class Peripheral(Elaboratable):
         :param handle_write: a function with the signature handle_write(m, addr, data, write_done) that is used to
                             insert logic to the write path. Write_done is a function that gets a Response as an argument
         :param memorymap: the MemoryMap of the peripheral
+        :param handle_read_pipelined: an optional function with the signature handle_read_pipelined(m, addr, en) -> data
+                            for peripherals that can start a read in every cycle (e.g. memories). It is called once
+                            outside of any conditional statements and returns a value that holds the data of the address
+                            one cycle after en was high. While en is low the returned value must not change.
+                            Connectors that support bursts (e.g. the `AxiPeripheralConnector`) use it instead of
+                            handle_read.
+        :param handle_write_pipelined: an optional function with the signature handle_write_pipelined(m, addr, data, en)
+                            that writes data to addr in every cycle in which en is high.
         """
         self.handle_read = handle_read
         self.handle_write = handle_write
+        self.handle_read_pipelined = handle_read_pipelined
+        self.handle_write_pipelined = handle_write_pipelined
         self.memorymap = memorymap
         self.name = name
 
@@ -1,54 +1,124 @@
+from amaranth import *
+
 from .peripheral import Response
-from naps.util.amaranth_misc import iterator_with_if_elif
+from naps.util.past import NewHere
 
 __all__ = ["PeripheralsAggregator"]
 
 
+def aligned_windows(start, stop):
+    """
+    Split an address range into the least number of naturally aligned power of two sized windows.
+    :return: a list of (base, log2_size) tuples that cover range(start, stop) exactly
+    """
+    windows = []
+    while start < stop:
+        log2_size = (start & -start).bit_length() - 1 if start else (stop - start).bit_length()
+        while (1 << log2_size) > stop - start:
+            log2_size -= 1
+        windows.append((start, log2_size))
+        start += 1 << log2_size
+    return windows
+
+
+def window_patterns(windows, width):
+    """
+    Turn aligned windows (see aligned_windows()) into Switch Case patterns for an address of the given width.
+    Only the bits above the window size are compared; windows that lie outside the address width are dropped.
+    """
+    patterns = []
+    for base, log2_size in windows:
+        if log2_size >= width:
+            patterns.append("-" * width)
+        elif base >> width == 0:
+            patterns.append(format(base >> log2_size, "0{}b".format(width - log2_size)) + "-" * log2_size)
+    return patterns
+
+
 class PeripheralsAggregator:
-    def __init__(self):
+    def __init__(self, register_decode=False):
         """
         A helper class that behaves like a Peripheral but proxies its read/write request to downstream peripherals
         based on their memorymap.
+        The address is decoded with a single Switch whose cases only look at the upper address bits that select an
+        aligned power of two window of a peripheral.
+        :param register_decode: register the decoded peripheral select before calling the downstream peripheral.
+                                this costs one cycle per access but removes the decoder from the downstream paths.
         """
         self.downstream_peripherals = []
+        self.register_decode = register_decode
+        self._decoder = None
 
     def add_peripheral(self, peripheral):
         assert callable(peripheral.handle_read) and callable(peripheral.handle_write)
         assert isinstance(peripheral.range(), range)
         self.downstream_peripherals.append(peripheral)
+        self._decoder = None
 
     def range(self):
-        return range(
-            min(p.range().start for p in self.downstream_peripherals),
-            max(p.range().stop for p in self.downstream_peripherals)
-        )
+        return self.decoder()[0]
 
-    def handle_read(self, m, addr, data, read_done_callback):
-        for cond, peripheral in iterator_with_if_elif(self.downstream_peripherals, m):
-            address_range = peripheral.memorymap.absolute_range_of_direct_children.range()
-            translated_address_range = range(
-                address_range.start - self.range().start,
-                address_range.stop - self.range().start,
-            )
-            with cond((addr >= translated_address_range.start) & (addr < translated_address_range.stop)):
-                peripheral.handle_read(m, addr - translated_address_range.start, data, read_done_callback)
-        if self.downstream_peripherals:
-            with m.Else():
-                read_done_callback(Response.ERR)
+    def decoder(self):
+        """
+        Compute (and cache) the information needed for the address decoding.
+        :return: a tuple of (own_range, [(peripheral, translated_range, windows), ...])
+        """
+        if self._decoder is None:
+            ranges = [p.range() for p in self.downstream_peripherals]
+            own_range = range(min(r.start for r in ranges), max(r.stop for r in ranges))
+            entries = []
+            for peripheral, address_range in zip(self.downstream_peripherals, ranges):
+                translated_range = range(address_range.start - own_range.start, address_range.stop - own_range.start)
+                entries.append((peripheral, translated_range, aligned_windows(translated_range.start, translated_range.stop)))
+            self._decoder = own_range, entries
+        return self._decoder
+
+    def _dispatch(self, m, addr, data, done_callback, handler_name):
+        if not self.downstream_peripherals:
+            done_callback(Response.ERR)
+            return
+        _, entries = self.decoder()
+
+        def handle(peripheral, translated_range):
+            getattr(peripheral, handler_name)(m, downstream_addr(translated_range), data, done_callback)
+
+        def downstream_addr(translated_range):
+            # if the peripheral starts at a boundary of its own (power of two rounded) size we dont need a subtractor
+            log2_size = (len(translated_range) - 1).bit_length()
+            if translated_range.start % (1 << log2_size) == 0:
+                return addr[:log2_size]
+            return addr - translated_range.start
+
+        if not self.register_decode:
+            with m.Switch(addr):
+                for peripheral, translated_range, windows in entries:
+                    case_patterns = window_patterns(windows, len(addr))
+                    if case_patterns:
+                        with m.Case(*case_patterns):
+                            handle(peripheral, translated_range)
+                with m.Default():
+                    done_callback(Response.ERR)
         else:
-            read_done_callback(Response.ERR)
+            selected = Signal(range(len(entries) + 1))
+            first_cycle = NewHere(m)
+            with m.Switch(addr):
+                for i, (peripheral, translated_range, windows) in enumerate(entries):
+                    case_patterns = window_patterns(windows, len(addr))
+                    if case_patterns:
+                        with m.Case(*case_patterns):
+                            m.d.sync += selected.eq(i)
+                with m.Default():
+                    m.d.sync += selected.eq(len(entries))
+            with m.If(~first_cycle):
+                with m.Switch(selected):
+                    for i, (peripheral, translated_range, windows) in enumerate(entries):
+                        with m.Case(i):
+                            handle(peripheral, translated_range)
+                    with m.Default():
+                        done_callback(Response.ERR)
+
+    def handle_read(self, m, addr, data, read_done_callback):
+        self._dispatch(m, addr, data, read_done_callback, "handle_read")
 
     def handle_write(self, m, addr, data, write_done_callback):
-        for cond, peripheral in iterator_with_if_elif(self.downstream_peripherals, m):
-            address_range = peripheral.memorymap.absolute_range_of_direct_children.range()
-            translated_address_range = range(
-                address_range.start - self.range().start,
-                address_range.stop - self.range().start,
-            )
-            with cond((addr >= translated_address_range.start) & (addr < translated_address_range.stop)):
-                peripheral.handle_write(m, addr - translated_address_range.start, data, write_done_callback)
-        if self.downstream_peripherals:
-            with m.Else():
-                write_done_callback(Response.ERR)
-        else:
-            write_done_callback(Response.ERR)
+        self._dispatch(m, addr, data, write_done_callback, "handle_write")
@@ -0,0 +1,99 @@
+import unittest
+
+from amaranth import *
+from naps import SimPlatform, Response, PeripheralsAggregator
+from naps.soc.peripherals_aggregator import aligned_windows
+
+
+class FakePeripheral:
+    def __init__(self, address_range, value):
+        self.address_range = address_range
+        self.value = value
+
+    def range(self):
+        return self.address_range
+
+    def handle_read(self, m, addr, data, read_done):
+        m.d.sync += data.eq(self.value + addr)
+        read_done(Response.OK)
+
+    def handle_write(self, m, addr, data, write_done):
+        write_done(Response.OK)
+
+
+class ReadHarness(Elaboratable):
+    """A minimal bus master in the spirit of the PeripheralConnectors that performs one read per strobe"""
+    def __init__(self, aggregator):
+        self.aggregator = aggregator
+        self.addr = Signal(32)
+        self.start = Signal()
+        self.data = Signal(32)
+        self.error = Signal()
+        self.done = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        def read_done(response):
+            m.d.sync += self.done.eq(1)
+            m.d.sync += self.error.eq(response == Response.ERR)
+
+        with m.FSM():
+            with m.State("IDLE"):
+                with m.If(self.start):
+                    m.d.sync += self.done.eq(0)
+                    m.next = "READ"
+            with m.State("READ"):
+                with m.If(self.done):
+                    m.next = "IDLE"
+                with m.Else():
+                    self.aggregator.handle_read(m, self.addr, self.data, read_done)
+        return m
+
+
+class PeripheralsAggregatorTest(unittest.TestCase):
+    def test_aligned_windows(self):
+        self.assertEqual(aligned_windows(0x0, 0x40), [(0x0, 6)])
+        self.assertEqual(aligned_windows(0x4, 0x20), [(0x4, 2), (0x8, 3), (0x10, 4)])
+        for start, stop in [(0x0, 0x1C), (0x24, 0x104), (0x100, 0x1000)]:
+            covered = [a for base, log2_size in aligned_windows(start, stop) for a in range(base, base + (1 << log2_size))]
+            self.assertEqual(covered, list(range(start, stop)))
+
+    def check_decode(self, register_decode):
+        platform = SimPlatform()
+        aggregator = PeripheralsAggregator(register_decode=register_decode)
+        aggregator.add_peripheral(FakePeripheral(range(0x1000, 0x1040), 0x1000_0000))
+        aggregator.add_peripheral(FakePeripheral(range(0x1044, 0x1100), 0x2000_0000))
+        aggregator.add_peripheral(FakePeripheral(range(0x1200, 0x1204), 0x3000_0000))
+        self.assertEqual(aggregator.range(), range(0x1000, 0x1204))
+        dut = ReadHarness(aggregator)
+
+        def read(addr):
+            yield dut.addr.eq(addr)
+            yield dut.start.eq(1)
+            yield
+            yield dut.start.eq(0)
+            for _ in range(10):
+                yield
+                if (yield dut.done):
+                    return (yield dut.data), (yield dut.error)
+            raise TimeoutError()
+
+        def testbench():
+            self.assertEqual((yield from read(0x0)), (0x1000_0000, 0))
+            self.assertEqual((yield from read(0x3C)), (0x1000_003C, 0))
+            self.assertEqual((yield from read(0x44)), (0x2000_0000, 0))
+            self.assertEqual((yield from read(0xFC)), (0x2000_00B8, 0))
+            self.assertEqual((yield from read(0x200)), (0x3000_0000, 0))
+            self.assertEqual((yield from read(0x40))[1], 1)
+            self.assertEqual((yield from read(0x100))[1], 1)
+            self.assertEqual((yield from read(0x204))[1], 1)
+
+        platform.add_sim_clock("sync", 10e6)
+        platform.sim(dut, testbench)
+
+    def test_decode(self):
+        self.check_decode(register_decode=False)
+
+    def test_registered_decode(self):
+        self.check_decode(register_decode=True)
@@ -0,0 +1,182 @@
+# A fake openocd tcl server that emulates a JTAGPeripheralConnector on the other end of the jtag chain.
+# It is used to test and benchmark the JTAGAccessor without hardware.
+
+import socket
+import time
+from threading import Thread
+
+__all__ = ["FakeOpenOCD"]
+
+
+class FakeConnector:
+    """A bit level model of the JTAGPeripheralConnector FSM with a memory as peripheral"""
+
+    def __init__(self, latency=3, error_addresses=()):
+        self.latency = latency
+        self.error_addresses = set(error_addresses)
+        self.memory = {}
+
+        self.state = "IDLE0"
+        self.bit = 0
+        self.addr = 0
+        self.data = 0
+        self.status = 0
+        self.done = False
+        self.wait_cycles = 0
+        self.transactions = 0
+
+    def _handle(self, write):
+        # the peripheral needs `latency` cycles before it signals completion
+        self.wait_cycles += 1
+        if self.wait_cycles < self.latency:
+            return
+        self.status = int(self.addr in self.error_addresses)
+        if not self.status:
+            if write:
+                self.memory[self.addr] = self.data
+            else:
+                self.data = self.memory.get(self.addr, 0)
+        self.done = True
+        self.transactions += 1
+
+    def shift(self, tdi):
+        tdo = 0
+        state = self.state
+        if state == "IDLE0":
+            self.done = False
+            if not tdi:
+                self.state = "IDLE1"
+        elif state == "IDLE1":
+            if tdi:
+                self.state, self.bit, self.addr = "ADDR", 0, 0
+        elif state == "ADDR":
+            self.addr |= tdi << self.bit
+            self.bit += 1
+            if self.bit == 32:
+                self.state = "RW_CMD"
+        elif state == "RW_CMD":
+            self.data = 0
+            self.wait_cycles = 0
+            if tdi:
+                self.state, self.bit = "WRITE", 0
+            else:
+                self.state = "READ_WAIT"
+        elif state in ("READ_WAIT", "WRITE_WAIT"):
+            if self.done:
+                tdo = 1
+                self.state, self.bit = ("READ", 0) if state == "READ_WAIT" else ("WRITE_STATUS", 0)
+            else:
+                self._handle(write=state == "WRITE_WAIT")
+            if not tdi:  # abort the waiting
+                self.state = "IDLE0"
+        elif state == "READ":
+            tdo = (self.data >> self.bit) & 1
+            self.bit += 1
+            if self.bit == 32:
+                self.state = "READ_STATUS"
+        elif state == "WRITE":
+            self.data |= tdi << self.bit
+            self.bit += 1
+            if self.bit == 32:
+                self.state = "WRITE_WAIT"
+        elif state in ("READ_STATUS", "WRITE_STATUS"):
+            tdo = self.status
+            self.state = "IDLE0"
+        return tdo
+
+    def scan(self, length, value):
+        result = 0
+        for i in range(length):
+            result |= self.shift((value >> i) & 1) << i
+        return result
+
+
+class FakeOpenOCD:
+    """
+    Serves the openocd tcl rpc protocol on a local port. Only the commands used by the JTAGAccessor are understood.
+    :param scan_latency: the time every drscan takes in seconds to emulate the round trip to a real jtag adapter.
+    """
+
+    def __init__(self, latency=3, error_addresses=(), scan_latency=0.0):
+        self.connector = FakeConnector(latency, error_addresses)
+        self.scan_latency = scan_latency
+        self.scans = 0
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.close()
+
+    @property
+    def memory(self):
+        return self.connector.memory
+
+    def _serve(self):
+        try:
+            conn, _ = self.server.accept()
+        except OSError:  # the server was closed before anyone connected
+            return
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buf = bytearray()
+        with conn:
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    return
+                buf += chunk
+                replies = bytearray()
+                while (end := buf.find(b'\x1a')) != -1:
+                    command = buf[:end].decode('utf-8')
+                    del buf[:end + 1]
+                    if command == "shutdown":
+                        return
+                    replies += self._eval(command).encode('utf-8') + b'\x1a'
+                conn.sendall(replies)
+
+    def _drscan(self, *fields):
+        self.scans += 1
+        if self.scan_latency:
+            time.sleep(self.scan_latency)
+        results = []
+        for length, value in zip(fields[0::2], fields[1::2]):
+            length = int(length)
+            results.append("{{:0{}x}}".format((length + 3) // 4).format(self.connector.scan(length, int(value, 0))))
+        return " ".join(results)
+
+    def _naps_transaction(self, tap, head_len, head, wait_len, ones, tail_len, tail, timeout):
+        # a python port of the NAPS_TRANSACTION_PROC tcl procedure of the JTAGAccessor
+        reply = self._drscan(head_len, head, wait_len, ones)
+        wait = int(reply.split()[-1], 16)
+        i = 0
+        while wait == 0:
+            if i >= int(timeout):
+                return reply + " timeout"
+            chunk = self._drscan(wait_len, ones)
+            reply += " " + chunk
+            wait = int(chunk, 16)
+            i += 1
+        if (wait & ((1 << (int(wait_len) - int(tail_len))) - 1)) == 0:
+            reply += " " + self._drscan(tail_len, tail)
+        return reply
+
+    def _eval(self, command):
+        if command.startswith("proc "):
+            return ""
+        name, *args = command.split()
+        if name == "irscan":
+            return ""
+        elif name == "drscan":
+            return self._drscan(*args[1:])
+        elif name == "naps_transaction":
+            return self._naps_transaction(*args)
+        else:
+            return "invalid command name \"{}\"".format(name)
@@ -7,7 +7,7 @@ from ... import SocPlatform, Address, PeripheralsAggregator, PERIPHERAL_DOMAIN,
 
 __all__ = ["JTAGSocPlatform"]
 
-from ...fatbitstream import File
+from ...fatbitstream import File, build_product_file
 
 
 class JTAGSocPlatform(SocPlatform):
@@ -46,9 +46,9 @@ class JTAGSocPlatform(SocPlatform):
 
     def pack_bitstream_fatbitstream(self, name: str, build_products: BuildProducts):
         if isinstance(self, LatticePlatform) and self.toolchain == "Diamond":
-            yield File("bitstream_jtag.svf", build_products.get(f"{name}_sram.svf"))
+            yield File("bitstream_jtag.svf", build_product_file(build_products, f"{name}_sram.svf"))
         else:
-            yield File("bitstream_jtag.svf", build_products.get(f"{name}.svf"))
+            yield File("bitstream_jtag.svf", build_product_file(build_products, f"{name}.svf"))
         yield from self._wrapped_platform.generate_openocd_conf()
         yield 'openocd -f openocd.cfg -c "svf -tap dut.tap -quiet -progress bitstream_jtag.svf; shutdown"'
 
@@ -1,111 +1,190 @@
+import os
+import socket
+import time
+from array import array
+from os.path import dirname, abspath
+
+
+# A tcl procedure that is uploaded to openocd and that performs one whole JTAGPeripheralConnector transaction.
+# The first scan contains the wakeup bits, the address, the read / write bit, the write data and a chunk of wait bits.
+# If the connector did not signal completion in that chunk, further chunks of wait bits are shifted in until it did.
+# Because the connector ignores tdi after it signalled completion and stays idle on ones, the data & status bits
+# of fast transactions are already contained in the first chunk. Only if the completion happened too late in a
+# chunk an additional tail scan is needed to get them.
+# Doing the waiting inside openocd makes it safe to queue many transactions without waiting for their replies.
+NAPS_TRANSACTION_PROC = """
+proc naps_hex {h} { return [expr 0x[string map {0x {}} $h]] }
+proc naps_transaction {tap head_len head wait_len ones tail_len tail timeout} {
+    set reply [drscan $tap $head_len $head $wait_len $ones]
+    set wait [naps_hex [lindex $reply end]]
+    for {set i 0} {$wait == 0} {incr i} {
+        if {$i >= $timeout} { return "$reply timeout" }
+        set chunk [drscan $tap $wait_len $ones]
+        append reply " " $chunk
+        set wait [naps_hex $chunk]
+    }
+    if {($wait & ((1 << ($wait_len - $tail_len)) - 1)) == 0} {
+        append reply " " [drscan $tap $tail_len $tail]
+    }
+    return $reply
+}
+""".strip()
+
+
 class JTAGAccessor:
     base = 0
 
-    def __init__(self, addr="127.0.0.1", port=4444, timeout=1024, debug=False, spawn_server=True, tap_name="dut.tap"):
-        import socket
-        import os
-        import time
-        from os.path import dirname, abspath
+    # the length of the chunks of ones that are shifted in while waiting for the completion of a transaction.
+    # the last TAIL_LEN bits of each chunk are for the data and status bits (TAIL_LEN = 32 data bits + 1 status bit).
+    # this must be smaller than 64 bits to fit into a tcl integer.
+    WAIT_LEN = 48
+    TAIL_LEN = 33
 
+    def __init__(self, addr="127.0.0.1", port=6666, timeout=1024, debug=False, spawn_server=True, tap_name="dut.tap",
+                 max_in_flight=64):
         self.tap_name = tap_name
 
         if spawn_server:
             addr = "127.0.0.1"
-            port = 4444
+            port = 6666
             os.system('cd {}; openocd -f openocd.cfg > /dev/null 2>&1 &'.format(dirname(abspath(__file__))))
-            time.sleep(0.1)
 
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.s.connect((addr, port))
+        for i in range(50):
+            try:
+                self.s = socket.create_connection((addr, port))
+                break
+            except ConnectionRefusedError:
+                if i == 49:
+                    raise
+                time.sleep(0.1)
+        self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buf = bytearray()
         self.timeout = timeout
         self.debug = debug
         self.spawn_server = spawn_server
+        self.max_in_flight = max_in_flight
 
-        # skip some strange random shit
-        self._readline(decode=False)
-        self._irscan(0x32)
+        self._command(NAPS_TRANSACTION_PROC)
+        self._command('irscan {} {}'.format(self.tap_name, 0x32))
+        # bring the connector to a defined state (see the JTAGPeripheralConnector)
         for i in range(3):
-            self._shift_word(0)
+            self._command('drscan {} 32 0'.format(self.tap_name))
 
     def __del__(self):
         if hasattr(self, "spawn_server") and self.spawn_server:
-            self._writeline("shutdown")
+            self._send("shutdown")
 
     def read(self, addr):
-        self._shift_bit(0)  # wakeup
-        self._shift_bit(1)  # wakeup
-        self._shift_word(addr)  # address
-        self._shift_bit(0)  # read
-
-        # read wait
-        timeout = self.timeout
-        for t in range(timeout):
-            if self._shift_bit(1) == 1:
-                break
-            if t == timeout - 1:
-                raise TimeoutError()
-
-        data = self._shift_word(0)
-        if self._shift_bit(0) != 0:  # read status
-            raise TransactionNotSuccessfulException()
-
-        return data
+        return self._execute([(addr, None)])[0]
 
     def write(self, addr, value):
-        self._shift_bit(0)  # wakeup
-        self._shift_bit(1)  # wakeup
-        self._shift_word(addr)  # address
-        self._shift_bit(1)  # write
-        self._shift_word(value)
-
-        # write wait
-        timeout = self.timeout
-        for t in range(timeout):
-            if self._shift_bit(1) == 1:
-                break
-            if t == timeout - 1:
-                raise TimeoutError()
-        if self._shift_bit(0) != 0:  # write status
+        self._execute([(addr, value)])
+
+    def read_block(self, offset, n_words):
+        return memoryview(array('I', self._execute([(offset + i * 4, None) for i in range(n_words)])))
+
+    def write_block(self, offset, buffer):
+        if isinstance(buffer, (list, tuple, range)):
+            buffer = array('I', buffer)
+        words = memoryview(buffer).cast('B').cast('I')
+        self._execute([(offset + i * 4, word) for i, word in enumerate(words)])
+
+    def transfer(self, ops):
+        """Execute a list of (addr, value, mask) word operations pipelined (see hardware_proxy.transfer())"""
+        results = []
+        transactions = []
+        for addr, value, mask in ops:
+            if mask == 0:
+                transactions.append((addr, None))
+            elif mask == 0xFFFF_FFFF:
+                transactions.append((addr, value))
+            else:  # we need the old value for the masked write; so we have to drain the pipeline here
+                transactions.append((addr, None))
+                *done, old = self._execute(transactions)
+                results += [r for r, (_, v) in zip(done, transactions) if v is None]
+                transactions = [(addr, old & ~mask | value & mask)]
+        done = self._execute(transactions)
+        results += [r for r, (_, v) in zip(done, transactions) if v is None]
+        return results
+
+    def _execute(self, transactions):
+        """
+        Execute a list of (addr, value) transactions. value None means read.
+        Up to max_in_flight transactions are sent before the replies are collected.
+        :return: the list of read values (None for writes)
+        """
+        results = []
+        sent = 0
+        try:
+            for addr, value in transactions:
+                if value is None:
+                    head_len, head = 35, 0b10 | (addr << 2)
+                else:
+                    head_len, head = 67, 0b10 | (addr << 2) | (1 << 34) | (value << 35)
+                self._send('naps_transaction {} {} 0x{:x} {} 0x{:x} {} 0x{:x} {}'.format(
+                    self.tap_name, head_len, head, self.WAIT_LEN, (1 << self.WAIT_LEN) - 1,
+                    self.TAIL_LEN, (1 << self.TAIL_LEN) - 1, self.timeout // self.WAIT_LEN + 1,
+                ))
+                sent += 1
+                if sent - len(results) == self.max_in_flight:
+                    results.append(self._parse_reply(*transactions[len(results)]))
+            while len(results) < len(transactions):
+                results.append(self._parse_reply(*transactions[len(results)]))
+        except (TimeoutError, TransactionNotSuccessfulException):
+            # the replies of the transactions that are still in flight would otherwise be taken for the replies of the
+            # next transactions
+            for _ in range(sent - len(results) - 1):
+                self._receive()
+            raise
+        return results
+
+    def _parse_reply(self, addr, value):
+        fields = self._receive().split()
+        if fields[-1] == "timeout":
+            raise TimeoutError("transaction at 0x{:x} timed out".format(addr))
+
+        # reassemble the tdo bits of all scans that belonged to the transaction
+        head_len = 35 if value is None else 67
+        lengths = [head_len] + [self.WAIT_LEN] * (len(fields) - 1)
+        if len(fields) > 2 and int(fields[-2], 16) != 0:  # the last field is the tail scan
+            lengths[-1] = self.TAIL_LEN
+        bits, position = 0, 0
+        for field, length in zip(fields, lengths):
+            bits |= int(field, 16) << position
+            position += length
+
+        reply = bits >> head_len
+        done = (reply & -reply).bit_length() - 1  # the connector signals completion with the first one on tdo
+        if value is None:
+            data = (reply >> (done + 1)) & 0xFFFF_FFFF
+            status = (reply >> (done + 33)) & 1
+        else:
+            data = None
+            status = (reply >> (done + 1)) & 1
+        if status != 0:
             raise TransactionNotSuccessfulException()
+        return data
 
-    def _writeline(self, message):
-        message += "\n"
-        self.s.send(message.encode('utf-8'))
-
-    def _readline(self, decode=True):
-        buf = b""
-
-        while buf[-2:] != b'> ':
-            buf += self.s.recv(1)
-
-        if decode and self.debug:
-            print(buf.decode('utf-8'))
-
-        buf = buf.rsplit(b'\r\n', 2)[1][1:]
-
-        if decode:
-            buf = buf.decode('utf-8')
-
-        return buf
-
-    def _writecmd(self, cmd):
-        self._writeline(cmd)
-        ret = self._readline()
+    def _send(self, command):
         if self.debug:
-            print(cmd, "->", ret)
-        return ret
-
-    def _shift_word(self, write):
-        return int(self._drscan(32, write), 16)
-
-    def _shift_bit(self, write):
-        return int(self._drscan(1, write), 16)
-
-    def _irscan(self, instruction):
-        return self._writecmd('irscan {} {}'.format(self.tap_name, instruction))
+            print("->", command[:100])
+        self.s.sendall(command.encode('utf-8') + b'\x1a')
+
+    def _receive(self):
+        while (end := self._buf.find(b'\x1a')) == -1:
+            chunk = self.s.recv(65536)
+            if not chunk:
+                raise ConnectionError("openocd closed the connection")
+            self._buf += chunk
+        reply = self._buf[:end].decode('utf-8')
+        del self._buf[:end + 1]
+        if self.debug:
+            print("<-", reply)
+        return reply
 
-    def _drscan(self, len, value):
-        return self._writecmd('drscan {} {} {}'.format(self.tap_name, len, value))
+    def _command(self, command):
+        self._send(command)
+        return self._receive()
 
 
 MemoryAccessor = JTAGAccessor
@@ -0,0 +1,67 @@
+import unittest
+
+from .fake_openocd import FakeOpenOCD
+from .memory_accessor_openocd import JTAGAccessor, TransactionNotSuccessfulException
+
+
+class JTAGAccessorTest(unittest.TestCase):
+    def check_read_write(self, latency):
+        with FakeOpenOCD(latency=latency) as server:
+            accessor = JTAGAccessor(port=server.port, spawn_server=False)
+            for addr in range(0, 64, 4):
+                accessor.write(addr, 0xDEAD_0000 | addr)
+            self.assertEqual(server.memory, {addr: 0xDEAD_0000 | addr for addr in range(0, 64, 4)})
+            for addr in range(0, 64, 4):
+                self.assertEqual(accessor.read(addr), 0xDEAD_0000 | addr)
+
+    def test_read_write(self):
+        self.check_read_write(latency=3)
+
+    def test_read_write_tail_scan(self):
+        self.check_read_write(latency=JTAGAccessor.WAIT_LEN - JTAGAccessor.TAIL_LEN + 2)
+
+    def test_read_write_slow_peripheral(self):
+        self.check_read_write(latency=3 * JTAGAccessor.WAIT_LEN + 5)
+
+    def test_block_and_transfer(self):
+        with FakeOpenOCD() as server:
+            accessor = JTAGAccessor(port=server.port, spawn_server=False, max_in_flight=8)
+            accessor.write_block(0x100, list(range(100)))
+            self.assertEqual(accessor.read_block(0x100, 100).tolist(), list(range(100)))
+            results = accessor.transfer([(0x100, 0, 0), (0x104, 0xFF00, 0xFF00), (0x108, 7, 0xFFFF_FFFF), (0x104, 0, 0)])
+            self.assertEqual(results, [0, 0xFF01])
+            self.assertEqual(server.memory[0x108], 7)
+
+    def test_error(self):
+        with FakeOpenOCD(error_addresses=[0x40]) as server:
+            accessor = JTAGAccessor(port=server.port, spawn_server=False)
+            with self.assertRaises(TransactionNotSuccessfulException):
+                accessor.read(0x40)
+            accessor.write(0x44, 1)
+            self.assertEqual(accessor.read(0x44), 1)
+
+    def test_error_in_pipeline(self):
+        with FakeOpenOCD(error_addresses=[0x40]) as server:
+            accessor = JTAGAccessor(port=server.port, spawn_server=False, max_in_flight=8)
+            server.memory.update({i * 4: 100 + i for i in range(32)})
+            with self.assertRaises(TransactionNotSuccessfulException):
+                accessor.read_block(0x0, 32)
+            # the replies of the transactions after the failed one are not mistaken for the replies of later reads
+            self.assertEqual(accessor.read(0x0), 100)
+            self.assertEqual(accessor.read_block(0x10, 4).tolist(), [104, 105, 106, 107])
+
+    def test_timeout(self):
+        with FakeOpenOCD(latency=10_000) as server:
+            accessor = JTAGAccessor(port=server.port, spawn_server=False, timeout=100)
+            with self.assertRaises(TimeoutError):
+                accessor.read(0x0)
+
+    def test_pipelined_block_read(self):
+        n_words = 2048
+        with FakeOpenOCD(scan_latency=100e-6) as server:
+            accessor = JTAGAccessor(port=server.port, spawn_server=False)
+            server.memory.update({i * 4: i * 3 for i in range(n_words)})
+            scans = server.scans
+            self.assertEqual(accessor.read_block(0, n_words).tolist(), [i * 3 for i in range(n_words)])
+            # fast transactions need a single scan each
+            self.assertEqual(server.scans - scans, n_words)
@@ -1,3 +1,4 @@
+from array import array
 from multiprocessing import Pipe
 from threading import Thread
 from amaranth import Fragment, Module, DomainRenamer, ClockDomain, ClockSignal
@@ -59,6 +60,15 @@ class SimSocPlatform(SocPlatform):
                     def write(self, offset, to_write):
                         conn.send(('write', offset, to_write))
 
+                    def read_block(self, offset, n_words):
+                        conn.send(('read_block', offset, n_words))
+                        return memoryview(conn.recv())
+
+                    def write_block(self, offset, buffer):
+                        if isinstance(buffer, (list, tuple, range)):
+                            buffer = array('I', buffer)
+                        conn.send(('write_block', offset, array('I', memoryview(buffer).cast('B').cast('I'))))
+
                 g = {}
                 exec(self.driver, g, g)
                 Design = g["Design"]
@@ -100,6 +110,16 @@ class SimSocPlatform(SocPlatform):
                     elif cmd == "write":
                         address, data = rest
                         yield from axil_write(self.axi_lite_master, address, data)
+                    elif cmd == "read_block":
+                        address, n_words = rest
+                        result = array('I')
+                        for i in range(n_words):
+                            result.append((yield from axil_read(self.axi_lite_master, address + i * 4)))
+                        conn.send(result)
+                    elif cmd == "write_block":
+                        address, words = rest
+                        for i, word in enumerate(words):
+                            yield from axil_write(self.axi_lite_master, address + i * 4, word)
                     elif cmd == 'amaranth':
                         payload, = rest
                         conn.send((yield payload))
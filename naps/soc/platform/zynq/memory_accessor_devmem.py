@@ -1,6 +1,7 @@
 import mmap
 import os
 import struct
+from array import array
 from math import ceil
 
 
@@ -20,6 +21,7 @@ class DevMemAccessor:
 
         self.f = os.open(filename, os.O_RDWR | os.O_SYNC)
         self.mem = mmap.mmap(self.f, bytes, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE, offset=base_addr)
+        self.words = memoryview(self.mem).cast('I')
 
     def __del__(self):
         os.close(self.f)
@@ -30,3 +32,16 @@ class DevMemAccessor:
     def write(self, offset, to_write):
         self.mem[offset:offset + 4] = struct.pack('I', to_write)
 
+    # the peripherals behind the axi lite bus expect single aligned 32 bit accesses. slice copies of the mapping are
+    # done by memcpy / memmove which choose their own access widths, therefore every word is accessed on its own.
+    def read_block(self, offset, n_words):
+        start = offset // 4
+        return memoryview(array('I', map(self.words.__getitem__, range(start, start + n_words))))
+
+    def write_block(self, offset, buffer):
+        if isinstance(buffer, (list, tuple, range)):
+            buffer = array('I', buffer)
+        words = memoryview(buffer).cast('B').cast('I')
+        start = offset // 4
+        for i, word in enumerate(words):
+            self.words[start + i] = word
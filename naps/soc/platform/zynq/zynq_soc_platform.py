@@ -7,7 +7,7 @@ from ... import *
 
 __all__ = ["ZynqSocPlatform"]
 
-from ...fatbitstream import File
+from ...fatbitstream import File, BuildDirProducts, build_product_file
 
 
 class ZynqSocPlatform(SocPlatform):
@@ -17,7 +17,17 @@ class ZynqSocPlatform(SocPlatform):
     def can_wrap(platform):
         return isinstance(platform, XilinxPlatform) and platform.device.startswith("xc7z")
 
-    def __init__(self, platform, use_axi_interconnect=False):
+    def __init__(self, platform, use_axi_interconnect=False, use_axi_crossbar=False):
+        """
+        :param use_axi_interconnect: connect every peripheral with its own AXI Lite connector through an AxiInterconnect
+        :param use_axi_crossbar: connect every peripheral to its own port of a full AXI crossbar. this allows bursts
+                                 and multiple outstanding transactions (reads and writes are independent).
+                                 Transactions with different AXI ids can access different peripherals at the same time;
+                                 transactions with the same id are kept in order and wait while another peripheral is
+                                 answering that id. In simulation the full AXI master is available as
+                                 `axi_full_master`. Peripherals that provide pipelined handlers (like SocMemory) are
+                                 connected with a full AXI connector and serve one burst beat per cycle.
+        """
         from naps.vendor.xilinx_s7 import PS7
 
         super().__init__(platform)
@@ -25,13 +35,37 @@ class ZynqSocPlatform(SocPlatform):
         self.final_to_inject_subfragments.append((self.ps7, "ps7"))
 
         def peripherals_connect_hook(platform, top_fragment: Fragment):
-            from naps.cores.axi import AxiEndpoint, AxiLitePeripheralConnector, AxiFullToLiteBridge, AxiInterconnect
+            from naps.cores.axi import AxiEndpoint, AxiLitePeripheralConnector, AxiPeripheralConnector, AxiFullToLiteBridge, AxiInterconnect, AxiCrossbar
 
             if platform.peripherals:
                 m = Module()
                 platform.ps7.fck_domain(domain_name="axi_lite", requested_frequency=10e6)
                 if not hasattr(platform, "is_sim"):  # we are not in a simulation platform
                     axi_full_port: AxiEndpoint = platform.ps7.get_axi_gp_master(ClockSignal("axi_lite"))
+                elif use_axi_crossbar:  # we are in a simulation platform
+                    axi_full_port = AxiEndpoint(addr_bits=32, data_bits=32, lite=False, id_bits=12)
+                    self.axi_full_master = axi_full_port
+
+                m.domains += ClockDomain(PERIPHERAL_DOMAIN)
+                m.d.comb += ClockSignal(PERIPHERAL_DOMAIN).eq(ClockSignal("axi_lite"))
+
+                if use_axi_crossbar:
+                    crossbar = m.submodules.crossbar = DomainRenamer("axi_lite")(AxiCrossbar([axi_full_port]))
+                    for peripheral in platform.peripherals:
+                        port = crossbar.get_port(peripheral.range())
+                        if peripheral.handle_read_pipelined is not None or peripheral.handle_write_pipelined is not None:
+                            connector = DomainRenamer(PERIPHERAL_DOMAIN)(AxiPeripheralConnector(peripheral, id_bits=port.id_bits))
+                            m.d.comb += port.connect_downstream(connector.axi)
+                            m.submodules += connector
+                            continue
+                        bridge = DomainRenamer(PERIPHERAL_DOMAIN)(AxiFullToLiteBridge(port))
+                        connector = DomainRenamer(PERIPHERAL_DOMAIN)(AxiLitePeripheralConnector(peripheral))
+                        m.d.comb += bridge.lite_master.connect_downstream(connector.axi)
+                        m.submodules += [bridge, connector]
+                    platform.to_inject_subfragments.append((m, "axi_lite"))
+                    return
+
+                if not hasattr(platform, "is_sim"):  # we are not in a simulation platform
                     axi_lite_bridge = m.submodules.axi_lite_bridge = DomainRenamer("axi_lite")(
                         AxiFullToLiteBridge(axi_full_port)
                     )
@@ -39,9 +73,6 @@ class ZynqSocPlatform(SocPlatform):
                 else:  # we are in a simulation platform
                     axi_lite_master = AxiEndpoint(addr_bits=32, data_bits=32, lite=True)
                     self.axi_lite_master = axi_lite_master
-                
-                m.domains += ClockDomain(PERIPHERAL_DOMAIN)
-                m.d.comb += ClockSignal(PERIPHERAL_DOMAIN).eq(ClockSignal("axi_lite"))
 
                 if use_axi_interconnect:
                     interconnect = m.submodules.interconnect = DomainRenamer("axi_lite")(
@@ -52,7 +83,7 @@ class ZynqSocPlatform(SocPlatform):
                         m.d.comb += interconnect.get_port().connect_downstream(connector.axi)
                         m.submodules += connector
                 else:
-                    aggregator = PeripheralsAggregator()
+                    aggregator = PeripheralsAggregator(register_decode=True)
                     for peripheral in platform.peripherals:
                         aggregator.add_peripheral(peripheral)
                     connector = DomainRenamer(PERIPHERAL_DOMAIN)(AxiLitePeripheralConnector(aggregator))
@@ -61,9 +92,49 @@ class ZynqSocPlatform(SocPlatform):
                 platform.to_inject_subfragments.append((m, "axi_lite"))
         self.prepare_hooks.append(peripherals_connect_hook)
 
+        def interrupts_hook(platform, top_fragment: Fragment):
+            from naps.soc.pydriver.hardware_proxy import uio_interrupt_name
+
+            interrupt_signals = []
+
+            def collect(memorymap):
+                for row in memorymap.direct_children:
+                    if isinstance(row.obj, StatusSignal) and row.obj._interrupt:
+                        if not any(row.obj is signal for signal, _ in interrupt_signals):
+                            interrupt_signals.append((row.obj, memorymap.own_offset.translate(row.address)))
+                for row in memorymap.subranges:
+                    collect(row.obj)
+            collect(platform.memorymap)
+
+            for signal, address in interrupt_signals:
+                irq = platform.ps7.get_irq_f2p(signal.as_value().any())
+                # the uio_pdrv_genirq driver only binds to the generic-uio compatible if it is told to do so
+                fc = FatbitstreamContext.get(platform)
+                fc.add_cmd_unique("modprobe uio_pdrv_genirq of_id=generic-uio 2>/dev/null || true", CommandPosition.Front)
+                overlay_content = """
+                    %overlay_name% {
+                        compatible = "generic-uio";
+                        interrupt-parent = <&intc>;
+                        interrupts = <0 %irq% 4>;
+                    };
+                """
+                devicetree_overlay(
+                    platform, uio_interrupt_name(address.address, address.bit_offset), overlay_content, {"irq": str(irq)}
+                )
+        self.prepare_hooks.append(interrupts_hook)
+
     def pack_bitstream_fatbitstream(self, name: str, build_products: BuildProducts):
         from .to_raw_bitstream import bit2bin
-        bitstream = bit2bin(build_products.get(f"{name}.bit"))
+        if isinstance(build_products, BuildDirProducts):
+            # the converted bitstream is kept with the build products so that it is streamed into the blob store and
+            # cached builds do not convert it again
+            bitstream = build_products.path(f"{name}_fpga_manager.bin")
+            if not bitstream.exists():
+                tmp = bitstream.with_name(f"{bitstream.name}.tmp")
+                tmp.write_bytes(bit2bin(build_products.get(f"{name}.bit")))
+                tmp.replace(bitstream)
+        else:
+            bitstream = bit2bin(build_products.get(f"{name}.bit"))
         yield File("bitstream.bin", bitstream)
         yield f"cp bitstream.bin /usr/lib/firmware/{name}.bin"
         yield f"echo {name}.bin > /sys/class/fpga_manager/fpga0/firmware"
@@ -1,4 +1,5 @@
 from naps import naps_getenv
+from naps.soc.fatbitstream import read_fatbitstream_manifest
 import paramiko
 from paramiko import SSHClient
 from pathlib import Path
@@ -16,7 +17,7 @@ def u(s, encoding="utf8"):
     else:
         raise TypeError(f"Expected unicode or bytes, got {type(s)}")
 
-__all__ = ["program_fatbitstream_ssh"]
+__all__ = ["program_fatbitstream_ssh", "upload_fatbitstream"]
 
 default_host = naps_getenv("SSH_HOST", "10.42.0.1")
 default_user = naps_getenv("SSH_USER", "operator")
@@ -64,6 +65,58 @@ def interactive_shell(stdin, stdout, stderr):
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, oldtty)
 
 
+def sftp_mkdir(sftp, path):
+    try:
+        sftp.mkdir(path)
+    except IOError as e:
+        # ignore if dir is already existing
+        if e.errno:
+            raise e
+
+
+def upload_fatbitstream(sftp, fatbitstream_file: Path, dir="fatbitstreams"):
+    """
+    Uploads a fatbitstream and the blobs it references to dir. Blobs that are already present on the target
+    (with a matching name, which is their hash, and size) are not sent again. Blobs that are not referenced by any
+    fatbitstream in dir any more are deleted.
+    :return: the number of uploaded bytes
+    """
+    local_blob_dir = fatbitstream_file.parent / "blobs"
+    sftp_mkdir(sftp, dir)
+    sftp.chdir(dir)
+    sftp_mkdir(sftp, "blobs")
+    remote_blobs = {attr.filename: attr.st_size for attr in sftp.listdir_attr("blobs")}
+
+    uploaded = 0
+    for digest in sorted(set(read_fatbitstream_manifest(fatbitstream_file).values())):
+        size = (local_blob_dir / digest).stat().st_size
+        if remote_blobs.get(digest) == size:
+            continue
+        # upload to a temporary name first so that interrupted uploads never leave a truncated blob
+        sftp.put(str(local_blob_dir / digest), f"blobs/{digest}.tmp")
+        sftp.posix_rename(f"blobs/{digest}.tmp", f"blobs/{digest}")
+        uploaded += size
+
+    sftp.put(str(fatbitstream_file), fatbitstream_file.name)
+    sftp.chmod(fatbitstream_file.name, 0o777)
+    remove_unreferenced_blobs(sftp)
+    return uploaded + fatbitstream_file.stat().st_size
+
+
+def remove_unreferenced_blobs(sftp):
+    """
+    Deletes the blobs (and leftovers of interrupted uploads) in the blobs directory below the current remote directory
+    that are not referenced by any of the fatbitstreams in it.
+    """
+    referenced = set()
+    for name in sftp.listdir("."):
+        if name.endswith(".fatbitstream"):
+            referenced.update(read_fatbitstream_manifest(Path(name), sftp.open(name, "r")).values())
+    for name in sftp.listdir("blobs"):
+        if name not in referenced:
+            sftp.remove(f"blobs/{name}")
+
+
 def program_fatbitstream_ssh(fatbitstream_file: Path, *, run=False, dir="fatbitstreams", **kwargs):
     name = fatbitstream_file.name
     with SSHClient() as client:
@@ -72,17 +125,8 @@ def program_fatbitstream_ssh(fatbitstream_file: Path, *, run=False, dir="fatbits
         client.connect(hostname=default_host, username=default_user, password=default_password)
 
         with client.open_sftp() as sftp:
-            try:
-                sftp.mkdir(f"{dir}")
-            except IOError as e:
-                # ignore if dir is already existing
-                if e.errno:
-                    raise e
-
-            sftp.chdir(dir)
-            with sftp.file(name, "w") as f:
-                f.write(fatbitstream_file.read_bytes())
-                f.chmod(0o777)
+            uploaded = upload_fatbitstream(sftp, fatbitstream_file, dir)
+            print(f"uploaded {uploaded / 1024:.1f} KiB")
 
         (stdin, stdout, stderr) = client.exec_command(f"cd {dir} && sudo ./{name} {'--run' if run else ''}\n",
                                                       get_pty=True)
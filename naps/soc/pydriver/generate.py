@@ -1,7 +1,11 @@
+import py_compile
 import re
+import sys
 from enum import Enum
-from inspect import getsource
+from inspect import getsource, iscoroutinefunction
+from math import ceil
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from textwrap import indent, dedent
 
 from amaranth.build import Platform
@@ -17,34 +21,42 @@ def gen_hardware_proxy_python_code(mmap: MemoryMap, name="design", superclass=""
     name = name.lower()
     class_name = ("_" if not top else "") + name.capitalize()
     to_return = "class {}({}):\n".format(class_name, superclass)
-    for row in mmap.direct_children:
-        address = mmap.own_offset.translate(row.address)
-        if isinstance(row.obj, (ControlSignal, StatusSignal)):
-            if isinstance(row.obj.decoder, type) and issubclass(row.obj.decoder, Enum):
-                decoder = {entry.name: entry.value for entry in row.obj.decoder}
-            elif callable(row.obj.decoder):
+    to_return += "    __slots__ = ()\n"
+    if top:
+        to_return += f"    _cpu_owned_words = frozenset({{{', '.join(f'0x{a:02x}' for a in sorted(cpu_owned_words(mmap)))}}})\n"
+    rows = [(row.name, row.obj, mmap.own_offset.translate(row.address)) for row in mmap.direct_children]
+    # aliases are resources that are allocated somewhere else in the hierarchy but are also reachable from here
+    for name, obj in mmap.aliases.items():
+        address = mmap.find_recursive(obj, go_up=True)
+        if address is not None and not any(name == row_name for row_name, _, _ in rows):
+            rows.append((name, obj, address))
+    for row_name, obj, address in rows:
+        if isinstance(obj, (ControlSignal, StatusSignal)):
+            if isinstance(obj.decoder, type) and issubclass(obj.decoder, Enum):
+                decoder = {entry.name: entry.value for entry in obj.decoder}
+            elif callable(obj.decoder):
                 decoder = {}
-                r = range(0, 2**row.obj.width) if not row.obj.signed else range(-2**(row.obj.width - 1), 2**(row.obj.width - 1))
+                r = range(0, 2**obj.width) if not obj.signed else range(-2**(obj.width - 1), 2**(obj.width - 1))
                 for i in r:
                     try:
-                        decoder[i] = row.obj.decoder(i)
+                        decoder[i] = obj.decoder(i)
                     except KeyError:
                         pass
-            elif row.obj.decoder is None:
+            elif obj.decoder is None:
                 decoder = None
             else:
-                raise TypeError(f"unknown decoder type {row.obj.decoder.__class__}")
+                raise TypeError(f"unknown decoder type {obj.decoder.__class__}")
             writable = True
             readable = True
-            if isinstance(row.obj, StatusSignal):
+            if isinstance(obj, StatusSignal):
                 writable = False
-            rhs = f"Value(0x{address.address:02x}, {address.bit_offset}, {address.bit_len}, {decoder}, {writable}, {readable})"
-        elif isinstance(row.obj, EventReg):
-            rhs = f"Value(0x{address.address:02x}, {address.bit_offset}, {address.bit_len}, None, True, True)"
+            rhs = f"value_property({row_name!r}, 0x{address.address:02x}, {address.bit_offset}, {address.bit_len}, {decoder}, {writable}, {readable})"
+        elif isinstance(obj, EventReg):
+            rhs = f"value_property({row_name!r}, 0x{address.address:02x}, {address.bit_offset}, {address.bit_len}, None, True, True)"
         else:
             rhs = f"Blob(0x{address.address:02x}, {address.bit_offset}, {address.bit_len})"
         to_return += indent(
-            f"{row.name} = {rhs}\n",
+            f"{row_name} = {rhs}\n",
             "    "
         )
     init_function_seen = False
@@ -55,6 +67,9 @@ def gen_hardware_proxy_python_code(mmap: MemoryMap, name="design", superclass=""
             function_body_without_decorator = re.sub("^@.*$", "", function_body, flags=re.MULTILINE).strip()
             function_string = ("@property\n" if item.is_property else "") + function_body_without_decorator
             to_return += indent("\n" + function_string + "\n", "    ")
+            if iscoroutinefunction(item.function):
+                assert not item.is_property, "driver_property()s cannot be async"
+                to_return += indent(f"{item.function.__name__} = AsyncDriverMethod({item.function.__name__})\n", "    ")
             if item.is_init:
                 assert not init_function_seen, "only one function can be driver_init()"
                 init_function_seen = True
@@ -70,6 +85,30 @@ def gen_hardware_proxy_python_code(mmap: MemoryMap, name="design", superclass=""
     return to_return
 
 
+def cpu_owned_words(mmap: MemoryMap):
+    """
+    Find the (absolute) addresses of all the words that can only be changed by the cpu.
+    These are words that contain only ControlSignals that have no read strobe.
+    Other rows (e.g. memories) never share words with csrs and are not cached at all.
+    """
+    cpu_words, hardware_words = set(), set()
+
+    def collect(mmap):
+        for row in mmap.direct_children:
+            address = mmap.own_offset.translate(row.address)
+            n_words = ceil((address.bit_offset + address.bit_len) / 32)
+            words = range(address.address, address.address + n_words * 4, 4)
+            if isinstance(row.obj, ControlSignal) and row.obj._read_strobe is None:
+                cpu_words.update(words)
+            elif isinstance(row.obj, (ControlSignal, StatusSignal, EventReg)):
+                hardware_words.update(words)
+        for row in mmap.subranges:
+            collect(row.obj)
+
+    collect(mmap)
+    return cpu_words - hardware_words
+
+
 def generate_pydriver(top_memorymap, memory_accessor):
     pycode = "# pydriver hardware access file"
     pycode += "\n\n## HARDWARE PROXY STATIC: ###\n"
@@ -83,9 +122,27 @@ def generate_pydriver(top_memorymap, memory_accessor):
     return pycode
 
 
+def compile_pydriver(pydriver: str) -> File:
+    """
+    Precompile the pydriver so that the target does not need to do that on every start.
+    The bytecode is only used if the target runs the same python version as the build host; otherwise it is ignored.
+    It is checked against the hash of the source, so it does not depend on the file modification times.
+    """
+    with TemporaryDirectory() as tmp:
+        source = Path(tmp) / "pydriver.py"
+        source.write_text(pydriver)
+        bytecode = Path(tmp) / "pydriver.pyc"
+        py_compile.compile(
+            str(source), cfile=str(bytecode), doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH
+        )
+        return File(f"__pycache__/pydriver.{sys.implementation.cache_tag}.pyc", bytecode.read_bytes())
+
+
 def pydriver_hook(platform: Platform, top_fragment):
     if hasattr(platform, "pydriver_memory_accessor"):
         memorymap = top_fragment.memorymap
         pydriver = generate_pydriver(memorymap, platform.pydriver_memory_accessor(memorymap))
         fc = FatbitstreamContext.get(platform)
         fc += File("pydriver.py", pydriver)
+        fc += compile_pydriver(pydriver)
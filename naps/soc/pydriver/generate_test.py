@@ -0,0 +1,51 @@
+import importlib.machinery
+import importlib.util
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from naps.soc.pydriver.generate import generate_pydriver, compile_pydriver
+from naps.soc.test_util import big_memorymap
+
+
+ACCESSOR = """
+class DictAccessor(MemoryAccessor):
+    def __init__(self):
+        self.memory = {}
+
+    def read(self, addr):
+        return self.memory.get(addr, 0)
+
+    def write(self, addr, value):
+        self.memory[addr] = value
+"""
+
+
+class GeneratePydriverTest(unittest.TestCase):
+    def test_compiled_pydriver(self):
+        pydriver = generate_pydriver(big_memorymap(), ACCESSOR)
+        bytecode = compile_pydriver(pydriver)
+        self.assertTrue(bytecode.name.startswith("__pycache__/pydriver."))
+        # the bytecode is checked against the hash of the source
+        self.assertEqual(bytecode.contents[8:16], importlib.util.source_hash(pydriver.encode()))
+
+        with TemporaryDirectory() as tmp:
+            pyc = Path(tmp) / "pydriver.pyc"
+            pyc.write_bytes(bytecode.contents)
+            loader = importlib.machinery.SourcelessFileLoader("pydriver", str(pyc))
+            module = importlib.util.module_from_spec(importlib.util.spec_from_loader("pydriver", loader))
+            loader.exec_module(module)
+        design = module.Design(module.DictAccessor())
+        design.bank199.csr0 = 42
+        self.assertEqual(design.bank199.csr0, 42)
+
+    def test_lazy_children(self):
+        namespace = {"__name__": "pydriver"}
+        exec(generate_pydriver(big_memorymap(n_banks=3), ACCESSOR), namespace)
+        design = namespace["Design"](namespace["DictAccessor"]())
+        self.assertNotIn("bank0", vars(design))
+        self.assertIn("bank0", dir(design))
+        design.bank0.csr0 = 1
+        self.assertIs(design.bank0, vars(design)["bank0"])
+        with self.assertRaises(AttributeError):
+            design.bank3
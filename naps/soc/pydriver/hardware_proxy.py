@@ -1,11 +1,24 @@
+import asyncio
+import os
+import struct
 from abc import ABC, abstractmethod
+from array import array
 from dataclasses import dataclass
+from functools import wraps, lru_cache
 from textwrap import indent
 from math import ceil
 from inspect import stack
 
 
+WORD_MASK = 0xFFFF_FFFF
+POLL_INTERVAL = 100e-6  # seconds between two reads when waiting for a register without an interrupt
+
+
 class MemoryAccessor(ABC):
+    """
+    Accesses the 32 bit words of the bus. Accessors can optionally implement a vectored
+    `transfer(ops)` method (see `transfer()`) to execute many word operations in one go.
+    """
     base = 0
 
     @abstractmethod
@@ -16,6 +29,237 @@ class MemoryAccessor(ABC):
     def write(self, addr, value):
         raise NotImplementedError()
 
+    def read_block(self, offset, n_words):
+        """
+        Read n_words consecutive words starting at offset.
+        :return: a memoryview of 32 bit words (format 'I') that holds a copy of the words; it does not change when the
+                 hardware does
+        """
+        return memoryview(array("I", (self.read(offset + i * 4) for i in range(n_words))))
+
+    def write_block(self, offset, buffer):
+        """
+        Write consecutive words starting at offset.
+        :param buffer: anything supporting the buffer protocol with 32 bit words (e.g. a numpy uint32 array) or a list of ints
+        """
+        for i, word in enumerate(as_words(buffer)):
+            self.write(offset + i * 4, word)
+
+
+def as_words(buffer):
+    """Interpret a buffer (or a list of ints) as a memoryview of 32 bit words without copying it if possible"""
+    if isinstance(buffer, (list, tuple, range)):
+        buffer = array("I", buffer)
+    return memoryview(buffer).cast("B").cast("I")
+
+
+def transfer(memory_accessor, ops):
+    """
+    Execute a list of (addr, value, mask) word operations. A mask of 0 reads the word, a full mask writes it and
+    every other mask does a read-modify-write of the masked bits.
+    Uses the vectored `transfer` method of the accessor if it has one.
+    :return: the list of the words that were read
+    """
+    vectored_transfer = getattr(memory_accessor, "transfer", None)
+    if vectored_transfer is not None:
+        return vectored_transfer(ops)
+
+    results = []
+    for addr, value, mask in ops:
+        if mask == 0:
+            results.append(memory_accessor.read(addr))
+        elif mask == WORD_MASK:
+            memory_accessor.write(addr, value)
+        else:
+            memory_accessor.write(addr, memory_accessor.read(addr) & ~mask | value & mask)
+    return results
+
+
+def write_masked(memory_accessor, addr, value, mask):
+    """Write the masked bits of a word. Only does a read-modify-write if the mask does not cover the whole word."""
+    if mask == WORD_MASK:
+        memory_accessor.write(addr, value)
+    elif hasattr(memory_accessor, "write_masked"):
+        memory_accessor.write_masked(addr, value, mask)
+    else:
+        memory_accessor.write(addr, memory_accessor.read(addr) & ~mask | value & mask)
+
+
+class Batch:
+    """
+    A memory accessor that queues the register accesses of a HardwareProxy tree.
+    Writes to the same word are merged into one masked write, repeated reads of cpu owned words (words that only
+    contain ControlSignals) are served locally and everything is flushed as one vectored `transfer()` when the batch
+    ends. All other reads flush the queued writes first to keep the order of side effects and always go to the
+    hardware because it may change the word (e.g. a StatusSignal) at any time.
+    """
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.memory_accessor = proxy._memory_accessor
+        self.base = self.memory_accessor.base
+        self.cpu_owned_words = frozenset(addr - self.base for addr in getattr(proxy, "_cpu_owned_words", ()))
+        self.depth = 0
+        self.known = {}  # cpu owned word address -> value of the whole word as the batch knows it
+        self.pending = {}  # word address -> (value, mask) of the queued writes
+
+    def read(self, addr):
+        if addr in self.known:
+            return self.known[addr]
+        self.flush()
+        value, = transfer(self.memory_accessor, [(addr, 0, 0)])
+        if addr in self.cpu_owned_words:
+            self.known[addr] = value
+        return value
+
+    def write(self, addr, value):
+        self.write_masked(addr, value, WORD_MASK)
+
+    def write_masked(self, addr, value, mask):
+        value &= mask
+        if addr in self.pending:
+            old_value, old_mask = self.pending[addr]
+            self.pending[addr] = (old_value & ~mask | value, old_mask | mask)
+        else:
+            self.pending[addr] = (value, mask)
+        if addr in self.known:
+            self.known[addr] = self.known[addr] & ~mask | value
+        elif mask == WORD_MASK and addr in self.cpu_owned_words:
+            self.known[addr] = value
+
+    def read_block(self, offset, n_words):
+        self.flush()
+        return self.memory_accessor.read_block(offset, n_words)
+
+    def write_block(self, offset, buffer):
+        self.flush()
+        words = as_words(buffer)
+        for i in range(len(words)):
+            self.known.pop(offset + i * 4, None)
+        self.memory_accessor.write_block(offset, words)
+
+    def flush(self):
+        ops = []
+        for addr, (value, mask) in self.pending.items():
+            if addr in self.known:  # we know the rest of the word so we dont have to read it back
+                ops.append((addr, self.known[addr], WORD_MASK))
+            else:
+                ops.append((addr, value, mask))
+        self.pending = {}
+        if ops:
+            transfer(self.memory_accessor, ops)
+
+    def __enter__(self):
+        if self.depth == 0:
+            install_memory_accessor(self.proxy, self)
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.depth -= 1
+        if self.depth == 0:
+            install_memory_accessor(self.proxy, self.memory_accessor)
+            if exc_type is None:
+                self.flush()
+            self.pending = {}
+            self.known = {}
+
+
+
+class ShadowRegisters:
+    """
+    A memory accessor that keeps a local copy of the words that are only ever written by the cpu (i.e. words that only
+    contain ControlSignals). Reads of these words are served from the copy and writes to parts of them do not need to
+    read the word back. All other words (StatusSignals, EventRegs, memories, ...) are passed through.
+    The copy is only valid as long as nobody else changes the hardware; call invalidate() or sync() after
+    e.g. reloading the bitstream.
+    """
+
+    def __init__(self, memory_accessor, cpu_owned_words):
+        self.memory_accessor = memory_accessor
+        self.base = memory_accessor.base
+        self.cpu_owned_words = frozenset(addr - self.base for addr in cpu_owned_words)
+        self.cache = {}  # word address -> value
+
+    def invalidate(self):
+        """Forget the local copy. The words are read from the hardware again on their next access."""
+        self.cache = {}
+
+    def sync(self):
+        """Reread all the cpu owned words from the hardware into the local copy"""
+        addresses = sorted(self.cpu_owned_words)
+        self.cache = dict(zip(addresses, transfer(self.memory_accessor, [(addr, 0, 0) for addr in addresses])))
+
+    def read(self, addr):
+        if addr in self.cache:
+            return self.cache[addr]
+        value = self.memory_accessor.read(addr)
+        if addr in self.cpu_owned_words:
+            self.cache[addr] = value
+        return value
+
+    def write(self, addr, value):
+        self.memory_accessor.write(addr, value)
+        if addr in self.cpu_owned_words:
+            self.cache[addr] = value
+
+    def write_masked(self, addr, value, mask):
+        if addr in self.cpu_owned_words:
+            self.write(addr, self.read(addr) & ~mask | value & mask)
+        else:
+            write_masked(self.memory_accessor, addr, value, mask)
+
+    def read_block(self, offset, n_words):
+        return self.memory_accessor.read_block(offset, n_words)
+
+    def write_block(self, offset, buffer):
+        words = as_words(buffer)
+        self.memory_accessor.write_block(offset, words)
+        for i, word in enumerate(words):
+            if offset + i * 4 in self.cpu_owned_words:
+                self.cache[offset + i * 4] = word
+
+    def transfer(self, ops):
+        forwarded = []
+        planned_reads = []  # the cached value or None if the word is read from the hardware
+        cache_results = []  # the address to cache the result of a forwarded read at or None
+        last_access = {addr: i for i, (addr, _, _) in enumerate(ops)}
+        for i, (addr, value, mask) in enumerate(ops):
+            cpu_owned = addr in self.cpu_owned_words
+            if mask == 0:
+                if addr in self.cache:
+                    planned_reads.append(self.cache[addr])
+                else:
+                    forwarded.append((addr, 0, 0))
+                    planned_reads.append(None)
+                    cache_results.append(addr if cpu_owned and last_access[addr] == i else None)
+            elif cpu_owned and (mask == WORD_MASK or addr in self.cache):
+                value = self.cache.get(addr, 0) & ~mask | value & mask
+                forwarded.append((addr, value, WORD_MASK))
+                self.cache[addr] = value
+            else:  # we do not know the other bits of the word, so the accessor has to do a read-modify-write
+                forwarded.append((addr, value, mask))
+
+        forwarded_results = iter(transfer(self.memory_accessor, forwarded))
+        cache_results = iter(cache_results)
+        results = []
+        for planned in planned_reads:
+            if planned is None:
+                planned = next(forwarded_results)
+                cache_at = next(cache_results)
+                if cache_at is not None:
+                    self.cache[cache_at] = planned
+            results.append(planned)
+        return results
+
+
+def install_memory_accessor(proxy, memory_accessor):
+    """Make a proxy and all its children use a different memory accessor"""
+    proxy._memory_accessor = memory_accessor
+    for child in vars(proxy).values():
+        if isinstance(child, HardwareProxy):
+            install_memory_accessor(child, memory_accessor)
+
 
 class BitwiseAccessibleInteger:
     def __init__(self, value=0):
@@ -68,6 +312,75 @@ class Value:
         self.word_aligned_inverse_bit_mask = (2**(num_words * 32) - 1) ^ self.bit_mask
 
 
+class ValueProperty(property):
+    """A property that reads / writes a Value. The `value` attribute holds the description of the Value."""
+
+
+def value_property(name, address, bit_start, bit_len, decoder, writable, readable):
+    """
+    Build a property for a Value with getter and setter closures that have the address, shift and masks baked in.
+    This is what the generated pydriver uses for every ControlSignal, StatusSignal and EventReg.
+    """
+    value = Value(address, bit_start, bit_len, decoder, writable, readable)
+    mask = 2 ** bit_len - 1
+    bit_mask = value.bit_mask
+    num_words = ceil((bit_start + bit_len) / 32)
+    too_big_message = "you can at maximum assign '{}' to a {} bit value".format(mask, bit_len)
+
+    if not readable:
+        def fget(self):
+            raise AssertionError(f"cannot read write-only value {name}")
+    elif bit_start == 0 and bit_len <= 32:
+        def fget(self):
+            memory_accessor = self._memory_accessor
+            return memory_accessor.read(address - memory_accessor.base) & mask
+    elif num_words == 1 and decoder is None:
+        def fget(self):
+            memory_accessor = self._memory_accessor
+            return (memory_accessor.read(address - memory_accessor.base) >> bit_start) & mask
+    else:
+        def fget(self):
+            memory_accessor = self._memory_accessor
+            offset = address - memory_accessor.base
+            to_return = 0
+            for i in range(num_words):
+                to_return |= memory_accessor.read(offset + (i * 4)) << (i * 32)
+            to_return = (to_return >> bit_start) & mask
+            if decoder is not None:
+                to_return = decoder[to_return]
+            return to_return
+
+    if not writable:
+        def fset(self, to_write):
+            raise AssertionError(f"cannot write read-only value {name}")
+    elif bit_start == 0 and bit_len == 32:
+        def fset(self, to_write):
+            assert to_write <= mask, too_big_message
+            memory_accessor = self._memory_accessor
+            memory_accessor.write(address - memory_accessor.base, to_write)
+    elif num_words == 1:
+        def fset(self, to_write):
+            assert to_write <= mask, too_big_message
+            memory_accessor = self._memory_accessor
+            write_masked(memory_accessor, address - memory_accessor.base, to_write << bit_start, bit_mask)
+    else:
+        def fset(self, to_write):
+            assert to_write <= mask, too_big_message
+            memory_accessor = self._memory_accessor
+            offset = address - memory_accessor.base
+            shifted_value = to_write << bit_start
+            for i in range(num_words):
+                write_masked(
+                    memory_accessor, offset + (i * 4),
+                    (shifted_value >> (i * 32)) & WORD_MASK,
+                    (bit_mask >> (i * 32)) & WORD_MASK,
+                )
+
+    to_return = ValueProperty(fget, fset, doc=name)
+    to_return.value = value
+    return to_return
+
+
 @dataclass
 class Blob:
     """Represents bigger address chunks that are not useful to express as BitwiseAccessibleInteger"""
@@ -76,82 +389,174 @@ class Blob:
     bit_len: int
 
 
+class AsyncDriverMethod:
+    """
+    Wraps a driver method that is an `async def`. If it is called from within a running event loop, a coroutine is
+    returned so that independent peripherals can be driven concurrently (e.g. with `asyncio.gather()`).
+    Outside of an event loop (e.g. in the interactive shell) the method is run to completion instead.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        coroutine_function = self.function.__get__(instance, owner)
+        try:
+            asyncio.get_running_loop()
+            return coroutine_function
+        except RuntimeError:
+            @wraps(self.function)
+            def run_to_completion(*args, **kwargs):
+                return asyncio.run(coroutine_function(*args, **kwargs))
+            return run_to_completion
+
+
+def uio_interrupt_name(address, bit_start):
+    """The name of the uio device that is created for a StatusSignal(interrupt=True) at the given address"""
+    return "naps_irq_{:08x}_{}".format(address, bit_start)
+
+
+class UioInterrupt:
+    """
+    The interrupt of a StatusSignal(interrupt=True) as it is exposed by the linux uio_pdrv_genirq driver.
+    The interrupt is level triggered and active as long as the StatusSignal is not zero.
+    """
+    _cache = {}
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDWR)
+
+    @classmethod
+    def find(cls, value):
+        """:return: the UioInterrupt for the given Value or None if there is none (e.g. in simulation or via jtag)"""
+        name = uio_interrupt_name(value.address, value.bit_start)
+        if name not in cls._cache:
+            cls._cache[name] = None
+            sysfs = "/sys/class/uio"
+            for device in (os.listdir(sysfs) if os.path.isdir(sysfs) else []):
+                with open(os.path.join(sysfs, device, "name")) as f:
+                    if f.read().strip() == name:
+                        cls._cache[name] = cls(os.path.join("/dev", device))
+        return cls._cache[name]
+
+    def enable(self):
+        # the interrupt is masked by the kernel every time it fires and needs to be unmasked again
+        os.write(self.fd, struct.pack("I", 1))
+
+    async def wait(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        fired = loop.create_future()
+        loop.add_reader(self.fd, lambda: fired.done() or fired.set_result(None))
+        try:
+            await asyncio.wait_for(fired, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(self.fd)
+        # wait_for() cancels the future when the timeout expires; in that case there is no count to read
+        if fired.done() and not fired.cancelled():
+            os.read(self.fd, 4)  # consume the interrupt count
+
+
 class HardwareProxy:
-    # TODO: test bit fiddeling
+    # the child proxies and the state of driver methods still live in the __dict__
+    __slots__ = ("_memory_accessor", "__dict__")
+
     def __init__(self, memory_accessor: MemoryAccessor):
-        object.__setattr__(self, "_memory_accessor", memory_accessor)
-        for k, v in self.__class__.__dict__.items():
-            if isinstance(v, type) and issubclass(v, HardwareProxy):
-                object.__setattr__(self, k[1:].lower(), v(memory_accessor))
+        self._memory_accessor = memory_accessor
+        # child proxies are created on their first access (see __getattr__) unless they have to run an init function
+        for name, child_class in child_proxy_classes(type(self)).items():
+            if needs_eager_init(child_class):
+                setattr(self, name, child_class(memory_accessor))
         if hasattr(self, 'init_function'):
             self.init_function()
 
-    def __getattribute__(self, name):
-        obj = object.__getattribute__(self, name)
-
-        if isinstance(obj, Value):
-            memory_accessor = object.__getattribute__(self, "_memory_accessor")
-
-            assert obj.readable, f"cannot read write-only value {name}"
-            # fast path if the value is easy to handle
-            if obj.bit_start == 0 and obj.bit_len <= 32:
-                return memory_accessor.read(obj.address - memory_accessor.base) & obj.bit_mask
-
-            to_return = BitwiseAccessibleInteger()
-            read_bytes = ceil((obj.bit_start + obj.bit_len) / 32)
-            for i in range(read_bytes):
-                val = BitwiseAccessibleInteger(memory_accessor.read(obj.address - memory_accessor.base + (i * 4)))
-                to_return[i * 32:(i + 1) * 32] = val[obj.bit_start if i == 0 else 0:(32 if i != read_bytes - 1 else (obj.bit_len + obj.bit_start) % 32)]
-            to_return = int(to_return)
-            if obj.decoder is not None:
-                to_return = obj.decoder[to_return]
-            return to_return
-        else:
-            return obj
+    def __getattr__(self, name):
+        # this is only called if the attribute was not found otherwise
+        child_class = child_proxy_classes(type(self)).get(name)
+        if child_class is None:
+            raise AttributeError("{!r} object has no attribute {!r}".format(type(self).__name__, name))
+        child = child_class(self._memory_accessor)
+        setattr(self, name, child)
+        return child
 
-    def __setattr__(self, name, value):
-        if name.startswith("__"):
-            return object.__setattr__(self, name, value)
-        else:
-            obj = object.__getattribute__(self, name)
-
-            if not isinstance(obj, (Value, Blob)):
-                return object.__setattr__(self, name, value)
-            elif isinstance(obj, Value):
-                assert obj.writable, f"cannot write read-only value {name}"
-
-                memory_accessor = object.__getattribute__(self, "_memory_accessor")
-                assert value < 2 ** obj.bit_len, "you can at maximum assign '{}' to a {} bit value".format((2 ** obj.bit_len - 1), obj.bit_len)
-            
-                # fast path if the value is easy to handle
-                if obj.bit_start == 0 and obj.bit_len <= 32:
-                    old = memory_accessor.read(obj.address - memory_accessor.base)
-                    memory_accessor.write(obj.address - memory_accessor.base, old & obj.word_aligned_inverse_bit_mask | value)
-                    return
-
-                v = BitwiseAccessibleInteger(value)
-                read_bytes = ceil((obj.bit_start + obj.bit_len) / 32)
-                for i in range(read_bytes):
-                    prev_value = BitwiseAccessibleInteger(memory_accessor.read(obj.address - memory_accessor.base + (i * 4)))
-                    prev_value[obj.bit_start if i == 0 else 0:(32 if i != read_bytes - 1 else (obj.bit_len + obj.bit_start) % 32)] = v[i * 32:(i + 1) * 32]
-                    memory_accessor.write(
-                        obj.address - memory_accessor.base + (i * 4),
-                        int(prev_value)
-                    )
+    def __dir__(self):
+        return sorted({*super().__dir__(), *child_proxy_classes(type(self))})
+
+    async def wait_for(self, field, value=1, timeout=None):
+        """
+        Wait until the register `field` of this proxy has the given value.
+        If the field is a StatusSignal(interrupt=True) and the uio device of its interrupt is present we sleep
+        until the interrupt fires while the field is zero. Otherwise (e.g. in simulation or via jtag) the field is polled.
+        :param timeout: the maximum time to wait in seconds or None to wait forever
+        :return: True if the field has the value or False if the timeout expired
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        interrupt = UioInterrupt.find(getattr(type(self), field).value)
+        while True:
+            if interrupt is not None:
+                interrupt.enable()  # we unmask the interrupt before reading to not miss a change
+            current = getattr(self, field)
+            if current == value:
+                return True
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            if interrupt is not None and current == 0:
+                await interrupt.wait(remaining)
+            else:
+                await asyncio.sleep(POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining))
+    wait_for = AsyncDriverMethod(wait_for)
+
+    def enable_shadow_registers(self):
+        """
+        Opt into serving the reads of cpu owned registers (words that only contain ControlSignals) from a local copy.
+        :return: the ShadowRegisters accessor. Call its invalidate() or sync() after the hardware was reset.
+        """
+        if isinstance(self._memory_accessor, ShadowRegisters):
+            return self._memory_accessor
+        assert not isinstance(self._memory_accessor, Batch), "shadow registers cannot be enabled inside a batch"
+        shadow_registers = ShadowRegisters(self._memory_accessor, getattr(self, "_cpu_owned_words", ()))
+        install_memory_accessor(self, shadow_registers)
+        return shadow_registers
+
+    def batch(self):
+        """
+        Returns a context manager that batches all register accesses of this proxy and its children:
+        `with design.batch(): ...`
+        """
+        if isinstance(self._memory_accessor, Batch):  # we are already in a batch; nest into it
+            return self._memory_accessor
+        return Batch(self)
 
     def __repr__(self, allow_recursive=False):
         if stack()[1].filename == "<console>" or allow_recursive:
             to_return = ""
-            children = [(name, object.__getattribute__(self, name)) for name in dir(self) if not name.startswith("_")]
-            real_children = [(name, child) for name, child in children if not isinstance(child, HardwareProxy)]
-            proxy_children = [(name, child) for name, child in children if isinstance(child, HardwareProxy)]
-            for name, child in real_children:
-                if type(child) == Value:
-                    to_return += "{}: {}\n".format(name, getattr(self, name))
-                if type(getattr(self.__class__, name, None)) == property:
+            for name in dir(self):
+                if not name.startswith("_") and isinstance(getattr(type(self), name, None), property):
                     to_return += "{}: {}\n".format(name, getattr(self, name))
-            for name, child in proxy_children:
+            for name in sorted(child_proxy_classes(type(self))):
+                child = getattr(self, name)
                 to_return += "{}: \n{}\n".format(name, indent(child.__repr__(allow_recursive=True), "    "))
             return to_return.strip()
         else:
             return "<HardwareProxy at 0x{:x}>".format(id(self))
+
+
+@lru_cache(maxsize=None)
+def child_proxy_classes(proxy_class):
+    """:return: a dict of attribute name -> class of the child proxies of a HardwareProxy class"""
+    return {
+        k[1:].lower(): v for k, v in vars(proxy_class).items()
+        if isinstance(v, type) and issubclass(v, HardwareProxy)
+    }
+
+
+@lru_cache(maxsize=None)
+def needs_eager_init(proxy_class):
+    """Proxies that have an init function somewhere in their subtree are created on startup to run it"""
+    return hasattr(proxy_class, "init_function") or any(map(needs_eager_init, child_proxy_classes(proxy_class).values()))
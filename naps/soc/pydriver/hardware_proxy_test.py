@@ -1,5 +1,70 @@
+import asyncio
+import os
 import unittest
-from naps.soc.pydriver.hardware_proxy import BitwiseAccessibleInteger
+from collections import defaultdict
+from naps.soc.pydriver.hardware_proxy import BitwiseAccessibleInteger, HardwareProxy, value_property, MemoryAccessor, \
+    AsyncDriverMethod, UioInterrupt
+
+
+class RecordingAccessor(MemoryAccessor):
+    base = 0
+
+    def __init__(self):
+        self.memory = defaultdict(int)
+        self.log = []
+        self.transfers = 0
+
+    def read(self, addr):
+        self.log.append(("read", addr))
+        return self.memory[addr]
+
+    def write(self, addr, value):
+        self.log.append(("write", addr, value))
+        self.memory[addr] = value
+
+
+class VectoredRecordingAccessor(RecordingAccessor):
+    def transfer(self, ops):
+        self.transfers += 1
+        results = []
+        for addr, value, mask in ops:
+            if mask == 0:
+                results.append(self.read(addr))
+            else:
+                self.write(addr, self.memory[addr] & ~mask | value & mask)
+        return results
+
+
+class Design(HardwareProxy):
+    _cpu_owned_words = frozenset({0x0, 0x4, 0x8, 0xC, 0x10})
+
+    low = value_property("low", 0x0, 0, 4, None, True, True)
+    high = value_property("high", 0x0, 4, 28, None, True, True)
+    full = value_property("full", 0x4, 0, 32, None, True, True)
+    wide = value_property("wide", 0x8, 8, 48, None, True, True)
+    status = value_property("status", 0xC0, 4, 4, None, False, True)
+    control = value_property("control", 0xC4, 0, 4, None, True, True)
+    flags = value_property("flags", 0xC4, 4, 4, None, False, True)
+
+    class _Sub(HardwareProxy):
+        reg = value_property("reg", 0x10, 0, 8, None, True, True)
+
+        async def count_up(self, n):
+            for i in range(n):
+                self.reg = self.reg + 1
+                await asyncio.sleep(0.01)
+            return self.reg
+        count_up = AsyncDriverMethod(count_up)
+
+    async def count_both(self, n):
+        await asyncio.gather(self.sub.count_up(n), self.count_full(n))
+    count_both = AsyncDriverMethod(count_both)
+
+    async def count_full(self, n):
+        for i in range(n):
+            self.full = self.full + 1
+            await asyncio.sleep(0.01)
+    count_full = AsyncDriverMethod(count_full)
 
 
 class BitwiseAccessibleIntegerTest(unittest.TestCase):
@@ -24,4 +89,172 @@ class BitwiseAccessibleIntegerTest(unittest.TestCase):
 
         v = BitwiseAccessibleInteger(0b01011111)
         v[4:8] = 0b1010
-        self.assertEqual(int(v), 0b10101111)
\ No newline at end of file
+        self.assertEqual(int(v), 0b10101111)
+
+
+class HardwareProxyTest(unittest.TestCase):
+    def test_roundtrip(self):
+        accessor = RecordingAccessor()
+        design = Design(accessor)
+        design.low = 0xA
+        design.high = 0x123
+        design.wide = 0xABCD_1234_5678
+        self.assertEqual(design.low, 0xA)
+        self.assertEqual(design.high, 0x123)
+        self.assertEqual(design.wide, 0xABCD_1234_5678)
+        self.assertEqual(accessor.memory[0x0], 0x123A)
+        self.assertEqual(accessor.memory[0x8], 0x3456_7800)
+        self.assertEqual(accessor.memory[0xC], 0xAB_CD12)
+
+    def test_read_only(self):
+        accessor = RecordingAccessor()
+        accessor.memory[0xC0] = 0xAB
+        design = Design(accessor)
+        self.assertEqual(design.status, 0xA)
+        with self.assertRaises(AssertionError):
+            design.status = 1
+        with self.assertRaises(AssertionError):
+            design.low = 0x10
+
+    def test_full_word_write_does_not_read(self):
+        accessor = RecordingAccessor()
+        design = Design(accessor)
+        design.full = 0x1234_5678
+        self.assertEqual(accessor.log, [("write", 0x4, 0x1234_5678)])
+
+    def test_batch_merges_writes(self):
+        accessor = VectoredRecordingAccessor()
+        design = Design(accessor)
+        with design.batch():
+            design.low = 0x5
+            design.high = 0x7
+            design.sub.reg = 0x42
+            design.full = 1
+            design.full = 2
+            self.assertEqual(accessor.log, [])
+        self.assertEqual(accessor.transfers, 1)
+        self.assertEqual(accessor.log, [("write", 0x0, 0x75), ("write", 0x10, 0x42), ("write", 0x4, 2)])
+        self.assertEqual(design.low, 0x5)
+        self.assertEqual(design.sub.reg, 0x42)
+
+    def test_batch_serves_known_reads(self):
+        accessor = RecordingAccessor()
+        accessor.memory[0x0] = 0xF0
+        design = Design(accessor)
+        with design.batch():
+            self.assertEqual(design.low, 0x0)
+            self.assertEqual(design.high, 0xF)
+            design.low = 0x3
+            self.assertEqual(design.low, 0x3)
+            with design.batch():  # nested batches join the outer batch
+                design.high = 0x1
+        self.assertEqual(accessor.log, [("read", 0x0), ("write", 0x0, 0x13)])
+
+    def test_batch_rereads_status_words(self):
+        accessor = RecordingAccessor()
+        design = Design(accessor)
+        with design.batch():
+            self.assertEqual(design.status, 0)
+            accessor.memory[0xC0] = 0x10  # the hardware changes the status word during the batch
+            self.assertEqual(design.status, 1)
+            self.assertEqual(design.flags, 0)
+            design.control = 0x3
+            accessor.memory[0xC4] = 0x50
+        # the flags are not overwritten with the value the batch read before
+        self.assertEqual(accessor.memory[0xC4], 0x53)
+
+    def test_batch_discarded_on_exception(self):
+        accessor = RecordingAccessor()
+        design = Design(accessor)
+        with self.assertRaises(KeyError):
+            with design.batch():
+                design.full = 1
+                raise KeyError()
+        self.assertEqual(accessor.log, [])
+        design.full = 2
+        self.assertEqual(accessor.log, [("write", 0x4, 2)])
+
+    def test_block_access(self):
+        accessor = RecordingAccessor()
+        design = Design(accessor)
+        with design.batch():
+            design.full = 7
+            accessor.write_block(0x20, [1, 2, 3])
+            self.assertEqual(design._memory_accessor.read_block(0x4, 1).tolist(), [7])
+        self.assertEqual(accessor.read_block(0x20, 3).tolist(), [1, 2, 3])
+
+    def test_shadow_registers(self):
+        accessor = RecordingAccessor()
+        accessor.memory[0x0] = 0xF0
+        design = Design(accessor)
+        shadow_registers = design.enable_shadow_registers()
+        self.assertIs(design.sub._memory_accessor, shadow_registers)
+        self.assertEqual(design.high, 0xF)
+        design.low = 0x3
+        design.sub.reg = 0x42
+        self.assertEqual(design.low, 0x3)
+        self.assertEqual(design.sub.reg, 0x42)
+        self.assertEqual(design.status, 0)
+        self.assertEqual(design.status, 0)
+        self.assertEqual(accessor.log, [
+            ("read", 0x0), ("write", 0x0, 0xF3), ("read", 0x10), ("write", 0x10, 0x42), ("read", 0xC0), ("read", 0xC0)
+        ])
+
+        accessor.memory[0x0] = 0  # e.g. the fpga was reset
+        self.assertEqual(design.low, 0x3)
+        shadow_registers.invalidate()
+        self.assertEqual(design.low, 0x0)
+
+    def test_shadow_registers_in_batch(self):
+        accessor = VectoredRecordingAccessor()
+        accessor.memory[0x4] = 5
+        design = Design(accessor)
+        design.enable_shadow_registers().sync()
+        accessor.log.clear()
+        with design.batch():
+            design.low = 0x1
+            self.assertEqual(design.full, 5)
+            self.assertEqual(design.status, 0)
+        self.assertEqual(accessor.log, [("write", 0x0, 0x1), ("read", 0xC0)])
+        self.assertEqual(design.low, 0x1)
+        self.assertEqual(accessor.log, [("write", 0x0, 0x1), ("read", 0xC0)])
+
+    def test_async_driver_methods(self):
+        accessor = RecordingAccessor()
+        design = Design(accessor)
+        self.assertEqual(design.sub.count_up(3), 3)  # outside of an event loop the method is run to completion
+        accessor.log.clear()
+        design.count_both(2)
+        # both counters were incremented concurrently
+        self.assertEqual([entry[:2] for entry in accessor.log if entry[0] == "write"], [
+            ("write", 0x10), ("write", 0x4), ("write", 0x10), ("write", 0x4)
+        ])
+        self.assertEqual((design.sub.reg, design.full), (5, 2))
+
+    def test_wait_for(self):
+        class CountingAccessor(RecordingAccessor):
+            def read(self, addr):
+                self.memory[addr] += 0x10  # status counts up with every read
+                return super().read(addr)
+
+        accessor = CountingAccessor()
+        design = Design(accessor)
+        self.assertTrue(design.wait_for("status", 3, timeout=1))
+        self.assertEqual(design.status, 4)
+        self.assertFalse(design.wait_for("status", 0x20, timeout=0.01))
+
+    def test_uio_interrupt_timeout(self):
+        read_fd, write_fd = os.pipe()
+        interrupt = UioInterrupt.__new__(UioInterrupt)
+        interrupt.fd = read_fd
+        os.set_blocking(read_fd, False)  # a read without a pending interrupt raises instead of blocking forever
+        try:
+            # the timeout expires without an interrupt; nothing must be read from the fd
+            asyncio.run(interrupt.wait(0.01))
+            os.write(write_fd, bytes(4))
+            asyncio.run(interrupt.wait(1))
+            with self.assertRaises(BlockingIOError):
+                os.read(read_fd, 4)  # the interrupt count was consumed
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
@@ -4,6 +4,7 @@ from amaranth import Fragment
 
 from .hooks import csr_and_driver_item_hook, address_assignment_hook, peripherals_collect_hook
 from .pydriver.generate import pydriver_hook
+from ..util import profiler
 
 __all__ = ["SocPlatform", "soc_platform_name", "PERIPHERAL_DOMAIN"]
 
@@ -51,8 +52,9 @@ class SocPlatform(ABC):
         inject_subfragments(top_fragment, self.to_inject_subfragments)
         for hook in self.prepare_hooks:
             print("-> running {}".format(hook.__name__))
-            hook(self, top_fragment)
-            inject_subfragments(top_fragment, self.to_inject_subfragments)
+            with profiler.span(f"hook {hook.__name__}"):
+                hook(self, top_fragment)
+                inject_subfragments(top_fragment, self.to_inject_subfragments)
 
         print("\ninjecting final fragments")
         inject_subfragments(top_fragment, self.final_to_inject_subfragments)
@@ -0,0 +1,16 @@
+from naps.soc import MemoryMap, Address, StatusSignal, ControlSignal
+
+__all__ = ["big_memorymap"]
+
+
+def big_memorymap(n_banks=200, n_csrs=10):
+    """A placed memorymap with n_banks named subranges of n_csrs 32 bit csrs each (alternating control and status)"""
+    top = MemoryMap(top=True)
+    for i in range(n_banks):
+        bank = MemoryMap()
+        for j in range(n_csrs):
+            csr = StatusSignal(32) if j % 2 else ControlSignal(32)
+            bank.allocate(f"csr{j}", writable=isinstance(csr, ControlSignal), bits=32, obj=csr)
+        top.allocate_subrange(bank, name=f"bank{i}")
+    top.place_at = Address(0x4000_0000, 0, top.byte_len * 8)
+    return top
@@ -23,9 +23,9 @@ class StreamOutputCoverSpec(Elaboratable):
         return m
 
 
-def verify_stream_output_contract_cover(module, stream_output, support_modules=()):
+def verify_stream_output_contract_cover(module, stream_output, support_modules=(), wait=True):
     spec = StreamOutputCoverSpec(stream_output)
-    assert_formal(module, mode="cover", depth=10, submodules=[*support_modules, spec])
+    return assert_formal(module, mode="cover", depth=10, submodules=[*support_modules, spec], wait=wait)
 
 
 class StreamOutputAssertSpec(Elaboratable):
@@ -57,9 +57,9 @@ class StreamOutputAssertSpec(Elaboratable):
         return m
 
 
-def verify_stream_output_contract_assert(module, stream_output, support_modules=()):
+def verify_stream_output_contract_assert(module, stream_output, support_modules=(), wait=True):
     spec = StreamOutputAssertSpec(stream_output)
-    assert_formal(module, mode="bmc", depth=10, submodules=[*support_modules, spec])
+    return assert_formal(module, mode="bmc", depth=10, submodules=[*support_modules, spec], wait=wait)
 
 
 class LegalStreamSource(Elaboratable):
@@ -98,6 +98,7 @@ def verify_stream_output_contract(module, stream_output=None, support_modules=[]
                 output = module.output
             return (module, output, support_modules)
 
+    jobs = []
     for text, check in [
         ("that valid does not depend on ready", verify_stream_output_contract_cover),
         ("hold unacknowledged transactions", verify_stream_output_contract_assert),
@@ -105,4 +106,13 @@ def verify_stream_output_contract(module, stream_output=None, support_modules=[]
         elab, stream_output, support_modules = module_generator()
         elab._MustUse__used = True
         print(f"testing {text}...")
-        check(elab, stream_output, support_modules)
+        jobs.append(check(elab, stream_output, support_modules, wait=False))
+    # both checks run concurrently; all of them are finished before the first failure is raised
+    errors = []
+    for job in jobs:
+        try:
+            job.wait()
+        except (AssertionError, RuntimeError) as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
@@ -1,9 +1,14 @@
-from typing import Iterable
+from dataclasses import dataclass
+from typing import Iterable, Dict
 
+from amaranth import *
 from . import Stream, PacketizedStream
-from naps.util.sim import wait_for, do_nothing
+from naps.util.sim import wait_for, do_nothing, BulkSimCommand
 
-__all__ = ["write_to_stream", "read_from_stream", "read_packet_from_stream", "write_packet_to_stream"]
+__all__ = [
+    "write_to_stream", "read_from_stream", "read_packet_from_stream", "write_packet_to_stream",
+    "StreamTransfers", "StreamArrayTransfer", "write_arrays_to_stream", "read_arrays_from_stream",
+]
 
 
 def write_to_stream(stream: Stream, timeout=100, **kwargs):
@@ -49,3 +54,189 @@ def read_packet_from_stream(stream: PacketizedStream, timeout=100, allow_pause=T
         packet.append(payload)
         if last:
             return packet
+
+
+# The following functions move whole numpy arrays through a stream. All fields of a word (and valid) are packed into
+# a single integer (in bulk with numpy) so that every cycle only costs a single signal set and read.
+# numpy is only needed for simulation and therefore imported lazily.
+
+
+@dataclass
+class StreamTransfers:
+    fields: Dict  # field name -> numpy array of the transferred words
+    cycles: object  # numpy array of the cycle (counted from the start of the read / write) in which each word was transferred
+
+    def __getitem__(self, item):
+        return self.fields[item]
+
+    def __len__(self):
+        return len(self.cycles)
+
+    def throughput(self):
+        """:return: the average number of transferred words per cycle between the first and the last transfer"""
+        if len(self.cycles) < 2:
+            return 0.0
+        return (len(self.cycles) - 1) / (self.cycles[-1] - self.cycles[0])
+
+
+def _field_layout(stream, fields):
+    layout = []
+    offset = 1  # bit 0 is valid
+    for name in fields:
+        value = Value.cast(stream[name])
+        layout.append((name, offset, len(value), value.shape().signed))
+        offset += len(value)
+    return Cat(stream.valid, *(Value.cast(stream[name]) for name in fields)), layout, offset
+
+
+def _pauses(pause_probability, seed, chunk_size=4096):
+    """Yields the number of idle cycles before each word; every cycle is idle with pause_probability"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    while True:
+        if pause_probability <= 0:
+            yield 0
+        else:
+            yield from (rng.geometric(1 - pause_probability, chunk_size) - 1).tolist()
+
+
+def _packing_type(width):
+    """:return: the numpy dtype that can hold a packed word and a function that converts python ints to it"""
+    import numpy as np
+    return (np.uint64, np.uint64) if width <= 64 else (object, int)
+
+
+class StreamArrayTransfer(BulkSimCommand):
+    """
+    Moves packed words (valid in bit 0, the fields in the layout after it) through a stream. Yielded by
+    write_arrays_to_stream / read_arrays_from_stream; simulation engines may run it natively (see sim_cxxrtl.py).
+    The result is a tuple of the transferred packed words and their transfer cycles.
+    """
+
+    def __init__(self, stream, fields, is_writer, words=(), count=None, until=None, timeout=100, pauses=None):
+        self.stream = stream
+        self.cat, self.layout, self.width = _field_layout(stream, fields)
+        self.is_writer = is_writer
+        self.words = words
+        self.count = len(words) if is_writer else count
+        self.until_bit = 1 << dict((name, offset) for name, offset, _, _ in self.layout)[until] if until is not None else 0
+        self.timeout = timeout
+        self.pauses = pauses
+        self.native = self.width <= 64
+
+    def run(self):
+        return (yield from (self._write() if self.is_writer else self._read()))
+
+    def _write(self):
+        stream = self.stream
+        cycles = []
+        cycle = 0
+        for word, pause in zip(self.words, self.pauses):
+            if pause:
+                yield stream.valid.eq(0)
+                for _ in range(pause):
+                    yield
+                cycle += pause
+            yield self.cat.eq(word)
+            waited = 0
+            while True:
+                if self.timeout != -1 and waited >= self.timeout:
+                    raise TimeoutError(f"{stream.ready!r} did not become '1' within {self.timeout} cycles")
+                yield
+                cycle += 1
+                waited += 1
+                if (yield stream.ready):
+                    break
+            cycles.append(cycle)
+        yield stream.valid.eq(0)
+        return list(self.words), cycles
+
+    def _read(self):
+        stream = self.stream
+        words = []
+        cycles = []
+        cycle = 0
+        yield stream.ready.eq(1)
+        while self.count is None or len(words) < self.count:
+            pause = next(self.pauses)
+            if pause:
+                yield stream.ready.eq(0)
+                for _ in range(pause):
+                    yield
+                cycle += pause
+                yield stream.ready.eq(1)
+            waited = 0
+            while True:
+                if self.timeout != -1 and waited >= self.timeout:
+                    raise TimeoutError(f"{stream.valid!r} did not become '1' within {self.timeout} cycles")
+                yield
+                cycle += 1
+                waited += 1
+                word = (yield self.cat)
+                if word & 1:
+                    break
+            words.append(word)
+            cycles.append(cycle)
+            if word & self.until_bit:
+                break
+        yield stream.ready.eq(0)
+        return words, cycles
+
+
+def write_arrays_to_stream(stream: Stream, timeout=100, pause_probability=0.0, seed=0, **fields):
+    """
+    Writes whole arrays of words to a stream. Scalar fields are repeated for every word.
+    :param pause_probability: the probability of valid being deasserted in a cycle (from a schedule seeded by seed)
+    :return: the written words and their transfer cycles as StreamTransfers
+    """
+    import numpy as np
+    arrays = {k: np.asarray(v) for k, v in fields.items()}
+    n = max((len(a) for a in arrays.values() if a.ndim > 0), default=1)
+    arrays = {k: np.broadcast_to(a, (n,)) for k, a in arrays.items()}
+    _, layout, width = _field_layout(stream, arrays.keys())
+
+    dtype, const = _packing_type(width)
+    packed = np.ones(n, dtype=dtype)
+    for name, offset, field_width, _signed in layout:
+        field = arrays[name].astype(np.int64 if dtype is np.uint64 else object).astype(dtype)
+        packed |= (field & const((1 << field_width) - 1)) << const(offset)
+
+    transfer = StreamArrayTransfer(
+        stream, arrays.keys(), is_writer=True, words=packed.tolist(), timeout=timeout,
+        pauses=_pauses(pause_probability, seed),
+    )
+    _, cycles = yield transfer
+    return StreamTransfers(dict(arrays), np.array(cycles))
+
+
+def read_arrays_from_stream(
+        stream: Stream, fields=("payload",), count=None, until=None, timeout=100, pause_probability=0.0, seed=1
+):
+    """
+    Reads words from a stream into numpy arrays until either count words were read or the field `until` is 1.
+    :param pause_probability: the probability of ready being deasserted in a cycle (from a schedule seeded by seed)
+    :return: the read words and their transfer cycles as StreamTransfers
+    """
+    import numpy as np
+    if count is None and until is None:
+        raise ValueError("either count or until must be given")
+    fields = tuple(fields)
+    if until is not None and until not in fields:
+        fields += (until,)
+    transfer = StreamArrayTransfer(
+        stream, fields, is_writer=False, count=count, until=until, timeout=timeout,
+        pauses=_pauses(pause_probability, seed),
+    )
+    words, cycles = yield transfer
+
+    dtype, const = _packing_type(transfer.width)
+    packed = np.array(words, dtype=dtype)
+    arrays = {}
+    for name, offset, field_width, signed in transfer.layout:
+        field = (packed >> const(offset)) & const((1 << field_width) - 1)
+        if field_width < 64:
+            field = field.astype(np.int64)
+        if signed:
+            field = np.where(field >= (1 << (field_width - 1)), field - (1 << field_width), field)
+        arrays[name] = field
+    return StreamTransfers(arrays, np.array(cycles))
@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+from amaranth import *
+
+from naps import SimPlatform
+from naps.cores.stream import BufferedSyncStreamFIFO
+from . import BasicStream, PacketizedStream, write_arrays_to_stream, read_arrays_from_stream
+
+
+class BulkStreamSimTest(unittest.TestCase):
+    def check_roundtrip(self, input, fields, write_pause, read_pause, **read_args):
+        platform = SimPlatform()
+        fifo = BufferedSyncStreamFIFO(input, 16)
+        results = {}
+
+        def write_process():
+            results["written"] = yield from write_arrays_to_stream(input, pause_probability=write_pause, **fields)
+
+        def read_process():
+            results["read"] = yield from read_arrays_from_stream(
+                fifo.output, fields=fields.keys(), pause_probability=read_pause, **read_args
+            )
+
+        platform.add_sim_clock("sync", 100e6)
+        platform.add_process(write_process, "sync")
+        platform.sim(fifo, read_process)
+        for name, array in fields.items():
+            np.testing.assert_array_equal(results["read"][name], array)
+        return results["written"], results["read"]
+
+    def test_roundtrip(self):
+        payload = np.random.default_rng(0).integers(0, 2**32, 1000)
+        written, read = self.check_roundtrip(BasicStream(32), {"payload": payload}, 0, 0, count=1000)
+        self.assertEqual(len(written), 1000)
+        self.assertGreater(read.throughput(), 0.9)
+
+    def test_backpressure(self):
+        payload = np.arange(500) % 256
+        written, read = self.check_roundtrip(BasicStream(8), {"payload": payload}, 0, 0.5, count=500)
+        # the reader only accepts every second word on average which throttles the writer as well
+        self.assertLess(read.throughput(), 0.7)
+        self.assertLess(written.throughput(), 0.7)
+        self.assertTrue(np.all(np.diff(read.cycles) >= 1))
+
+    def test_until_and_signed(self):
+        payload = np.arange(-50, 50)
+        last = np.arange(100) == 99
+        input = PacketizedStream(signed(8))
+        written, read = self.check_roundtrip(input, {"payload": payload, "last": last}, 0.3, 0.3, until="last")
+        self.assertEqual(len(read), 100)
+
+    def test_wide(self):
+        payload = [(1 << 100) + i for i in range(20)]
+        self.check_roundtrip(BasicStream(120), {"payload": np.array(payload, dtype=object)}, 0, 0, count=20)
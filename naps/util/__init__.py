@@ -1,6 +1,7 @@
 from .amaranth_misc import *
 from .python_misc import *
 from .formal import *
+from .sim_trace import *
 from .sim import *
 from .past import *
 from .py_serialize import *
@@ -1,17 +1,40 @@
+# Formal verification of amaranth designs with SymbiYosys.
+#
+# Every check is keyed by the hash of its sby config (the generated rtlil without the source locations, the mode, the
+# depth and the engines) and the versions of sby and yosys. Definite results (pass or fail) are cached on disk (in
+# NAPS_FORMAL_CACHE or ~/.cache/naps/formal) and reused as long as the design is unchanged; failing checks keep their
+# counterexample traces.
+# Checks can be started without waiting for them (assert_formal(..., wait=False)) so that several sby runs proceed
+# concurrently. If more than one engine is given, sby runs them in parallel and the first definite result wins.
+
+import functools
+import hashlib
 import inspect
+import json
+import os
+import re
+import shutil
 import subprocess
 import textwrap
 from typing import Iterable
 from pathlib import Path
 
 from amaranth import Fragment, ValueCastable, Value
-from amaranth._toolchain import require_tool
+from amaranth._toolchain import require_tool, ToolNotFound
 from amaranth.back import rtlil
 from shutil import rmtree
 
 from naps.data_structure import Bundle
+from .env import naps_getenv
+
+__all__ = ["assert_formal", "FormalPlatform", "FormalJob"]
 
-__all__ = ["assert_formal", "FormalPlatform"]
+# the engines that are used if none are given (separated by ";" in the NAPS_FORMAL_ENGINES environment variable)
+DEFAULT_ENGINES = {
+    "bmc": ["smtbmc"],
+    "cover": ["smtbmc"],
+    "prove": ["smtbmc", "abc pdr"],
+}
 
 
 class FormalPlatform:
@@ -22,7 +45,9 @@ def get_artifacts_location():
     test_class = None
     caller_path = ""
     stack = inspect.stack()
-    for frame in stack[2:]:
+    for frame in stack[1:]:
+        if frame.filename == __file__:
+            continue
         if "unittest" in frame.filename:
             filename = "__".join(reversed(functions))
             if test_class:
@@ -37,12 +62,123 @@ def get_artifacts_location():
 
     target_dir = Path(caller_path).parent / ".sim_results"
     target_dir.mkdir(exist_ok=True)
-    if (target_dir / filename).exists():
-        rmtree(target_dir / filename)
     return target_dir, filename
 
-def assert_formal(spec, mode="bmc", depth=1, submodules=()):
-    assert mode in ["bmc", "cover"]
+
+def _cache_dir():
+    return Path(naps_getenv("FORMAL_CACHE", Path.home() / ".cache" / "naps" / "formal"))
+
+
+# the exit codes of sby for definite results. other exit codes (errors, timeouts, unknown results) depend on the
+# environment (e.g. a missing solver) and are not cached.
+SBY_PASS, SBY_FAIL = 0, 2
+
+
+@functools.lru_cache(maxsize=None)
+def _tool_versions():
+    versions = []
+    for tool, flag in [("sby", "--version"), ("yosys", "-V")]:
+        try:
+            result = subprocess.run([require_tool(tool), flag], capture_output=True, text=True)
+            versions.append(f"{tool} {result.stdout.strip()} {result.stderr.strip()}")
+        except (ToolNotFound, OSError):
+            versions.append(f"{tool} not found")
+    return "\n".join(versions)
+
+
+def formal_key(config):
+    """
+    :return: the cache key of a sby config and the versions of sby and yosys. source locations are ignored so that
+             moving code does not invalidate it
+    """
+    without_src = re.sub(r"^\s*attribute \\src .*\n", "", config, flags=re.MULTILINE)
+    return hashlib.sha256(f"{_tool_versions()}\0{without_src}".encode()).hexdigest()[:32]
+
+
+class FormalJob:
+    """A running sby check or its cached result"""
+
+    def __init__(self, config, target_dir, filename):
+        self.key = formal_key(config)
+        self.result = None
+        cached = _cache_dir() / f"{self.key}.json"
+        if cached.exists():
+            self.result = json.loads(cached.read_text())
+            return
+
+        self.workdir = target_dir / filename
+        if self.workdir.exists():
+            rmtree(self.workdir)
+        # the config is passed as a file (and not through stdin) so that sby can start right away
+        self.config_file = target_dir / f"{filename}.sby"
+        self.config_file.write_text(config)
+        self.process = subprocess.Popen(
+            [require_tool("sby"), "-f", "-d", filename, self.config_file.name], cwd=str(target_dir),
+            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+        )
+
+    def wait(self):
+        """
+        Waits for the check to finish.
+        :raises AssertionError: if the formal verification failed
+        :raises RuntimeError: if sby did not produce a definite result
+        """
+        if self.result is None:
+            returncode = self.process.wait()
+            self.config_file.unlink()
+            log = self.workdir / "logfile.txt"
+            output = log.read_text() if log.exists() else ""
+            if returncode not in (SBY_PASS, SBY_FAIL):
+                raise RuntimeError(f"sby did not produce a result (exit code {returncode}):\n{output}")
+            self.result = {"passed": returncode == SBY_PASS, "output": output, "traces": []}
+            self._store()
+        if not self.result["passed"]:
+            traces = "\n".join(f"vcd: {trace}" for trace in self.result["traces"])
+            assert False, "Formal verification failed:\n" + self.result["output"] + "\n\n" + traces
+
+    def _store(self):
+        cache_dir = _cache_dir()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        if not self.result["passed"]:
+            # the counterexample traces are kept in the cache because the workdir is replaced by the next run
+            trace_dir = cache_dir / self.key
+            trace_dir.mkdir(exist_ok=True)
+            for i, trace in enumerate(sorted(self.workdir.glob("engine_*/trace*.vcd"))):
+                copy = trace_dir / f"{i}_{trace.parent.name}_{trace.name}"
+                shutil.copyfile(trace, copy)
+                self.result["traces"].append(str(copy))
+        temp = cache_dir / f"{self.key}.json.{os.getpid()}"
+        temp.write_text(json.dumps(self.result))
+        os.replace(temp, cache_dir / f"{self.key}.json")  # atomic, so that parallel test runs can share the cache
+
+
+def formal_config(spec_module, ports, mode, depth, engines):
+    engine_lines = "\n".join(engines)
+    return textwrap.dedent(f"""\
+        [options]
+        mode {mode}
+        depth {depth}
+        [engines]
+        {{engines}}
+        [script]
+        read_rtlil top.il
+        prep
+        [file top.il]
+        {{rtlil}}
+    """).format(engines=engine_lines, rtlil=rtlil.convert(spec_module, ports=ports))
+
+
+def assert_formal(spec, mode="bmc", depth=1, submodules=(), engines=None, wait=True):
+    """
+    Checks the assertions (or covers) of a design with SymbiYosys.
+    :param engines: a list of sby engine lines (e.g. ["smtbmc yices", "smtbmc boolector", "abc bmc3"]) that are run in
+                    parallel; defaults to NAPS_FORMAL_ENGINES or DEFAULT_ENGINES
+    :param wait: if False, the FormalJob is returned without waiting for it; call its wait() method to get the result
+    """
+    assert mode in ["bmc", "cover", "prove"]
+    if engines is None:
+        env_engines = naps_getenv("FORMAL_ENGINES")
+        engines = env_engines.split(";") if env_engines else DEFAULT_ENGINES[mode]
 
     target_dir, filename = get_artifacts_location()
     import sys
@@ -72,27 +208,12 @@ def assert_formal(spec, mode="bmc", depth=1, submodules=()):
             return ports
         else:
             return []
-    
+
 
     ports = flat_entry(list(spec.__dict__.values()))
     print(ports, file=sys.stderr)
 
-    config = textwrap.dedent(f"""\
-        [options]
-        mode {mode}
-        depth {depth}
-        wait on
-        [engines]
-        smtbmc
-        [script]
-        read_rtlil top.il
-        prep
-        [file top.il]
-        {rtlil.convert(spec_module, ports=ports)}
-    """)
-    with subprocess.Popen([require_tool("sby"), "-f", "-d", filename], cwd=str(target_dir),
-                          universal_newlines=True,
-                          stdin=subprocess.PIPE, stdout=subprocess.PIPE) as proc:
-        stdout, stderr = proc.communicate(config)
-        if proc.returncode != 0:
-            assert False, "Formal verification failed:\n" + stdout + "\n\n" + f"vcd: {str(target_dir / filename)}/engine_0/trace.vcd"
+    job = FormalJob(formal_config(spec_module, ports, mode, depth, engines), target_dir, filename)
+    if wait:
+        job.wait()
+    return job
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import textwrap
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from amaranth import *
+from amaranth.hdl import Assert
+
+from .formal import FormalJob, formal_config, formal_key, _tool_versions
+
+
+class Counter(Elaboratable):
+    def __init__(self, limit=10):
+        self.limit = limit
+        self.counter = Signal(8)
+
+    def elaborate(self, platform):
+        m = Module()
+        with m.If(self.counter < self.limit):
+            m.d.sync += self.counter.eq(self.counter + 1)
+        m.d.comb += Assert(self.counter <= self.limit)
+        return m
+
+
+def config(limit=10, depth=10, engines=("smtbmc",)):
+    dut = Counter(limit)
+    dut._MustUse__used = True
+    return formal_config(dut.elaborate(None), [dut.counter], "bmc", depth, engines)
+
+
+class FormalTest(unittest.TestCase):
+    def test_key(self):
+        self.assertEqual(formal_key(config()), formal_key(config()))
+        # source locations do not matter
+        self.assertEqual(formal_key(config()), formal_key(config().replace("formal_test.py:", "other_test.py:")))
+        keys = [formal_key(c) for c in [config(), config(limit=11), config(depth=20), config(engines=["abc bmc3"])]]
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_engines(self):
+        self.assertIn("[engines]\nsmtbmc yices\nsmtbmc boolector\n[script]", config(engines=["smtbmc yices", "smtbmc boolector"]))
+
+    def test_cached_results(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ["NAPS_FORMAL_CACHE"] = cache_dir
+            try:
+                for passed in [True, False]:
+                    # cached results are used without running sby
+                    (Path(cache_dir) / f"{formal_key(config())}.json").write_text(
+                        json.dumps({"passed": passed, "output": "cached output", "traces": []})
+                    )
+                    job = FormalJob(config(), Path(cache_dir), "unused")
+                    if passed:
+                        job.wait()
+                    else:
+                        with self.assertRaisesRegex(AssertionError, "cached output"):
+                            job.wait()
+            finally:
+                del os.environ["NAPS_FORMAL_CACHE"]
+
+    def test_sby_results(self):
+        # a stand-in for sby that exits with the code given in its environment
+        with tempfile.TemporaryDirectory() as tmp:
+            sby = Path(tmp) / "sby"
+            sby.write_text(textwrap.dedent("""\
+                #!/bin/sh
+                if [ "$1" = "--version" ]; then echo "SBY $FAKE_SBY_VERSION"; exit 0; fi
+                mkdir -p "$3" && echo "fake sby log" > "$3/logfile.txt"
+                exit $FAKE_SBY_EXIT
+            """))
+            sby.chmod(0o755)
+            cache_dir = Path(tmp) / "cache"
+            with patch.dict(os.environ, SBY=str(sby), NAPS_FORMAL_CACHE=str(cache_dir), FAKE_SBY_VERSION="1"):
+                _tool_versions.cache_clear()
+                try:
+                    key = formal_key(config())
+                    # errors, timeouts and unknown results are not cached
+                    for exit_code in [1, 4, 8, 16]:
+                        os.environ["FAKE_SBY_EXIT"] = str(exit_code)
+                        with self.assertRaises(RuntimeError):
+                            FormalJob(config(), Path(tmp), "job").wait()
+                        self.assertFalse((cache_dir / f"{key}.json").exists())
+                    # definite failures are
+                    os.environ["FAKE_SBY_EXIT"] = "2"
+                    with self.assertRaisesRegex(AssertionError, "fake sby log"):
+                        FormalJob(config(), Path(tmp), "job").wait()
+                    self.assertTrue((cache_dir / f"{key}.json").exists())
+                    # another version of sby does not reuse the results
+                    os.environ["FAKE_SBY_VERSION"] = "2"
+                    _tool_versions.cache_clear()
+                    self.assertNotEqual(formal_key(config()), key)
+                finally:
+                    _tool_versions.cache_clear()
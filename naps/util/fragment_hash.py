@@ -0,0 +1,243 @@
+# A structural hash of elaborated amaranth designs that is used as the cache key of gateware builds.
+#
+# The fragment tree is walked once and every fragment, statement and value is fed into a hashlib object as a stream of
+# small tokens; no textual representation of the design is ever built. Signals are numbered in the order they are
+# first encountered so that two different signals with the same name still hash differently.
+# Additionally, every fragment gets a short digest of its own contents (in which signals are only identified by their
+# name, shape and init value). These are used to tell which parts of a design changed between two builds.
+
+import hashlib
+from collections.abc import Mapping
+
+from amaranth.hdl import Fragment, Instance, Signal, Const, ClockSignal, ResetSignal, Value, ValueCastable
+from amaranth.hdl._ast import (
+    Assign, Property, Switch, Print, Format, Operator, Slice, Part, Concat, SwitchValue, ArrayProxy, AnyValue, Initial,
+    IOPort, IOSlice, IOConcat,
+)
+
+__all__ = ["FragmentHash", "fragment_hash"]
+
+# fragment attributes that do not influence the generated gateware (the memorymap is attached by the soc hooks and is
+# already reflected in the statements of the design)
+_IGNORED_FRAGMENT_ATTRIBUTES = {"src_loc", "origins", "subfragments", "memorymap"}
+_FLUSH_TOKENS = 1 << 14
+
+
+class FragmentHash:
+    def __init__(self, digest: str, fragment_digests: dict):
+        """
+        :param digest: the hex digest of the whole design
+        :param fragment_digests: a dict of fragment path -> short digest of the contents of that fragment
+        """
+        self.digest = digest
+        self.fragment_digests = fragment_digests
+
+    def serialize(self) -> str:
+        return "\n".join([self.digest, *(f"{path} {digest}" for path, digest in self.fragment_digests.items())]) + "\n"
+
+    @staticmethod
+    def deserialize(text: str) -> "FragmentHash":
+        digest, *lines = text.splitlines()
+        return FragmentHash(digest, dict(line.rsplit(" ", 1) for line in lines if line))
+
+    def changed_fragments(self, old: "FragmentHash"):
+        """:return: a list of (path, change) tuples of the fragments that differ from an older hash"""
+        changes = []
+        for path, digest in self.fragment_digests.items():
+            if path not in old.fragment_digests:
+                changes.append((path, "added"))
+            elif old.fragment_digests[path] != digest:
+                changes.append((path, "changed"))
+        changes += [(path, "removed") for path in old.fragment_digests if path not in self.fragment_digests]
+        return changes
+
+
+# the kinds of objects the hasher knows about. the kind of every type is looked up once and then cached because long
+# isinstance() chains (especially against abstract base classes) would dominate the runtime.
+(
+    _STR, _SIGNAL, _CONST, _OPERATOR, _SLICE, _PART, _CONCAT, _SWITCH_VALUE, _ARRAY_PROXY, _CLOCK_SIGNAL, _RESET_SIGNAL,
+    _ANY_VALUE, _INITIAL, _IO_PORT, _IO_SLICE, _IO_CONCAT, _VALUE_CASTABLE, _ASSIGN, _SWITCH, _PROPERTY, _PRINT, _FORMAT,
+    _MAPPING, _SEQUENCE, _PRIMITIVE, _OBJECT, _OTHER,
+) = range(27)
+_KIND_CLASSES = [
+    (str, _STR), (Signal, _SIGNAL), (Const, _CONST), (Operator, _OPERATOR), (Slice, _SLICE), (Part, _PART),
+    (Concat, _CONCAT), (SwitchValue, _SWITCH_VALUE), (ArrayProxy, _ARRAY_PROXY), (ClockSignal, _CLOCK_SIGNAL),
+    (ResetSignal, _RESET_SIGNAL), (AnyValue, _ANY_VALUE), (Initial, _INITIAL), (IOPort, _IO_PORT), (IOSlice, _IO_SLICE),
+    (IOConcat, _IO_CONCAT), (ValueCastable, _VALUE_CASTABLE), (Assign, _ASSIGN), (Switch, _SWITCH),
+    (Property, _PROPERTY), (Print, _PRINT), (Format, _FORMAT), (Mapping, _MAPPING), ((list, tuple), _SEQUENCE),
+    ((int, float, bytes, bool, type(None)), _PRIMITIVE),
+]
+_kinds = {}
+
+
+def _kind(cls):
+    for classes, kind in _KIND_CLASSES:
+        if issubclass(cls, classes):
+            break
+    else:
+        kind = _OBJECT if hasattr(cls, "__dict__") and not issubclass(cls, type) else _OTHER
+    _kinds[cls] = kind
+    return kind
+
+
+class _Hasher:
+    def __init__(self):
+        self.design = hashlib.sha256()
+        self.signal_ids = {}  # id(signal) -> number
+        self.signal_descriptions = {}  # id(signal) -> description
+        self.object_ids = {}  # id(object) -> number; for the generic objects that are walked by their attributes
+        self.fragment_digests = {}
+
+    def hash_fragment(self, fragment, path):
+        local = hashlib.sha256()
+        tokens = [f"fragment {type(fragment).__qualname__}"]
+
+        def flush():
+            # the tokens contain strings and signals. signals are identified by their number in the design hash and by
+            # their description in the local hash.
+            design_tokens = []
+            local_tokens = []
+            for token in tokens:
+                if token.__class__ is str:
+                    design_tokens.append(token)
+                    local_tokens.append(token)
+                    continue
+                if (number := self.signal_ids.get(id(token))) is None:
+                    number = self.signal_ids[id(token)] = len(self.signal_ids)
+                    description = self.signal_descriptions[id(token)] = \
+                        f"signal {token.name} {token.shape()!r} {token.init} {token.reset_less}"
+                    design_tokens.append(f"{description} {dict(token.attrs)!r} as {number}")
+                else:
+                    description = self.signal_descriptions[id(token)]
+                    design_tokens.append(f"signal {number}")
+                local_tokens.append(description)
+            self.design.update("\0".join(design_tokens).encode() + b"\0")
+            local.update("\0".join(local_tokens).encode() + b"\0")
+            tokens.clear()
+
+        def value(root):
+            stack = [root]
+            while stack:
+                obj = stack.pop()
+                if len(tokens) > _FLUSH_TOKENS:
+                    flush()
+                kind = _kinds.get(obj.__class__)
+                if kind is None:
+                    kind = _kind(obj.__class__)
+
+                if kind == _STR or kind == _SIGNAL:
+                    tokens.append(obj)
+                elif kind == _CONST:
+                    tokens.append(f"const {obj._value} {obj._shape!r}")
+                elif kind == _OPERATOR:
+                    tokens.append(f"op {obj.operator} {len(obj.operands)}")
+                    stack.extend(reversed(obj.operands))
+                elif kind == _SLICE:
+                    tokens.append(f"slice {obj.start} {obj.stop}")
+                    stack.append(obj.value)
+                elif kind == _ASSIGN:
+                    tokens.append("assign")
+                    stack.append(obj.rhs)
+                    stack.append(obj.lhs)
+                elif kind == _SWITCH:
+                    tokens.append(f"switch {len(obj.cases)}")
+                    for patterns, statements, _src_loc in reversed(obj.cases):
+                        stack.extend(reversed(statements))
+                        stack.append(f"case {patterns!r} {len(statements)}")
+                    stack.append(obj.test)
+                elif kind == _CONCAT:
+                    tokens.append(f"cat {len(obj.parts)}")
+                    stack.extend(reversed(obj.parts))
+                elif kind == _PART:
+                    tokens.append(f"part {obj.width} {obj.stride}")
+                    stack.extend([obj.offset, obj.value])
+                elif kind == _SWITCH_VALUE:
+                    tokens.append(f"switchvalue {len(obj.cases)}")
+                    for patterns, case_value in reversed(obj.cases):
+                        stack.extend([case_value, f"patterns {patterns!r}"])
+                    stack.append(obj.test)
+                elif kind == _ARRAY_PROXY:
+                    tokens.append(f"array {len(obj.elems)}")
+                    stack.extend(reversed([obj.index, *obj.elems]))
+                elif kind == _CLOCK_SIGNAL:
+                    tokens.append(f"clk {obj.domain}")
+                elif kind == _RESET_SIGNAL:
+                    tokens.append(f"rst {obj.domain} {obj.allow_reset_less}")
+                elif kind == _ANY_VALUE:
+                    tokens.append(f"any {obj.kind} {obj.shape()!r}")
+                elif kind == _INITIAL:
+                    tokens.append("initial")
+                elif kind == _IO_PORT:
+                    tokens.append(f"ioport {obj.name} {obj.width} {dict(obj.attrs)!r}")
+                elif kind == _IO_SLICE:
+                    tokens.append(f"ioslice {obj.start} {obj.stop}")
+                    stack.append(obj.value)
+                elif kind == _IO_CONCAT:
+                    tokens.append(f"iocat {len(obj.parts)}")
+                    stack.extend(reversed(obj.parts))
+                elif kind == _VALUE_CASTABLE:
+                    stack.append(Value.cast(obj))
+                elif kind == _PROPERTY:
+                    tokens.append(f"property {obj.kind} {obj.message is not None}")
+                    stack.extend([obj.message, obj.test] if obj.message is not None else [obj.test])
+                elif kind == _PRINT:
+                    tokens.append("print")
+                    stack.append(obj.message)
+                elif kind == _FORMAT:
+                    tokens.append(f"format {len(obj._chunks)}")
+                    for chunk in reversed(obj._chunks):
+                        if isinstance(chunk, str):
+                            stack.append(f"text {chunk!r}")
+                        else:
+                            chunk_value, format_spec = chunk
+                            stack.extend([f"spec {format_spec!r}", chunk_value])
+                # containers and other python objects (e.g. instance parameters or memory ports)
+                elif kind == _MAPPING:
+                    tokens.append(f"dict {len(obj)}")
+                    for key, item in reversed(list(obj.items())):
+                        stack.extend([item, f"key {key!r}"])
+                elif kind == _SEQUENCE:
+                    tokens.append(f"list {len(obj)}")
+                    stack.extend(reversed(obj))
+                elif kind == _PRIMITIVE:
+                    tokens.append(repr(obj))
+                elif kind == _OBJECT:
+                    if (number := self.object_ids.get(id(obj))) is not None:
+                        tokens.append(f"object {number}")
+                    else:
+                        self.object_ids[id(obj)] = len(self.object_ids)
+                        tokens.append(f"object {type(obj).__qualname__}")
+                        stack.append({k: v for k, v in vars(obj).items() if k not in ("src_loc", "_MustUse__context")})
+                else:
+                    tokens.append(f"{type(obj).__qualname__} {obj!r}")
+
+        for domain, statements in fragment.statements.items():
+            tokens.append(f"domain statements {domain} {len(statements)}")
+            for statement in statements:
+                value(statement)
+        for name, domain in fragment.domains.items():
+            tokens.append(f"clock domain {name} {domain.name} local={domain.local} async_reset={domain.async_reset}")
+            value(domain.clk)
+            value(domain.rst)
+        if isinstance(fragment, Instance):
+            tokens.append(f"instance {fragment.type}")
+            value(fragment.parameters)
+            value(fragment.ports)
+        # fragment subclasses (e.g. the MemoryInstance) have additional attributes
+        value({name: attr for name, attr in vars(fragment).items()
+               if name not in _IGNORED_FRAGMENT_ATTRIBUTES and name not in ("statements", "domains", "type", "parameters", "ports")})
+        flush()
+        self.fragment_digests[path] = local.hexdigest()[:16]
+
+        self.design.update(f"children {len(fragment.subfragments)}\0".encode())
+        for i, (subfragment, name, _src_loc) in enumerate(fragment.subfragments):
+            child_path = f"{path}.{name if name is not None else f'<unnamed #{i}>'}"
+            self.design.update(f"child {name}\0".encode())
+            self.hash_fragment(subfragment, child_path)
+
+
+def fragment_hash(fragment: Fragment, name="top") -> FragmentHash:
+    """Computes the structural hash of an elaborated design (see the comment at the top of this file)"""
+    hasher = _Hasher()
+    hasher.hash_fragment(fragment, name)
+    return FragmentHash(hasher.design.hexdigest(), hasher.fragment_digests)
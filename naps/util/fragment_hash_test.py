@@ -0,0 +1,79 @@
+import unittest
+
+from amaranth import *
+from amaranth.lib.memory import Memory
+
+from naps import SimPlatform, SimSocPlatform, ControlSignal
+from naps.cores.peripherals import CsrBank
+from .fragment_hash import fragment_hash, FragmentHash
+
+
+class Child(Elaboratable):
+    def __init__(self, init=0, name_clash=False):
+        self.init = init
+        self.name_clash = name_clash
+
+    def elaborate(self, platform):
+        m = Module()
+        a, b, out = Signal(8, name="x"), Signal(8, name="x" if self.name_clash else "y"), Signal(8)
+        m.d.sync += out.eq(Mux(a[0], a + 1, b << 2))
+        with m.Switch(a):
+            with m.Case(3):
+                m.d.comb += b.eq(a)
+        m.submodules.memory = Memory(shape=8, depth=4, init=[self.init])
+        return m
+
+
+class Top(Elaboratable):
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.child = Child(**self.kwargs)
+        m.submodules.other = Child()
+        m.submodules += Instance("FOO", p_PARAM=self.kwargs.get("init", 0), i_x=Signal())
+        return m
+
+
+def csr_design(init=0, n_banks=30, n_csrs=100):
+    platform = SimSocPlatform(SimPlatform())
+    m = Module()
+    for b in range(n_banks):
+        bank = m.submodules[f"bank{b}"] = CsrBank(f"bank{b}")
+        for i in range(n_csrs):
+            bank.reg(f"csr{i}", ControlSignal(32, init=init if (b, i) == (3, 5) else 0))
+    return platform.prepare_soc(m)
+
+
+class FragmentHashTest(unittest.TestCase):
+    def test_deterministic(self):
+        self.assertEqual(fragment_hash(Fragment.get(Top(), None)).digest, fragment_hash(Fragment.get(Top(), None)).digest)
+
+    def test_changes(self):
+        base = fragment_hash(Fragment.get(Top(), None))
+
+        # memory contents and instance parameters are part of the hash
+        changed = fragment_hash(Fragment.get(Top(init=1), None))
+        self.assertNotEqual(changed.digest, base.digest)
+        self.assertEqual(
+            sorted(changed.changed_fragments(base)), [("top.<unnamed #2>", "changed"), ("top.child.memory", "changed")]
+        )
+
+        # two signals with the same name are still distinguished
+        name_clash = fragment_hash(Fragment.get(Top(name_clash=True), None))
+        self.assertNotEqual(name_clash.digest, base.digest)
+
+    def test_serialize(self):
+        design_hash = fragment_hash(Fragment.get(Top(), None))
+        deserialized = FragmentHash.deserialize(design_hash.serialize())
+        self.assertEqual(deserialized.digest, design_hash.digest)
+        self.assertEqual(deserialized.fragment_digests, design_hash.fragment_digests)
+
+    def test_many_csrs(self):
+        design_hash = fragment_hash(csr_design())
+        self.assertEqual(fragment_hash(csr_design()).digest, design_hash.digest)
+        self.assertGreaterEqual(len(design_hash.fragment_digests), 30)  # at least one fragment per bank
+        # only the fragment that contains the statements of the changed csr differs
+        changes = fragment_hash(csr_design(init=1)).changed_fragments(design_hash)
+        self.assertEqual([change for _, change in changes], ["changed"])
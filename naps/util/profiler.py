@@ -0,0 +1,247 @@
+# A small hierarchical profiler for the build pipeline.
+#
+# Spans can be nested and record the wall time, the cpu time (of this process and of the waited for child processes,
+# e.g. the vendor toolchain) and the peak rss. The finished spans can be summarized as a tree (where spans with the same
+# path are merged and counted) or exported as a chrome trace (load it in chrome://tracing or https://ui.perfetto.dev).
+
+import atexit
+import inspect
+import json
+import os
+import resource
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from time import time_ns, perf_counter_ns, process_time_ns
+from typing import List, Dict
+
+__all__ = [
+    "SpanRecord", "span", "instrumented", "start_task", "end_task", "records", "add_records", "reset",
+    "format_summary", "chrome_trace", "write_chrome_trace",
+]
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    path: tuple  # the names of all the parent spans and this span
+    start: float  # unix timestamp in seconds
+    wall: float  # in seconds
+    cpu: float  # in seconds
+    children_cpu: float  # cpu time of child processes that finished during the span in seconds
+    max_rss: int  # peak rss of this process at the end of the span in bytes
+    children_max_rss: int  # peak rss of the largest child process in bytes
+    pid: int
+    args: Dict = field(default_factory=dict)
+
+
+_stack = []
+_records: List[SpanRecord] = []
+_task = None
+
+
+def _rusage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_maxrss * 1024, children.ru_utime + children.ru_stime, children.ru_maxrss * 1024
+
+
+class _OpenSpan:
+    __slots__ = ("name", "path", "args", "start", "start_ns", "cpu_ns", "children_cpu")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.path = (_stack[-1].path if _stack else ()) + (name,)
+        self.args = args
+        self.start = time_ns() / 1e9
+        self.start_ns = perf_counter_ns()
+        self.cpu_ns = process_time_ns()
+        self.children_cpu = _rusage()[1]
+
+    def close(self):
+        wall = (perf_counter_ns() - self.start_ns) / 1e9
+        cpu = (process_time_ns() - self.cpu_ns) / 1e9
+        max_rss, children_cpu, children_max_rss = _rusage()
+        record = SpanRecord(
+            self.name, self.path, self.start, wall, cpu, children_cpu - self.children_cpu, max_rss, children_max_rss,
+            os.getpid(), self.args,
+        )
+        _records.append(record)
+        if len(self.path) == 1:
+            _print_record(record)
+        return record
+
+
+def _open(name, args):
+    opened = _OpenSpan(name, args)
+    _stack.append(opened)
+    return opened
+
+
+def _close(opened):
+    assert _stack and _stack[-1] is opened, "profiler spans must be closed in the reverse order they were opened"
+    _stack.pop()
+    return opened.close()
+
+
+@contextmanager
+def span(name, **args):
+    """
+    Profiles the enclosed block (or the decorated function) as a span nested into the currently open span.
+    :param args: additional information that is stored with the span (e.g. the command line of a tool)
+    """
+    opened = _open(name, args)
+    try:
+        yield
+    finally:
+        _close(opened)
+
+
+@contextmanager
+def instrumented(owner, attribute, name, max_depth=None):
+    """
+    Wraps the function owner.attribute in a span while the context is active.
+    :param name: the name of the spans or a function that computes it from the arguments of the call
+    :param max_depth: only create spans for the outermost max_depth (recursive) calls
+    """
+    original = inspect.getattr_static(owner, attribute)
+    function = getattr(owner, attribute)
+    depth = 0
+
+    def wrapper(*args, **kwargs):
+        nonlocal depth
+        depth += 1
+        try:
+            if max_depth is not None and depth > max_depth:
+                return function(*args, **kwargs)
+            with span(name(*args, **kwargs) if callable(name) else name):
+                return function(*args, **kwargs)
+        finally:
+            depth -= 1
+
+    setattr(owner, attribute, staticmethod(wrapper) if isinstance(original, staticmethod) else wrapper)
+    try:
+        yield
+    finally:
+        setattr(owner, attribute, original)
+
+
+def start_task(name):
+    """Starts a new top level task span. The currently running task (if any) is ended."""
+    end_task()
+    print(f"\n### starting {name}")
+    global _task
+    _task = _open(name, {})
+
+
+def end_task():
+    global _task
+    if _task is not None:
+        _close(_task)
+    _task = None
+
+
+def records() -> List[SpanRecord]:
+    """:return: all finished spans in the order they were finished"""
+    return list(_records)
+
+
+def add_records(new_records: List[SpanRecord], prefix=()):
+    """Adds spans that were recorded elsewhere (e.g. in a worker process), optionally nesting them under a prefix path"""
+    for record in new_records:
+        _records.append(SpanRecord(**{**asdict(record), "path": tuple(prefix) + tuple(record.path)}))
+
+
+def reset():
+    """Forgets all recorded spans; the currently open spans stay open"""
+    _records.clear()
+
+
+def _format_seconds(seconds):
+    return f"{seconds:.2f} s" if seconds >= 0.1 else f"{seconds * 1e3:.1f} ms"
+
+
+def _print_record(record: SpanRecord):
+    print(f"🕑 {record.name} took {_format_seconds(record.wall)}")
+
+
+def format_summary(records_to_summarize: List[SpanRecord] = None, min_wall=0.0):
+    """
+    Formats the spans as a tree in which spans with the same path are merged.
+    Every line shows the number of calls, the total wall time, the total cpu time (including child processes) and the
+    peak rss.
+    """
+    if records_to_summarize is None:
+        records_to_summarize = _records
+    merged = {}
+    for record in records_to_summarize:
+        entry = merged.setdefault(record.path, [0, 0.0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += record.wall
+        entry[2] += record.cpu + record.children_cpu
+        entry[3] = max(entry[3], record.max_rss, record.children_max_rss)
+
+    # sort the paths by their first occurrence so that the tree keeps the chronological order of the spans
+    first_start = {}
+    for record in records_to_summarize:
+        for i in range(1, len(record.path) + 1):  # ancestors without own records (e.g. prefixes) are included
+            first_start[record.path[:i]] = min(first_start.get(record.path[:i], record.start), record.start)
+    order = sorted(first_start, key=lambda path: tuple(first_start[path[:i + 1]] for i in range(len(path))))
+
+    lines = []
+    for path in order:
+        indent = "  " * (len(path) - 1)
+        if path not in merged:
+            lines.append(f"{indent}{path[-1]}")
+            continue
+        calls, wall, cpu, max_rss = merged[path]
+        if wall < min_wall:
+            continue
+        calls_str = f" ({calls} calls)" if calls > 1 else ""
+        lines.append(
+            f"{indent}🕑 {path[-1]}{calls_str} took {_format_seconds(wall)} "
+            f"(cpu {_format_seconds(cpu)}, peak rss {max_rss / 2**20:.0f} MiB)"
+        )
+    return "\n".join(lines)
+
+
+def chrome_trace(records_to_export: List[SpanRecord] = None):
+    """:return: the spans as a chrome trace (a json serializable dict)"""
+    if records_to_export is None:
+        records_to_export = _records
+    origin = min((record.start for record in records_to_export), default=0)
+    events = []
+    for record in sorted(records_to_export, key=lambda record: (record.start, -record.wall)):
+        events.append({
+            "name": record.name,
+            "ph": "X",
+            "ts": (record.start - origin) * 1e6,
+            "dur": record.wall * 1e6,
+            "pid": record.pid,
+            "tid": record.pid,
+            "args": {
+                **{k: str(v) for k, v in record.args.items()},
+                "path": "/".join(record.path),
+                "cpu_s": record.cpu,
+                "children_cpu_s": record.children_cpu,
+                "max_rss_mib": record.max_rss / 2**20,
+                "children_max_rss_mib": record.children_max_rss / 2**20,
+            },
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(path, records_to_export: List[SpanRecord] = None):
+    with open(path, "w") as f:
+        json.dump(chrome_trace(records_to_export), f)
+
+
+@atexit.register
+def print_summary_at_end():
+    end_task()
+    summary = format_summary(min_wall=0.01) if os.getpid() == _main_pid else ""
+    if summary:
+        print(f"\n### naps finished - timing summary")
+        print(summary)
+
+
+_main_pid = os.getpid()
@@ -0,0 +1,66 @@
+import json
+import subprocess
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from amaranth import *
+
+from . import profiler
+
+
+class Child(Elaboratable):
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.grandchild = Module()
+        return m
+
+
+class Parent(Elaboratable):
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.a = Child()
+        m.submodules.b = Child()
+        return m
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        profiler.reset()
+        self.addCleanup(profiler.reset)
+
+    def test_nested_spans(self):
+        with profiler.span("outer"):
+            for i in range(3):
+                with profiler.span("inner", i=i):
+                    subprocess.check_call(["true"])
+        paths = [record.path for record in profiler.records()]
+        self.assertEqual(paths, [("outer", "inner")] * 3 + [("outer",)])
+        outer = profiler.records()[-1]
+        self.assertGreaterEqual(outer.wall, sum(record.wall for record in profiler.records()[:3]))
+        self.assertGreater(outer.max_rss, 0)
+        self.assertIn("inner (3 calls)", profiler.format_summary())
+
+    def test_instrumented(self):
+        with profiler.instrumented(Fragment, "get", lambda obj, platform: f"elaborate {type(obj).__name__}", max_depth=2):
+            Fragment.get(Parent(), None)
+        self.assertEqual(
+            [record.path for record in profiler.records()],
+            [("elaborate Parent", "elaborate Child")] * 2 + [("elaborate Parent",)]
+        )
+        # the original function is restored afterwards
+        Fragment.get(Parent(), None)
+        self.assertEqual(len(profiler.records()), 3)
+
+    def test_chrome_trace(self):
+        profiler.start_task("first")
+        with profiler.span("step", command="yosys"):
+            pass
+        profiler.start_task("second")
+        profiler.end_task()
+        with TemporaryDirectory() as dir:
+            profiler.write_chrome_trace(Path(dir) / "trace.json")
+            trace = json.loads((Path(dir) / "trace.json").read_text())
+        self.assertEqual([event["name"] for event in trace["traceEvents"]], ["first", "step", "second"])
+        self.assertEqual(trace["traceEvents"][1]["args"]["command"], "yosys")
+        self.assertEqual(trace["traceEvents"][1]["args"]["path"], "first/step")
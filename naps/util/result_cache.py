@@ -0,0 +1,170 @@
+# A cache of the green simulation tests that lets the test runner skip the tests which did not change (see conftest.py).
+#
+# Every call of SimPlatform.sim() computes a key from the structural hash of the design, the simulation engine, the code
+# of the testbench processes (including the source files of the helpers they reference), and the inputs the processes
+# captured (e.g. the numpy arrays that are written to a stream). A test that passed with exactly one simulation is
+# skipped in later runs if its source file and the key of that simulation are unchanged. Tests that simulate more than
+# one design are always run, because later designs could depend on code that only runs after the first simulation.
+
+import hashlib
+import inspect
+import unittest
+from pathlib import Path
+from types import CodeType, FunctionType, MethodType
+
+from amaranth.hdl import Value, ValueCastable, Elaboratable
+
+from .fragment_hash import fragment_hash
+
+__all__ = ["ResultRecord", "start_test", "finish_test", "check_simulation", "file_digest"]
+
+SKIP_REASON = "the simulation did not change since the last green run"
+
+_ROOT = Path(__file__).parents[2]
+# the files that implement the simulation engines
+_ENGINE_SOURCES = {
+    "pysim": [Path(__file__).parent / "sim.py"],
+    "cxxrtl": [Path(__file__).parent / "sim.py", Path(__file__).parent / "sim_cxxrtl.py",
+               Path(__file__).parent / "sim_cxxrtl_bridge.cc"],
+}
+
+
+class ResultRecord:
+    """The simulations of the currently running test and the record of its last green run"""
+    def __init__(self, source_digest, previous=None, skip_unchanged=False):
+        self.source_digest = source_digest
+        self.previous = previous
+        self.skip_unchanged = skip_unchanged
+        self.simulations = []
+
+    def serialize(self):
+        return {"source": self.source_digest, "simulations": self.simulations}
+
+
+_current = None
+
+
+def start_test(record: ResultRecord):
+    global _current
+    _current = record
+
+
+def finish_test(passed):
+    """:return: the record that should be stored for the test or None if nothing should be stored"""
+    global _current
+    record, _current = _current, None
+    if record is None or not passed or not record.simulations:
+        return None
+    return record.serialize()
+
+
+def file_digest(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def check_simulation(fragment, processes, engine):
+    """
+    Called by SimPlatform.sim() before a simulation is started.
+    :raises unittest.SkipTest: if the simulation and the test did not change since its last green run
+    """
+    if _current is None:
+        return
+    key = simulation_key(fragment, processes, engine)
+    _current.simulations.append(key)
+    previous = _current.previous
+    if (_current.skip_unchanged and previous is not None and len(_current.simulations) == 1
+            and previous["source"] == _current.source_digest and previous["simulations"] == [key]):
+        raise unittest.SkipTest(SKIP_REASON)
+
+
+def simulation_key(fragment, processes, engine):
+    hasher = _InputHasher()
+    hasher.update(f"engine {engine}")
+    for generator, domain in processes:
+        hasher.update(f"process {domain}")
+        hasher.value(generator)
+    files = sorted({*hasher.files, *_ENGINE_SOURCES.get(engine, [])})
+    return hashlib.sha256("\0".join([
+        fragment_hash(fragment).digest, hasher.digest.hexdigest(), *(f"{path} {file_digest(path)}" for path in files),
+    ]).encode()).hexdigest()
+
+
+class _InputHasher:
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.files = set()  # the source files of the helpers that are referenced by the processes
+        self.seen = set()
+
+    def update(self, token):
+        self.digest.update(token.encode() + b"\0")
+
+    def value(self, obj):
+        if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, range)):
+            self.update(repr(obj))
+        elif isinstance(obj, (Value, ValueCastable, Elaboratable)):
+            # parts of the design are covered by the design hash
+            self.update(f"design object {type(obj).__qualname__}")
+        elif id(obj) in self.seen:
+            self.update("seen")
+        elif isinstance(obj, MethodType):
+            self.value(obj.__func__)
+        elif isinstance(obj, FunctionType):
+            self.seen.add(id(obj))
+            self.function(obj)
+        elif isinstance(obj, (list, tuple)):
+            self.seen.add(id(obj))
+            self.update(f"list {len(obj)}")
+            for item in obj:
+                self.value(item)
+        elif isinstance(obj, (set, frozenset)):
+            self.update(f"set {sorted(repr(item) for item in obj)}")
+        elif isinstance(obj, dict):
+            self.seen.add(id(obj))
+            self.update(f"dict {len(obj)}")
+            for key, item in obj.items():
+                self.value(key)
+                self.value(item)
+        elif hasattr(obj, "dtype") and hasattr(obj, "tobytes"):  # numpy arrays
+            self.update(f"array {obj.dtype} {getattr(obj, 'shape', ())}")
+            self.digest.update(obj.tobytes())
+        else:
+            # other objects (e.g. the test case) are only identified by their type
+            self.update(f"object {type(obj).__module__}.{type(obj).__qualname__}")
+            self.source_file(type(obj))
+
+    def function(self, function):
+        self.code(function.__code__, function.__globals__)
+        self.value(function.__defaults__)
+        for cell in function.__closure__ or ():
+            try:
+                self.value(cell.cell_contents)
+            except ValueError:  # an empty cell
+                self.update("empty cell")
+
+    def code(self, code, globals):
+        self.update(f"code {code.co_name}")
+        self.digest.update(code.co_code)
+        self.update(repr(code.co_names))
+        for const in code.co_consts:
+            if isinstance(const, CodeType):
+                self.code(const, globals)
+            else:
+                self.value(const)
+        for name in code.co_names:
+            referenced = globals.get(name)
+            if inspect.isclass(referenced):
+                self.source_file(referenced)
+            elif inspect.isfunction(referenced) and self.source_file(referenced):
+                # helpers (e.g. write_to_stream) are followed because they may call helpers from other files
+                self.value(referenced)
+
+    def source_file(self, obj):
+        """:return: whether the object is defined in a file of this repository (which is then part of the key)"""
+        try:
+            path = Path(inspect.getsourcefile(obj)).resolve()
+        except (TypeError, OSError):
+            return False
+        if _ROOT not in path.parents:
+            return False
+        self.files.add(path)
+        return True
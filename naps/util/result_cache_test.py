@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import numpy as np
+from amaranth import *
+
+from naps.stream import BasicStream, write_arrays_to_stream
+from .result_cache import simulation_key
+
+
+class Design(Elaboratable):
+    def __init__(self, increment=1):
+        self.increment = increment
+        self.counter = Signal(8)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.sync += self.counter.eq(self.counter + self.increment)
+        return m
+
+
+def key(increment=1, data=(1, 2, 3), engine="pysim", pause_probability=0.0):
+    design = Design(increment)
+    stream = BasicStream(8)
+    payload = np.array(data)
+
+    def testbench():
+        yield from write_arrays_to_stream(stream, pause_probability=pause_probability, payload=payload)
+        assert (yield design.counter) == {"a", "b", "c"}.pop()
+
+    return simulation_key(Fragment.get(design, None), [(testbench, "sync")], engine)
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_unchanged(self):
+        self.assertEqual(key(), key())
+
+    def test_changes(self):
+        keys = [key(), key(increment=2), key(data=(1, 2, 4)), key(engine="cxxrtl"), key(pause_probability=0.5)]
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_hash_seed(self):
+        # the key is stored between runs and therefore must not depend on the hash randomization of python
+        code = "from naps.util.result_cache_test import key; print(key())"
+        keys = {
+            subprocess.check_output([sys.executable, "-c", code], env={**os.environ, "PYTHONHASHSEED": str(seed)}, text=True)
+            for seed in range(3)
+        }
+        self.assertEqual(len(keys), 1)
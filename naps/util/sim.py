@@ -7,7 +7,11 @@ from amaranth import Signal
 from amaranth.hdl import ValueCastable
 from amaranth.sim import Simulator
 
-__all__ = ["SimPlatform", "FakeResource", "OutputIo", "InputIo", "TristateIo", "TristateDdrIo", "SimDdr", "wait_for", "pulse", "do_nothing", "resolve"]
+from .env import naps_getenv
+from .result_cache import check_simulation
+from .sim_trace import SimTrace, PysimTracer
+
+__all__ = ["SimPlatform", "BulkSimCommand", "FakeResource", "OutputIo", "InputIo", "TristateIo", "TristateDdrIo", "SimDdr", "wait_for", "pulse", "do_nothing", "resolve"]
 
 
 class SimPlatform:
@@ -65,14 +69,21 @@ class SimPlatform:
     def add_sim_clock(self, domain_name, frequency, phase=0):
         self.clocks[domain_name] = (frequency, phase)
 
-    def sim(self, dut, testbench=None, traces=(), engine="pysim"):
+    def sim(self, dut, testbench=None, traces=(), engine=None, trace=None):
+        """
+        Simulates the design with all added processes (and the testbench) until all non passive processes are done.
+        :param traces: the signals that are shown in the gtkwave save file (only for unfiltered pysim traces)
+        :param engine: "pysim" (the amaranth python simulator) or "cxxrtl" (see sim_cxxrtl.py); defaults to the
+                       NAPS_SIM_ENGINE environment variable or "pysim"
+        :param trace: a SimTrace that controls which traces are written; defaults to SimTrace.from_env() (see
+                      sim_trace.py)
+        """
+        if engine is None:
+            engine = naps_getenv("SIM_ENGINE", "pysim")
+        if trace is None:
+            trace = SimTrace.from_env()
         dut = self.prepare(dut)
         self.fragment = dut
-        simulator = Simulator(dut, engine=engine)
-        for name, (frequency, phase) in self.clocks.items():
-            import sys
-            print(name, self.clocks, file=sys.stderr)
-            simulator.add_clock(1 / frequency, domain=name, phase=phase)
 
         if isinstance(testbench, tuple):
             generator, domain = testbench
@@ -84,13 +95,113 @@ class SimPlatform:
         else:
             raise TypeError("unknown type for testbench")
 
+        # skips the test if nothing changed since its last green run (only when run by pytest, see result_cache.py)
+        check_simulation(dut, self.processes, engine)
+
+        vcd_path = "{}.vcd".format(self.output_filename_base)
+        # the trace window and history are given in cycles of the fastest clock
+        period_s = 1 / max(frequency for frequency, phase in self.clocks.values()) if self.clocks else 1e-6
+
+        if engine == "cxxrtl":
+            from .sim_cxxrtl import CxxrtlSimulator
+            simulator = CxxrtlSimulator(dut)
+            for name, (frequency, phase) in self.clocks.items():
+                simulator.add_clock(1 / frequency, phase, domain=name)
+            for generator, domain in self.processes:
+                simulator.add_process(generator, domain=domain)
+            if trace.mode != "none":
+                period_ps = round(period_s * 1e12)
+                start, stop = trace.window_fs(period_ps)
+                if trace.mode == "all":
+                    print("\nwriting vcd to '{}'".format(vcd_path))
+                simulator.write_vcd(
+                    vcd_path,
+                    select=trace.selects if trace.signals else None,
+                    window=(start, stop if stop is not None else 2**64 - 1),
+                    history=trace.history * period_ps if trace.mode == "failure" else None,
+                )
+            try:
+                simulator.run()
+            except BaseException:
+                if trace.mode != "none":
+                    trace.finish(vcd_path)
+                raise
+            if trace.mode == "all":
+                trace.finish(vcd_path)
+            return
+
+        simulator = Simulator(dut, engine=engine)
+        for name, (frequency, phase) in self.clocks.items():
+            import sys
+            print(name, self.clocks, file=sys.stderr)
+            simulator.add_clock(1 / frequency, domain=name, phase=phase)
+
         for generator, domain in self.processes:
-            simulator.add_sync_process(generator, domain=domain)
+            simulator.add_sync_process(_run_bulk_commands(generator), domain=domain)
 
-        print("\nwriting vcd to '{}.vcd'".format(self.output_filename_base))
-        with simulator.write_vcd("{}.vcd".format(self.output_filename_base), "{}.gtkw".format(self.output_filename_base),
-                                 traces=traces):
+        if trace.mode == "none":
             simulator.run()
+        elif trace.mode == "all" and not trace.is_filtered:
+            print("\nwriting vcd to '{}'".format(vcd_path))
+            try:
+                with simulator.write_vcd(vcd_path, "{}.gtkw".format(self.output_filename_base), traces=traces):
+                    simulator.run()
+            finally:
+                trace.finish(vcd_path)
+        else:
+            tracer = PysimTracer(simulator, vcd_path, trace, round(period_s * 1e15))
+            if trace.mode == "all":
+                print("\nwriting vcd to '{}'".format(vcd_path))
+            simulator._engine._vcd_writers.append(tracer)
+            try:
+                simulator.run()
+            except BaseException:
+                if trace.mode == "failure":
+                    print("\nwriting the last cycles before the failure to '{}'".format(vcd_path))
+                    tracer.dump()
+                tracer.close(simulator._engine.now)
+                trace.finish(vcd_path)
+                raise
+            finally:
+                simulator._engine._vcd_writers.remove(tracer)
+            tracer.close(simulator._engine.now)
+            if trace.mode == "all":
+                trace.finish(vcd_path)
+
+
+class BulkSimCommand:
+    """
+    A command that testbench processes can yield to hand work that spans many cycles to the simulation engine
+    (e.g. a whole stream transfer). Engines that have no native implementation of a command run its python
+    implementation instead. The result of the command is sent back to the process.
+    """
+
+    def run(self):
+        """The python implementation of the command as a generator that is run in place of the process"""
+        raise NotImplementedError()
+
+
+def _run_bulk_commands(process):
+    """Wraps a process for the python simulator so that it runs the python implementation of BulkSimCommands"""
+    def wrapper():
+        generator = process()
+        result = None
+        exception = None
+        while True:
+            try:
+                command = generator.send(result) if exception is None else generator.throw(exception)
+            except StopIteration:
+                return
+            try:
+                if isinstance(command, BulkSimCommand):
+                    result = yield from command.run()
+                else:
+                    result = yield command
+                exception = None
+            except Exception as e:
+                result = None
+                exception = e
+    return wrapper
 
 
 class FakeResource(ValueCastable):
@@ -0,0 +1,564 @@
+# A simulation engine that compiles the design to c++ with the CXXRTL backend of yosys and drives it from the same
+# (generator based) testbench processes as the amaranth python simulator.
+#
+# The design is converted to rtlil, translated to c++ by yosys and compiled together with sim_cxxrtl_bridge.cc by the
+# system c++ compiler into a shared object. The shared object is cached by the structural hash of the design, so
+# rerunning a test only pays for the elaboration.
+#
+# Processes are resumed at the rising edges of their clock domain and observe the same semantics as sync processes in
+# the python simulator: they read the values from before the edge and their writes take effect after the edge.
+# Bulk stream transfers (see write_arrays_to_stream / read_arrays_from_stream) are run by stream bridges in c++;
+# while all processes are waiting for such transfers, whole stretches of cycles are simulated without python.
+# Falling clock edges are not scheduled on their own; designs that use both clock edges are not supported.
+
+import ctypes
+import hashlib
+import os
+import subprocess
+from itertools import islice
+from pathlib import Path
+
+from amaranth.back import rtlil
+from amaranth.hdl import Fragment, Instance, Signal, Const, Value, ValueCastable, Cat
+from amaranth.hdl._ast import (
+    Assign, Switch, Property, Print, Format, Operator, Slice, Part, Concat, SwitchValue, ArrayProxy, SignalDict,
+)
+from amaranth.hdl._ir import PortDirection
+from amaranth.hdl._mem import MemoryInstance
+from amaranth.sim import Tick, Passive, Active, Settle
+from amaranth._toolchain.yosys import find_yosys
+
+from .env import naps_getenv
+from .fragment_hash import fragment_hash
+from .sim import BulkSimCommand
+
+__all__ = ["CxxrtlSimulator"]
+
+BRIDGE_SOURCE = Path(__file__).parent / "sim_cxxrtl_bridge.cc"
+# public wires are kept as members of the design (-O4) because the on demand evaluation of inlined wires does not
+# support memory read ports
+CXXRTL_OPTIONS = ["-O4"]
+# out of bounds memory accesses are ignored (like in the python simulator) instead of aborting the process
+CXXFLAGS = ["-std=c++14", "-O1", "-fPIC", "-shared", "-DCXXRTL_NDEBUG"]
+
+# the results of naps_bridge_state()
+_BRIDGE_RUNNING, _BRIDGE_DONE, _BRIDGE_TIMEOUT = range(3)
+
+
+def _statement_signals(statement, driven, used):
+    """Collects the signals that are driven and used by a statement (ignoring clock and reset signals)"""
+    stack = [(statement, False)]
+    while stack:
+        obj, is_lhs = stack.pop()
+        if isinstance(obj, Signal):
+            (driven if is_lhs else used)[obj] = None
+        elif isinstance(obj, Assign):
+            stack += [(obj.lhs, True), (obj.rhs, False)]
+        elif isinstance(obj, Switch):
+            stack.append((obj.test, False))
+            stack += [(s, False) for _patterns, statements, _src_loc in obj.cases for s in statements]
+        elif isinstance(obj, Property):
+            stack += [(obj.test, False), (obj.message, False)] if obj.message is not None else [(obj.test, False)]
+        elif isinstance(obj, Print):
+            stack.append((obj.message, False))
+        elif isinstance(obj, Format):
+            stack += [(chunk[0], False) for chunk in obj._chunks if not isinstance(chunk, str)]
+        elif isinstance(obj, Operator):
+            stack += [(operand, False) for operand in obj.operands]
+        elif isinstance(obj, Slice):
+            stack.append((obj.value, is_lhs))
+        elif isinstance(obj, Part):
+            stack += [(obj.value, is_lhs), (obj.offset, False)]
+        elif isinstance(obj, Concat):
+            stack += [(part, is_lhs) for part in obj.parts]
+        elif isinstance(obj, SwitchValue):
+            stack.append((obj.test, False))
+            stack += [(value, is_lhs) for _patterns, value in obj.cases]
+        elif isinstance(obj, ArrayProxy):
+            stack.append((obj.index, False))
+            stack += [(elem, is_lhs) for elem in obj.elems]
+        elif isinstance(obj, ValueCastable):
+            stack.append((Value.cast(obj), is_lhs))
+
+
+def _undriven_signals(fragment):
+    """:return: the signals that are used but not driven by the design; they become inputs of the compiled design"""
+    driven, used = SignalDict(), SignalDict()
+    stack = [fragment]
+    while stack:
+        fragment = stack.pop()
+        for statements in fragment.statements.values():
+            for statement in statements:
+                _statement_signals(statement, driven, used)
+        if isinstance(fragment, Instance):
+            for value, direction in fragment.ports.values():
+                if isinstance(value, (Value, ValueCastable)):
+                    _statement_signals(Value.cast(value), driven, used)
+                    if direction != "i":
+                        _statement_signals(Value.cast(value).eq(0), driven, used)
+        if isinstance(fragment, MemoryInstance):
+            for port in fragment._read_ports:
+                _statement_signals(port._data.eq(Cat(port._addr, port._en)), driven, used)
+            for port in fragment._write_ports:
+                _statement_signals(Cat(port._addr, port._data, port._en), driven, used)
+        stack += [subfragment for subfragment, _name, _src_loc in fragment.subfragments]
+    return [signal for signal in used.keys() if signal not in driven]
+
+
+def _compile(rtlil_text, cache_key):
+    """Compiles the design (if it is not already cached) and returns the path of the shared object"""
+    yosys = find_yosys(lambda version: True)
+    key = hashlib.sha256("\0".join([
+        cache_key, BRIDGE_SOURCE.read_text(), *CXXRTL_OPTIONS, *CXXFLAGS, ".".join(map(str, yosys.version())),
+    ]).encode()).hexdigest()[:32]
+    cache_dir = Path(naps_getenv("CXXRTL_CACHE", Path.home() / ".cache" / "naps" / "cxxrtl"))
+    library = cache_dir / f"{key}.so"
+    if library.exists():
+        return library
+
+    build_dir = cache_dir / f"{key}.build.{os.getpid()}"
+    build_dir.mkdir(parents=True, exist_ok=True)
+    # the design is passed through stdin / stdout because the builtin (webassembly) yosys can only access the cwd
+    cxx_text = yosys.run(["-q", "-"], f"read_rtlil <<NAPS_EOF\n{rtlil_text}\nNAPS_EOF\nwrite_cxxrtl {' '.join(CXXRTL_OPTIONS)}\n", src_loc_at=0)
+    (build_dir / "design.cc").write_text(cxx_text)
+    runtime = Path(yosys.data_dir()) / "include" / "backends" / "cxxrtl" / "runtime"
+    subprocess.check_call([
+        os.environ.get("CXX", "c++"), *CXXFLAGS, "-I", str(runtime),
+        "-DCXXRTL_INCLUDE_CAPI_IMPL", "-DCXXRTL_INCLUDE_VCD_CAPI_IMPL",
+        str(build_dir / "design.cc"), str(BRIDGE_SOURCE), "-o", str(build_dir / "design.so"),
+    ])
+    os.replace(build_dir / "design.so", library)  # atomic, so that parallel test runs can share the cache
+    for f in build_dir.iterdir():
+        f.unlink()
+    build_dir.rmdir()
+    return library
+
+
+def _load(path):
+    lib = ctypes.CDLL(str(path))
+    p, u64, size, i32 = ctypes.c_void_p, ctypes.c_uint64, ctypes.c_size_t, ctypes.c_int
+    for name, restype, argtypes in [
+        ("cxxrtl_design_create", p, []),
+        ("cxxrtl_create", p, [p]),
+        ("cxxrtl_destroy", None, [p]),
+        ("cxxrtl_step", size, [p]),
+        ("naps_signal_get", p, [p, ctypes.c_char_p]),
+        ("naps_signal_width", size, [p]),
+        ("naps_signal_writable", i32, [p]),
+        ("naps_signal_read", None, [p, p]),
+        ("naps_signal_write", None, [p, p]),
+        ("naps_signal_read64", u64, [p]),
+        ("naps_signal_write64", None, [p, u64]),
+        ("naps_signal_free", None, [p]),
+        ("naps_bridge_create", p, [i32, p, p, size, p, p, p, p, p, size, size, u64, u64]),
+        ("naps_bridge_set_pauses", None, [p, p, size]),
+        ("naps_bridge_set_buffers", None, [p, p, p, size]),
+        ("naps_bridge_needs_space", i32, [p]),
+        ("naps_bridge_start", None, [p]),
+        ("naps_bridge_state", i32, [p]),
+        ("naps_bridge_needs_pauses", i32, [p]),
+        ("naps_bridge_index", size, [p]),
+        ("naps_bridge_free", None, [p]),
+        ("naps_bridges_pre_edge", i32, [p, size]),
+        ("naps_bridges_post_edge", None, [p, size]),
+        ("naps_edge_rise", None, [p, p]),
+        ("naps_edge_finish", None, [p, p, p, u64, u64]),
+        ("naps_run_bridges", u64, [p, p, p, size, u64, p, u64, u64, ctypes.POINTER(i32)]),
+        ("naps_vcd_create", p, [p, ctypes.c_char_p, i32, p, size, u64, u64, u64]),
+        ("naps_vcd_dump", i32, [p, ctypes.c_char_p]),
+        ("naps_vcd_close", None, [p]),
+    ]:
+        function = getattr(lib, name)
+        function.restype = restype
+        function.argtypes = argtypes
+    return lib
+
+
+def _to_signed(value, width):
+    return value - (1 << width) if value & (1 << (width - 1)) else value
+
+
+class _Bridge:
+    """A bulk stream transfer that is run by the c++ side"""
+
+    def __init__(self, simulator, command):
+        import numpy as np
+        self.command = command
+        self.lib = simulator.lib
+        fields = [simulator.signal(Value.cast(command.stream[name])) for name, _, _, _ in command.layout]
+        if command.is_writer:
+            self.words = np.array(command.words, dtype=np.uint64)
+        else:
+            self.words = np.zeros(min(command.count or 4096, 1 << 20), dtype=np.uint64)
+        self.cycles = np.zeros(len(self.words), dtype=np.uint64)
+        self.field_pointers = (ctypes.c_void_p * len(fields))(*fields)
+        self.offsets = (ctypes.c_uint * len(fields))(*(offset for _, offset, _, _ in command.layout))
+        self.widths = (ctypes.c_uint * len(fields))(*(width for _, _, width, _ in command.layout))
+        self.handle = self.lib.naps_bridge_create(
+            command.is_writer, simulator.signal(command.stream.valid), simulator.signal(command.stream.ready),
+            len(fields), self.field_pointers, self.offsets, self.widths, self.words.ctypes.data,
+            self.cycles.ctypes.data, len(self.words), command.count or (1 << 63), command.until_bit,
+            max(command.timeout, 0),
+        )
+        self.refill_pauses()
+        self.lib.naps_bridge_start(self.handle)
+
+    @staticmethod
+    def supported(simulator, command):
+        """:return: whether all signals of the stream are part of the compiled design and can be written if needed"""
+        written = [command.stream.valid, *(command.stream[name] for name, _, _, _ in command.layout)]
+        read = [command.stream.ready]
+        if not command.is_writer:
+            written, read = read, written
+        for signal in [*written, *read]:
+            value = Value.cast(signal)
+            if not isinstance(value, Signal) or simulator.signal(value) is None:
+                return False
+        return all(simulator.lib.naps_signal_writable(simulator.signal(Value.cast(signal))) for signal in written)
+
+    def refill_pauses(self):
+        import numpy as np
+        self.pauses = np.array(list(islice(self.command.pauses, 4096)), dtype=np.int64)
+        self.lib.naps_bridge_set_pauses(self.handle, self.pauses.ctypes.data, len(self.pauses))
+
+    def state(self):
+        """:return: the state of the bridge (after providing everything it needs) and the result if it is done"""
+        import numpy as np
+        if self.lib.naps_bridge_needs_pauses(self.handle):
+            self.refill_pauses()
+        if self.lib.naps_bridge_needs_space(self.handle):
+            self.words = np.concatenate([self.words, np.zeros_like(self.words)])
+            self.cycles = np.concatenate([self.cycles, np.zeros_like(self.cycles)])
+            self.lib.naps_bridge_set_buffers(self.handle, self.words.ctypes.data, self.cycles.ctypes.data, len(self.words))
+        state = self.lib.naps_bridge_state(self.handle)
+        if state == _BRIDGE_DONE:
+            n = self.lib.naps_bridge_index(self.handle)
+            return state, (self.words[:n].tolist(), self.cycles[:n].tolist())
+        return state, None
+
+    def free(self):
+        self.lib.naps_bridge_free(self.handle)
+
+
+class _Process:
+    def __init__(self, generator, domain):
+        self.stack = [generator]
+        self.domain = domain
+        self.passive = False
+        self.done = False
+        self.waiting_for = domain  # the domain whose next edge resumes the process
+        self.bridge = None
+
+
+class CxxrtlSimulator:
+    def __init__(self, fragment: Fragment):
+        cache_key = fragment_hash(fragment).digest
+        # the undriven signals (and the clocks and resets) become inputs of the design so that the testbench can write
+        # them. inside the design they are only (read only) aliases of the ports.
+        ports = {f"port${i}": (signal, PortDirection.Input) for i, signal in enumerate(_undriven_signals(fragment))}
+        self.design = fragment.prepare(ports=ports)
+        self.port_names = SignalDict((signal, name) for name, signal, direction in self.design.ports
+                                     if direction == PortDirection.Input)
+        rtlil_text, self.name_map = rtlil.convert_fragment(self.design)
+        self.lib = _load(_compile(rtlil_text, cache_key))
+        self.handle = self.lib.cxxrtl_create(self.lib.cxxrtl_design_create())
+
+        self.signals = {}  # id(signal) -> (signal, naps_signal pointer or None for signals that are not part of the design)
+        self.python_values = SignalDict()  # values of the signals that only exist in the testbench
+        self.pending_writes = []
+        self.clocks = {}  # domain -> [clk pointer, period_ps, next rising edge in ps]
+        self.processes = []
+        self.vcd = None
+        self.vcd_path = None
+        self.vcd_ring_buffer = False
+
+    def signal(self, signal: Signal):
+        """:return: the naps_signal pointer of a signal or None if the signal is not part of the compiled design"""
+        try:
+            return self.signals[id(signal)][1]
+        except KeyError:
+            pass
+        pointer = None
+        if signal in self.port_names or signal in self.name_map:
+            name = self.port_names[signal] if signal in self.port_names else " ".join(self.name_map[signal][1:])
+            pointer = self.lib.naps_signal_get(self.handle, name.encode())
+            if pointer is None:
+                raise ValueError(f"signal {signal!r} ({name}) is not accessible in the CXXRTL simulation")
+        self.signals[id(signal)] = (signal, pointer)
+        return pointer
+
+    def add_clock(self, period_s, phase_s=None, domain="sync"):
+        clk = self.design.fragment.domains[domain].clk
+        period = round(period_s * 1e12)
+        phase = round(phase_s * 1e12) if phase_s is not None else period // 2
+        self.clocks[domain] = [self.signal(clk), period, phase]
+
+    def add_process(self, generator_function, domain="sync"):
+        self.processes.append(_Process(generator_function(), domain))
+
+    def write_vcd(self, path, select=None, window=None, history=None, timescale_ps=1):
+        """
+        Traces the simulation to a vcd file (memories are not traced).
+        :param select: a function (dotted hierarchical name, signal) -> bool that decides which signals are traced
+        :param window: a (start, stop) tuple in ps; only the samples in this time window are written
+        :param history: if given (in ps), the trace is kept in memory and only (at least) the last `history` ps are
+                        written if the simulation fails
+        """
+        names = []
+        if select is not None:
+            names = [" ".join(path[1:]) for signal, path in self.name_map.items() if select(".".join(path[1:]), signal)]
+            if not names:
+                raise ValueError("no signal of the design is selected for tracing")
+        names_array = (ctypes.c_char_p * len(names))(*(name.encode() for name in names))
+        start, stop = window if window is not None else (0, 2**64 - 1)
+        self.vcd = self.lib.naps_vcd_create(
+            self.handle, str(path).encode(), timescale_ps, names_array, len(names), start, stop, history or 0
+        )
+        if self.vcd is None:
+            raise OSError(f"could not open {path}")
+        self.vcd_path = path
+        self.vcd_ring_buffer = bool(history)
+
+    # reading and writing signals
+
+    def read(self, signal):
+        pointer = self.signal(signal)
+        if pointer is None:
+            return self.python_values.get(signal, signal.init)
+        width = len(signal)
+        if width <= 64:
+            value = self.lib.naps_signal_read64(pointer)
+        else:
+            chunks = (ctypes.c_uint32 * ((width + 31) // 32))()
+            self.lib.naps_signal_read(pointer, chunks)
+            value = sum(chunk << (32 * i) for i, chunk in enumerate(chunks))
+        return _to_signed(value, width) if signal.shape().signed else value
+
+    def _write(self, signal, value):
+        pointer = self.signal(signal)
+        value &= (1 << len(signal)) - 1
+        if pointer is None:
+            self.python_values[signal] = _to_signed(value, len(signal)) if signal.shape().signed else value
+            return
+        if not self.lib.naps_signal_writable(pointer):
+            raise ValueError(f"signal {signal!r} is driven by the design and can not be written by a testbench")
+        if len(signal) <= 64:
+            self.lib.naps_signal_write64(pointer, value)
+        else:
+            chunks = (ctypes.c_uint32 * ((len(signal) + 31) // 32))(
+                *((value >> (32 * i)) & 0xffffffff for i in range((len(signal) + 31) // 32))
+            )
+            self.lib.naps_signal_write(pointer, chunks)
+
+    def evaluate(self, value):
+        """Evaluates an expression on the current values of the signals. The result is wrapped to its shape."""
+        value = Value.cast(value)
+        if isinstance(value, Signal):
+            return self.read(value)
+        if isinstance(value, Const):
+            return value.value
+        shape = value.shape()
+        if isinstance(value, Operator) and value.operator in ("r&", "r^"):
+            operand = self.evaluate(value.operands[0]) & ((1 << len(value.operands[0])) - 1)
+            if value.operator == "r&":
+                result = int(operand == (1 << len(value.operands[0])) - 1)
+            else:
+                result = bin(operand).count("1") & 1
+        elif isinstance(value, Operator):
+            operands = [self.evaluate(operand) for operand in value.operands]
+            result = _OPERATORS[(value.operator, len(operands))](*operands)
+        elif isinstance(value, Slice):
+            result = self.evaluate(value.value) >> value.start
+        elif isinstance(value, Part):
+            result = self.evaluate(value.value) >> (self.evaluate(value.offset) * value.stride)
+        elif isinstance(value, Concat):
+            result, offset = 0, 0
+            for part in value.parts:
+                result |= (self.evaluate(part) & ((1 << len(part)) - 1)) << offset
+                offset += len(part)
+        elif isinstance(value, ArrayProxy):
+            elems = value.elems
+            result = self.evaluate(elems[min(self.evaluate(value.index), len(elems) - 1)])
+        else:
+            raise NotImplementedError(f"evaluating {type(value).__name__} is not supported in the CXXRTL simulation")
+        result &= (1 << shape.width) - 1
+        return _to_signed(result, shape.width) if shape.signed and shape.width else result
+
+    def _assign(self, lhs, value):
+        lhs = Value.cast(lhs)
+        if isinstance(lhs, Signal):
+            self.pending_writes.append((lhs, value))
+        elif isinstance(lhs, Slice):
+            # later writes in the same cycle have to see the earlier ones; therefore we merge with the pending value
+            current = next((v for s, v in reversed(self.pending_writes) if s is lhs.value), None)
+            current = self.evaluate(lhs.value) if current is None else current
+            mask = ((1 << (lhs.stop - lhs.start)) - 1) << lhs.start
+            self._assign(lhs.value, (current & ~mask) | ((value << lhs.start) & mask))
+        elif isinstance(lhs, Concat):
+            for part in lhs.parts:
+                self._assign(part, value & ((1 << len(part)) - 1))
+                value >>= len(part)
+        else:
+            raise NotImplementedError(f"assigning to {type(lhs).__name__} is not supported in the CXXRTL simulation")
+
+    def _apply_writes(self):
+        for signal, value in self.pending_writes:
+            self._write(signal, value)
+        self.pending_writes.clear()
+
+    # running the processes
+
+    def _resume(self, process, result=None, exception=None):
+        from naps.stream.sim_util import StreamArrayTransfer
+
+        while True:
+            generator = process.stack[-1]
+            try:
+                command = generator.throw(exception) if exception is not None else generator.send(result)
+            except StopIteration as e:
+                process.stack.pop()
+                if not process.stack:
+                    process.done = True
+                    return
+                result, exception = e.value, None
+                continue
+            except Exception as e:
+                process.stack.pop()
+                if not process.stack:
+                    raise
+                result, exception = None, e
+                continue
+            result, exception = None, None
+
+            if command is None:
+                process.waiting_for = process.domain
+                return
+            elif isinstance(command, Tick):
+                process.waiting_for = command.domain if isinstance(command.domain, str) else command.domain.name
+                return
+            elif isinstance(command, Assign):
+                self._assign(command.lhs, self.evaluate(command.rhs))
+            elif isinstance(command, (Value, ValueCastable)):
+                result = self.evaluate(command)
+            elif isinstance(command, Passive):
+                process.passive = True
+            elif isinstance(command, Active):
+                process.passive = False
+            elif isinstance(command, Settle):
+                pass
+            elif isinstance(command, StreamArrayTransfer) and command.native and command.count != 0 \
+                    and _Bridge.supported(self, command):
+                process.bridge = _Bridge(self, command)
+                process.waiting_for = None
+                return
+            elif isinstance(command, BulkSimCommand):
+                process.stack.append(command.run())
+            else:
+                raise TypeError(f"command {command!r} is not supported in the CXXRTL simulation")
+
+    def _bridges(self, domain):
+        bridges = [p.bridge.handle for p in self.processes if p.bridge is not None and p.domain == domain]
+        return (ctypes.c_void_p * len(bridges))(*bridges), len(bridges)
+
+    def _python_phase(self, domain):
+        """resumes the processes that wait for this edge of the domain and the processes whose bridges finished"""
+        to_resume = [p for p in self.processes if not p.done and p.bridge is None and p.waiting_for == domain]
+        for process in self.processes:
+            if process.bridge is None or process.domain != domain:
+                continue
+            state, result = process.bridge.state()
+            if state == _BRIDGE_RUNNING:
+                continue
+            command = process.bridge.command
+            process.bridge.free()
+            process.bridge = None
+            if state == _BRIDGE_DONE:
+                # the transfer ends with deasserting the handshake signal (like the python implementation)
+                self._assign(command.stream.valid if command.is_writer else command.stream.ready, 0)
+                self._resume(process, result)
+            else:
+                handshake = command.stream.ready if command.is_writer else command.stream.valid
+                exception = TimeoutError(f"{handshake!r} did not become '1' within {command.timeout} cycles")
+                self._resume(process, exception=exception)
+        for process in to_resume:
+            self._resume(process)
+
+    def _finish_edge(self, domain):
+        clk, period, time = self.clocks[domain]
+        bridges, n_bridges = self._bridges(domain)
+        self.lib.naps_edge_rise(self.handle, clk)
+        # the bridges were started after the writes of their processes, therefore their writes have to win
+        self._apply_writes()
+        self.lib.naps_bridges_post_edge(bridges, n_bridges)
+        self.lib.naps_edge_finish(self.handle, clk, self.vcd, time, period)
+        self.clocks[domain][2] = time + period
+
+    def run(self):
+        for process in self.processes:
+            if process.domain not in self.clocks:
+                raise ValueError(f"there is no clock for the domain {process.domain!r} of a process")
+        try:
+            while any(not p.done and not p.passive for p in self.processes):
+                domain = min(self.clocks, key=lambda d: self.clocks[d][2])
+                clk, period, time = self.clocks[domain]
+                bridges, n_bridges = self._bridges(domain)
+                python_processes = [p for p in self.processes if not p.done and p.bridge is None]
+
+                if n_bridges and len(self.clocks) == 1 and not python_processes:
+                    # nothing to do for python until a bridge needs attention
+                    stopped = ctypes.c_int()
+                    edges = self.lib.naps_run_bridges(
+                        self.handle, clk, bridges, n_bridges, 1 << 20, self.vcd, time, period, ctypes.byref(stopped)
+                    )
+                    self.clocks[domain][2] = time + (edges - 1 if stopped.value else edges) * period
+                    if not stopped.value:
+                        continue
+                else:
+                    stopped = self.lib.naps_bridges_pre_edge(bridges, n_bridges)
+                    if not stopped and not any(p.waiting_for == domain for p in python_processes):
+                        self._finish_edge(domain)
+                        continue
+
+                self._python_phase(domain)
+                self._finish_edge(domain)
+        except BaseException:
+            if self.vcd is not None and self.vcd_ring_buffer:
+                print(f"\nwriting the last cycles before the failure to '{self.vcd_path}'")
+                self.lib.naps_vcd_dump(self.vcd, str(self.vcd_path).encode())
+            raise
+        finally:
+            for process in self.processes:
+                if process.bridge is not None:
+                    process.bridge.free()
+                    process.bridge = None
+            if self.vcd is not None:
+                self.lib.naps_vcd_close(self.vcd)
+                self.vcd = None
+            self.lib.cxxrtl_destroy(self.handle)
+
+
+_OPERATORS = {
+    ("~", 1): lambda a: ~a,
+    ("-", 1): lambda a: -a,
+    ("b", 1): lambda a: int(a != 0),
+    ("r|", 1): lambda a: int(a != 0),
+    ("u", 1): lambda a: a,
+    ("s", 1): lambda a: a,
+    ("+", 2): lambda a, b: a + b,
+    ("-", 2): lambda a, b: a - b,
+    ("*", 2): lambda a, b: a * b,
+    ("//", 2): lambda a, b: a // b if b else 0,
+    ("%", 2): lambda a, b: a % b if b else 0,  # like pysim, dividing by zero gives zero
+    ("&", 2): lambda a, b: a & b,
+    ("|", 2): lambda a, b: a | b,
+    ("^", 2): lambda a, b: a ^ b,
+    ("<<", 2): lambda a, b: a << b,
+    (">>", 2): lambda a, b: a >> b,
+    ("==", 2): lambda a, b: int(a == b),
+    ("!=", 2): lambda a, b: int(a != b),
+    ("<", 2): lambda a, b: int(a < b),
+    ("<=", 2): lambda a, b: int(a <= b),
+    (">", 2): lambda a, b: int(a > b),
+    (">=", 2): lambda a, b: int(a >= b),
+    ("m", 3): lambda s, a, b: a if s else b,
+}
@@ -0,0 +1,482 @@
+// The c side of the CXXRTL simulation engine (see sim_cxxrtl.py). It is compiled together with the design into a
+// shared object and provides
+// * reading and writing of (possibly split) signals as arrays of 32 bit chunks
+// * stream bridges that move whole arrays of words through a stream without calling back into python every cycle
+// * (filtered, windowed or ring buffered) vcd writing
+
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <set>
+#include <string>
+#include <vector>
+
+#include <cxxrtl/capi/cxxrtl_capi.h>
+#include <cxxrtl/capi/cxxrtl_capi_vcd.h>
+
+struct naps_signal {
+    std::vector<cxxrtl_object *> parts;
+    size_t width;
+    bool writable;
+    bool simple;  // a single part that starts at bit 0 and is at most 64 bit wide
+};
+
+static bool get_bit(const uint32_t *chunks, size_t bit) {
+    return (chunks[bit / 32] >> (bit % 32)) & 1;
+}
+
+static void set_bit(uint32_t *chunks, size_t bit, bool value) {
+    if (value) {
+        chunks[bit / 32] |= 1u << (bit % 32);
+    } else {
+        chunks[bit / 32] &= ~(1u << (bit % 32));
+    }
+}
+
+static size_t n_chunks(size_t width) {
+    return (width + 31) / 32;
+}
+
+static void eval_outline(cxxrtl_object *part) {
+    if (part->type == CXXRTL_OUTLINE) {
+        cxxrtl_outline_eval(part->outline);
+    }
+}
+
+extern "C" {
+
+naps_signal *naps_signal_get(cxxrtl_handle handle, const char *name) {
+    size_t n_parts = 0;
+    cxxrtl_object *parts = cxxrtl_get_parts(handle, name, &n_parts);
+    if (parts == nullptr || parts[0].type == CXXRTL_MEMORY) {
+        return nullptr;
+    }
+    auto signal = new naps_signal{{}, 0, true, false};
+    for (size_t i = 0; i < n_parts; i++) {
+        signal->parts.push_back(&parts[i]);
+        signal->width += parts[i].width;
+        signal->writable &= parts[i].next != nullptr;
+    }
+    signal->simple = n_parts == 1 && parts[0].lsb_at == 0 && parts[0].width <= 64;
+    return signal;
+}
+
+size_t naps_signal_width(naps_signal *signal) {
+    return signal->width;
+}
+
+int naps_signal_writable(naps_signal *signal) {
+    return signal->writable;
+}
+
+void naps_signal_read(naps_signal *signal, uint32_t *chunks) {
+    memset(chunks, 0, n_chunks(signal->width) * sizeof(uint32_t));
+    for (auto part : signal->parts) {
+        eval_outline(part);
+        size_t lsb = part->lsb_at - signal->parts[0]->lsb_at;
+        for (size_t bit = 0; bit < part->width; bit++) {
+            set_bit(chunks, lsb + bit, get_bit(part->curr, bit));
+        }
+    }
+}
+
+void naps_signal_write(naps_signal *signal, const uint32_t *chunks) {
+    for (auto part : signal->parts) {
+        size_t lsb = part->lsb_at - signal->parts[0]->lsb_at;
+        for (size_t bit = 0; bit < part->width; bit++) {
+            set_bit(part->next, bit, get_bit(chunks, lsb + bit));
+        }
+    }
+}
+
+uint64_t naps_signal_read64(naps_signal *signal) {
+    if (!signal->simple) {
+        uint32_t chunks[2] = {0, 0};
+        if (signal->width <= 64) {
+            naps_signal_read(signal, chunks);
+        }
+        return chunks[0] | ((uint64_t)chunks[1] << 32);
+    }
+    cxxrtl_object *part = signal->parts[0];
+    eval_outline(part);
+    return part->width > 32 ? part->curr[0] | ((uint64_t)part->curr[1] << 32) : part->curr[0];
+}
+
+void naps_signal_write64(naps_signal *signal, uint64_t value) {
+    if (!signal->simple) {
+        uint32_t chunks[2] = {(uint32_t)value, (uint32_t)(value >> 32)};
+        naps_signal_write(signal, chunks);
+        return;
+    }
+    cxxrtl_object *part = signal->parts[0];
+    uint64_t mask = part->width == 64 ? ~0ull : (1ull << part->width) - 1;
+    value &= mask;
+    part->next[0] = (uint32_t)value;
+    if (part->width > 32) {
+        part->next[1] = (uint32_t)(value >> 32);
+    }
+}
+
+void naps_signal_free(naps_signal *signal) {
+    delete signal;
+}
+
+
+// Stream bridges mirror write_arrays_to_stream / read_arrays_from_stream (naps/stream/sim_util.py) cycle by cycle.
+// Every word is packed into an uint64 with valid at bit 0 followed by the fields. Finished bridges are picked up by the
+// python side before the next edge, which also deasserts the handshake signal.
+
+enum naps_bridge_state {
+    NAPS_BRIDGE_RUNNING = 0,
+    NAPS_BRIDGE_DONE = 1,
+    NAPS_BRIDGE_TIMEOUT = 2,
+};
+
+struct naps_bridge_field {
+    naps_signal *signal;
+    unsigned offset;
+    unsigned width;
+};
+
+struct naps_bridge {
+    bool is_writer;
+    naps_signal *valid;
+    naps_signal *ready;
+    std::vector<naps_bridge_field> fields;
+
+    uint64_t *words;  // the words to write or the buffer for the read words
+    uint64_t *cycles;  // the transfer cycle of every word
+    size_t n_words;  // the number of words to write or the size of the buffers for the read words
+    size_t count;  // reader: the maximum number of words to read
+    size_t index = 0;
+    uint64_t until_mask;  // reader: stop after a word that has any of these bits set
+
+    const int64_t *pauses;
+    size_t n_pauses;
+    size_t pause_index = 0;
+    uint64_t remaining_pause = 0;
+
+    uint64_t timeout;  // 0 disables the timeout
+    uint64_t waited = 0;
+    uint64_t cycle = 0;
+    int state = NAPS_BRIDGE_RUNNING;
+    bool needs_pauses = true;  // the python side has to provide the next chunk of the pause schedule before the next edge
+    bool needs_space = false;  // the python side has to provide larger buffers for the read words before the next edge
+
+    // writes are applied after the clock edge
+    bool write_handshake;
+    uint64_t handshake_value;
+    bool write_word;
+    uint64_t word;
+};
+
+static void bridge_write_word(naps_bridge *bridge, uint64_t word) {
+    bridge->write_word = true;
+    bridge->word = word;
+}
+
+static void bridge_handshake(naps_bridge *bridge, uint64_t value) {
+    bridge->write_handshake = true;
+    bridge->handshake_value = value;
+}
+
+// starts the transfer of the next word (after an optional pause)
+static void bridge_next(naps_bridge *bridge) {
+    if (bridge->is_writer && bridge->index >= bridge->n_words) {
+        bridge->state = NAPS_BRIDGE_DONE;
+        return;
+    }
+    bridge->remaining_pause = bridge->pauses[bridge->pause_index++];
+    bridge->needs_pauses = bridge->pause_index >= bridge->n_pauses;
+    bridge->waited = 0;
+    if (bridge->remaining_pause) {
+        bridge_handshake(bridge, 0);
+    } else if (bridge->is_writer) {
+        bridge_write_word(bridge, bridge->words[bridge->index]);
+    } else {
+        bridge_handshake(bridge, 1);
+    }
+}
+
+naps_bridge *naps_bridge_create(
+        int is_writer, naps_signal *valid, naps_signal *ready, size_t n_fields, naps_signal **field_signals,
+        const unsigned *offsets, const unsigned *widths, uint64_t *words, uint64_t *cycles, size_t n_words,
+        size_t count, uint64_t until_mask, uint64_t timeout
+) {
+    auto bridge = new naps_bridge();
+    bridge->is_writer = is_writer;
+    bridge->valid = valid;
+    bridge->ready = ready;
+    for (size_t i = 0; i < n_fields; i++) {
+        bridge->fields.push_back({field_signals[i], offsets[i], widths[i]});
+    }
+    bridge->words = words;
+    bridge->cycles = cycles;
+    bridge->n_words = n_words;
+    bridge->count = count;
+    bridge->until_mask = until_mask;
+    bridge->timeout = timeout;
+    return bridge;
+}
+
+// provides the next chunk of the pause schedule (at least one entry); the array has to stay valid until the next call
+void naps_bridge_set_pauses(naps_bridge *bridge, const int64_t *pauses, size_t n_pauses) {
+    bridge->pauses = pauses;
+    bridge->n_pauses = n_pauses;
+    bridge->pause_index = 0;
+    bridge->needs_pauses = false;
+}
+
+// provides larger buffers for the read words that already contain the words that were read so far
+void naps_bridge_set_buffers(naps_bridge *bridge, uint64_t *words, uint64_t *cycles, size_t n_words) {
+    bridge->words = words;
+    bridge->cycles = cycles;
+    bridge->n_words = n_words;
+    bridge->needs_space = false;
+}
+
+// starts the transfer; the pause schedule has to be set before
+void naps_bridge_start(naps_bridge *bridge) {
+    if (!bridge->is_writer) {
+        bridge_handshake(bridge, 1);
+    }
+    bridge_next(bridge);
+}
+
+int naps_bridge_state(naps_bridge *bridge) {
+    return bridge->state;
+}
+
+int naps_bridge_needs_pauses(naps_bridge *bridge) {
+    return bridge->needs_pauses && bridge->state == NAPS_BRIDGE_RUNNING;
+}
+
+int naps_bridge_needs_space(naps_bridge *bridge) {
+    return bridge->needs_space && bridge->state == NAPS_BRIDGE_RUNNING;
+}
+
+size_t naps_bridge_index(naps_bridge *bridge) {
+    return bridge->index;
+}
+
+void naps_bridge_free(naps_bridge *bridge) {
+    delete bridge;
+}
+
+// samples the stream before a rising clock edge
+// :return: whether the python side has to look at the bridge before the edge
+static bool bridge_pre_edge(naps_bridge *bridge) {
+    if (bridge->state != NAPS_BRIDGE_RUNNING) {
+        return false;
+    }
+    bridge->cycle++;
+    if (bridge->remaining_pause) {
+        if (--bridge->remaining_pause == 0) {
+            if (bridge->is_writer) {
+                bridge_write_word(bridge, bridge->words[bridge->index]);
+            } else {
+                bridge_handshake(bridge, 1);
+            }
+        }
+        return false;
+    }
+    bridge->waited++;
+    if (bridge->is_writer) {
+        if (naps_signal_read64(bridge->ready)) {
+            bridge->cycles[bridge->index++] = bridge->cycle;
+            bridge_next(bridge);
+            return bridge->state != NAPS_BRIDGE_RUNNING || bridge->needs_pauses;
+        }
+    } else if (naps_signal_read64(bridge->valid)) {
+        uint64_t word = 1;
+        for (auto &field : bridge->fields) {
+            word |= naps_signal_read64(field.signal) << field.offset;
+        }
+        bridge->words[bridge->index] = word;
+        bridge->cycles[bridge->index++] = bridge->cycle;
+        if ((word & bridge->until_mask) || bridge->index >= bridge->count) {
+            bridge->state = NAPS_BRIDGE_DONE;
+        } else {
+            bridge->needs_space = bridge->index >= bridge->n_words;
+            bridge_next(bridge);
+        }
+        return bridge->state != NAPS_BRIDGE_RUNNING || bridge->needs_pauses || bridge->needs_space;
+    }
+    if (bridge->timeout && bridge->waited >= bridge->timeout) {
+        bridge->state = NAPS_BRIDGE_TIMEOUT;
+        return true;
+    }
+    return false;
+}
+
+// applies the writes of the bridge after the clock edge
+static void bridge_post_edge(naps_bridge *bridge) {
+    if (bridge->write_word) {
+        naps_signal_write64(bridge->valid, 1);
+        for (auto &field : bridge->fields) {
+            uint64_t mask = field.width >= 64 ? ~0ull : (1ull << field.width) - 1;
+            naps_signal_write64(field.signal, (bridge->word >> field.offset) & mask);
+        }
+        bridge->write_word = false;
+    }
+    if (bridge->write_handshake) {
+        naps_signal_write64(bridge->is_writer ? bridge->valid : bridge->ready, bridge->handshake_value);
+        bridge->write_handshake = false;
+    }
+}
+
+// :return: whether any of the bridges needs the python side before the edge
+int naps_bridges_pre_edge(naps_bridge **bridges, size_t n_bridges) {
+    bool stop = false;
+    for (size_t i = 0; i < n_bridges; i++) {
+        stop |= bridge_pre_edge(bridges[i]);
+    }
+    return stop;
+}
+
+void naps_bridges_post_edge(naps_bridge **bridges, size_t n_bridges) {
+    for (size_t i = 0; i < n_bridges; i++) {
+        bridge_post_edge(bridges[i]);
+    }
+}
+
+
+// vcd writing. the trace can be restricted to a set of signals and a time window. in the ring buffer mode, the trace is
+// kept in memory in segments of `history` time units (every segment starts with the values of all signals) and only
+// the last two segments are written by naps_vcd_dump().
+
+struct naps_vcd {
+    cxxrtl_handle handle;
+    int timescale_ps;
+    std::set<std::string> names;  // empty: all signals (without memories)
+    uint64_t window_start;
+    uint64_t window_stop;
+    uint64_t history;  // 0: stream the trace to the file
+    FILE *file;
+    cxxrtl_vcd vcd;
+    std::string previous;
+    std::string current;
+    uint64_t segment_start;
+};
+
+static int vcd_filter(void *data, const char *name, const cxxrtl_object *object) {
+    auto vcd = (naps_vcd *)data;
+    return object->type != CXXRTL_MEMORY && (vcd->names.empty() || vcd->names.count(name));
+}
+
+static void vcd_start_segment(naps_vcd *vcd) {
+    if (vcd->vcd) {
+        cxxrtl_vcd_destroy(vcd->vcd);
+    }
+    vcd->vcd = cxxrtl_vcd_create();
+    cxxrtl_vcd_timescale(vcd->vcd, vcd->timescale_ps, "ps");
+    cxxrtl_vcd_add_from_if(vcd->vcd, vcd->handle, vcd, vcd_filter);
+}
+
+naps_vcd *naps_vcd_create(
+        cxxrtl_handle handle, const char *path, int timescale_ps, const char **names, size_t n_names,
+        uint64_t window_start, uint64_t window_stop, uint64_t history
+) {
+    FILE *file = nullptr;
+    if (history == 0) {
+        file = fopen(path, "w");
+        if (file == nullptr) {
+            return nullptr;
+        }
+    }
+    auto vcd = new naps_vcd{handle, timescale_ps, {}, window_start, window_stop, history, file, nullptr, "", "", 0};
+    for (size_t i = 0; i < n_names; i++) {
+        vcd->names.insert(names[i]);
+    }
+    vcd_start_segment(vcd);
+    return vcd;
+}
+
+void naps_vcd_sample(naps_vcd *vcd, uint64_t time) {
+    if (time < vcd->window_start || time > vcd->window_stop) {
+        return;
+    }
+    if (vcd->history && !vcd->current.empty() && time - vcd->segment_start >= vcd->history) {
+        vcd->previous = std::move(vcd->current);
+        vcd->current.clear();
+        vcd_start_segment(vcd);
+    }
+    if (vcd->history && vcd->current.empty()) {
+        vcd->segment_start = time;
+    }
+    cxxrtl_vcd_sample(vcd->vcd, time);
+    const char *data;
+    size_t size;
+    cxxrtl_vcd_read(vcd->vcd, &data, &size);
+    if (vcd->file) {
+        fwrite(data, 1, size, vcd->file);
+    } else {
+        vcd->current.append(data, size);
+    }
+}
+
+// writes the ring buffer to a file
+int naps_vcd_dump(naps_vcd *vcd, const char *path) {
+    FILE *file = fopen(path, "w");
+    if (file == nullptr) {
+        return 0;
+    }
+    std::string current = vcd->current;
+    const char *end_of_definitions = "$enddefinitions $end\n";
+    size_t position = current.find(end_of_definitions);
+    if (!vcd->previous.empty() && position != std::string::npos) {
+        // the definitions of both segments are the same
+        current = current.substr(position + strlen(end_of_definitions));
+    }
+    fwrite(vcd->previous.data(), 1, vcd->previous.size(), file);
+    fwrite(current.data(), 1, current.size(), file);
+    fclose(file);
+    return 1;
+}
+
+void naps_vcd_close(naps_vcd *vcd) {
+    if (vcd->file) {
+        fclose(vcd->file);
+    }
+    cxxrtl_vcd_destroy(vcd->vcd);
+    delete vcd;
+}
+
+
+// simulates a rising clock edge. afterwards, the writes of the python processes and then the writes of the bridges
+// (naps_bridges_post_edge) have to be applied before calling naps_edge_finish.
+void naps_edge_rise(cxxrtl_handle handle, naps_signal *clk) {
+    naps_signal_write64(clk, 1);
+    cxxrtl_step(handle);
+}
+
+// settles the writes after a rising edge and simulates the following falling edge
+void naps_edge_finish(cxxrtl_handle handle, naps_signal *clk, naps_vcd *vcd, uint64_t time, uint64_t period) {
+    cxxrtl_step(handle);
+    if (vcd) naps_vcd_sample(vcd, time);
+    naps_signal_write64(clk, 0);
+    cxxrtl_step(handle);
+    if (vcd) naps_vcd_sample(vcd, time + period / 2);
+}
+
+// runs up to max_edges cycles of a single clock in which only stream bridges are active (i.e. no python process has
+// to be resumed). stops before completing an edge in which a bridge needs the python side (*stopped is set then).
+// :return: the number of edges that were started
+uint64_t naps_run_bridges(
+        cxxrtl_handle handle, naps_signal *clk, naps_bridge **bridges, size_t n_bridges, uint64_t max_edges,
+        naps_vcd *vcd, uint64_t time, uint64_t period, int *stopped
+) {
+    *stopped = 0;
+    for (uint64_t edge = 0; edge < max_edges; edge++) {
+        if (naps_bridges_pre_edge(bridges, n_bridges)) {
+            *stopped = 1;
+            return edge + 1;
+        }
+        naps_edge_rise(handle, clk);
+        naps_bridges_post_edge(bridges, n_bridges);
+        naps_edge_finish(handle, clk, vcd, time + edge * period, period);
+    }
+    return max_edges;
+}
+
+}
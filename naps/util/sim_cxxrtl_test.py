@@ -0,0 +1,153 @@
+import unittest
+
+import numpy as np
+from amaranth import *
+from amaranth.lib.memory import Memory
+
+from naps import SimPlatform
+from naps.cores.stream import BufferedSyncStreamFIFO
+from naps.stream import BasicStream, PacketizedStream, write_arrays_to_stream, read_arrays_from_stream, write_to_stream
+from naps.util.sim import do_nothing
+
+
+class Counter(Elaboratable):
+    def __init__(self):
+        self.enable = Signal()
+        self.counter = Signal(16)
+        self.wide = Signal(100)
+        self.history = Signal(16)
+
+    def elaborate(self, platform):
+        m = Module()
+        with m.If(self.enable):
+            m.d.sync += self.counter.eq(self.counter + 1)
+        m.d.sync += self.wide.eq(Cat(self.counter, self.counter, self.wide[:68]))
+
+        # an asynchronous memory read port
+        memory = m.submodules.memory = Memory(shape=16, depth=4, init=[])
+        write_port = memory.write_port()
+        read_port = memory.read_port(domain="comb")
+        m.d.comb += write_port.addr.eq(self.counter)
+        m.d.comb += write_port.data.eq(self.counter * 3)
+        m.d.comb += write_port.en.eq(1)
+        m.d.comb += read_port.addr.eq(self.counter - 1)
+        m.d.comb += self.history.eq(read_port.data)
+        return m
+
+
+class CxxrtlSimTest(unittest.TestCase):
+    def run_both(self, run):
+        results = {engine: run(engine) for engine in ("pysim", "cxxrtl")}
+        return results["pysim"], results["cxxrtl"]
+
+    def test_processes(self):
+        def run(engine):
+            platform = SimPlatform()
+            dut = Counter()
+            trace = []
+
+            def testbench():
+                for i in range(20):
+                    yield dut.enable.eq(i % 3 != 0)
+                    trace.append((
+                        (yield dut.counter), (yield dut.wide), (yield dut.counter[4:] + 1), (yield dut.history)
+                    ))
+                    yield
+
+            platform.add_sim_clock("sync", 100e6)
+            platform.sim(dut, testbench, engine=engine)
+            return trace
+
+        pysim, cxxrtl = self.run_both(run)
+        self.assertEqual(pysim, cxxrtl)
+
+    def test_division_by_zero(self):
+        def run(engine):
+            platform = SimPlatform()
+            dut = Counter()
+            trace = []
+
+            def testbench():
+                for i in range(4):
+                    yield dut.enable.eq(1)
+                    # the counter is zero in the first cycles
+                    trace.append(((yield (dut.counter + 5) // dut.counter), (yield (dut.counter + 5) % dut.counter)))
+                    yield
+
+            platform.add_sim_clock("sync", 100e6)
+            platform.sim(dut, testbench, engine=engine)
+            return trace
+
+        pysim, cxxrtl = self.run_both(run)
+        self.assertEqual(pysim, cxxrtl)
+        self.assertEqual(pysim[0], (0, 0))
+
+    def test_streams(self):
+        def run(engine):
+            platform = SimPlatform()
+            input = PacketizedStream(12)
+            fifo = BufferedSyncStreamFIFO(input, 8)
+            payload = np.random.default_rng(0).integers(0, 2**12, 3000)
+            last = np.arange(3000) % 100 == 99
+            results = {}
+
+            def writer():
+                # mix bulk transfers with single word transfers
+                yield from write_to_stream(input, payload=1, last=0)
+                results["written"] = yield from write_arrays_to_stream(input, pause_probability=0.3, payload=payload, last=last)
+
+            def reader():
+                yield from do_nothing(10)
+                packets = []
+                for _ in range(30):
+                    packets.append((yield from read_arrays_from_stream(
+                        fifo.output, until="last", pause_probability=0.4, seed=len(packets)
+                    )))
+                results["read"] = packets
+
+            platform.add_sim_clock("sync", 100e6)
+            platform.add_process(writer, "sync")
+            platform.sim(fifo, reader, engine=engine)
+            return results
+
+        pysim, cxxrtl = self.run_both(run)
+        np.testing.assert_array_equal(pysim["written"].cycles, cxxrtl["written"].cycles)
+        for pysim_packet, cxxrtl_packet in zip(pysim["read"], cxxrtl["read"]):
+            np.testing.assert_array_equal(pysim_packet["payload"], cxxrtl_packet["payload"])
+            np.testing.assert_array_equal(pysim_packet.cycles, cxxrtl_packet.cycles)
+
+    def test_timeout(self):
+        platform = SimPlatform()
+        input = BasicStream(8)
+        fifo = BufferedSyncStreamFIFO(input, 8)
+
+        def testbench():
+            # nobody reads from the fifo
+            with self.assertRaises(TimeoutError):
+                yield from write_arrays_to_stream(input, timeout=10, payload=np.arange(100))
+
+        platform.add_sim_clock("sync", 100e6)
+        platform.sim(fifo, testbench, engine="cxxrtl")
+
+    def test_long_stream(self):
+        def run(engine):
+            platform = SimPlatform()
+            input = BasicStream(32)
+            fifo = BufferedSyncStreamFIFO(input, 16)
+            payload = np.arange(20000) * 7
+            results = {}
+
+            def writer():
+                yield from write_arrays_to_stream(input, pause_probability=0.1, payload=payload)
+
+            def reader():
+                results["read"] = yield from read_arrays_from_stream(fifo.output, count=len(payload), pause_probability=0.1)
+
+            platform.add_sim_clock("sync", 100e6)
+            platform.add_process(writer, "sync")
+            platform.sim(fifo, reader, engine=engine)
+            np.testing.assert_array_equal(results["read"]["payload"], payload)
+            return results
+
+        pysim, cxxrtl = self.run_both(run)
+        np.testing.assert_array_equal(pysim["read"].cycles, cxxrtl["read"].cycles)
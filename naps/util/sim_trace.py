@@ -0,0 +1,188 @@
+# Control over the traces (vcd / fst files) that are written by SimPlatform.sim().
+#
+# By default, traces are only written for failing simulations: the simulator keeps the last cycles in memory and writes
+# them out when the simulation raises an exception, so that passing tests spend no time on trace io. The behaviour can
+# be changed for a single simulation (the trace= argument of SimPlatform.sim()) or globally by environment variables:
+# * NAPS_SIM_TRACE: "failure" (default), "all" or "none"
+# * NAPS_SIM_TRACE_SIGNALS: a comma separated list of hierarchical names or globs (e.g. "fifo.*,output.payload")
+# * NAPS_SIM_TRACE_WINDOW: "start:stop" in cycles of the fastest clock (e.g. "1000:2000" or "1000:")
+# * NAPS_SIM_TRACE_HISTORY: the number of cycles that are kept for the failure traces
+# * NAPS_SIM_TRACE_FORMAT: "vcd" (default) or "fst" (converted with vcd2fst from gtkwave)
+
+import os
+import shutil
+import subprocess
+from collections import deque
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+
+from amaranth.hdl import Signal, Value
+from amaranth.hdl._ast import SignalDict
+
+from .env import naps_getenv
+
+__all__ = ["SimTrace"]
+
+_MODES = ("all", "failure", "none")
+_FORMATS = ("vcd", "fst")
+
+
+@dataclass
+class SimTrace:
+    """
+    :param mode: "all" writes the whole (windowed) trace, "failure" only writes the last `history` cycles if the
+                 simulation fails and "none" writes nothing
+    :param signals: signals or globs of hierarchical names (without the name of the toplevel, e.g. "fifo.*") that are
+                    traced; all signals are traced if this is empty
+    :param window: a (start, stop) tuple of cycles of the fastest clock; only this part of the simulation is traced.
+                   stop may be None.
+    :param history: the number of cycles of the fastest clock that are kept for the failure traces
+    :param format: "vcd" or "fst"
+    """
+    mode: str = "failure"
+    signals: tuple = ()
+    window: tuple = None
+    history: int = 10000
+    format: str = "vcd"
+
+    def __post_init__(self):
+        if self.mode not in _MODES:
+            raise ValueError(f"unknown trace mode {self.mode!r}; expected one of {_MODES}")
+        if self.format not in _FORMATS:
+            raise ValueError(f"unknown trace format {self.format!r}; expected one of {_FORMATS}")
+        if self.history <= 0:
+            raise ValueError("the trace history must be at least one cycle")
+        if self.window is not None:
+            start, stop = self.window
+            if start < 0 or (stop is not None and stop < start):
+                raise ValueError(f"invalid trace window {self.window!r}")
+        self.signals = tuple(Value.cast(s) if not isinstance(s, str) else s for s in self.signals)
+        for s in self.signals:
+            if not isinstance(s, (str, Signal)):
+                raise TypeError(f"only signals and names can be traced, not {s!r}")
+
+    @staticmethod
+    def from_env() -> "SimTrace":
+        signals = naps_getenv("SIM_TRACE_SIGNALS", "")
+        window = naps_getenv("SIM_TRACE_WINDOW")
+        if window is not None:
+            start, _, stop = window.partition(":")
+            window = (int(start or 0), int(stop) if stop else None)
+        return SimTrace(
+            mode=naps_getenv("SIM_TRACE", "failure"),
+            signals=tuple(s.strip() for s in signals.split(",") if s.strip()),
+            window=window,
+            history=int(naps_getenv("SIM_TRACE_HISTORY", 10000)),
+            format=naps_getenv("SIM_TRACE_FORMAT", "vcd"),
+        )
+
+    @property
+    def is_filtered(self):
+        return bool(self.signals) or self.window is not None
+
+    def selects(self, name: str, signal: Signal) -> bool:
+        """:return: whether a signal with a hierarchical name (e.g. "fifo.r_data") is traced"""
+        if not self.signals:
+            return True
+        return any(
+            fnmatchcase(name, s) if isinstance(s, str) else s is signal
+            for s in self.signals
+        )
+
+    def window_fs(self, period_fs):
+        """:return: the trace window as a (start, stop) tuple of times"""
+        if self.window is None:
+            return 0, None
+        start, stop = self.window
+        return start * period_fs, stop * period_fs if stop is not None else None
+
+    def finish(self, vcd_path):
+        """Converts a written vcd file to the requested format. :return: the path of the trace"""
+        if self.format == "vcd" or not os.path.exists(vcd_path):
+            return vcd_path
+        if shutil.which("vcd2fst") is None:
+            print("vcd2fst (from gtkwave) was not found; keeping the vcd trace")
+            return vcd_path
+        fst_path = vcd_path[:-len(".vcd")] + ".fst"
+        subprocess.check_call(["vcd2fst", vcd_path, fst_path], stdout=subprocess.DEVNULL)
+        os.unlink(vcd_path)
+        return fst_path
+
+
+class PysimTracer:
+    """
+    Records the signal changes of the amaranth python simulator (it is attached to the engine like the vcd writer of
+    amaranth). Depending on the trace, the changes are either written to a vcd file while the simulation runs or kept
+    in memory and only written by dump().
+    """
+    fs_per_delta = 0
+
+    def __init__(self, simulator, path, trace: SimTrace, period_fs):
+        self.state = simulator._engine.state
+        self.path = path
+        self.start, self.stop = trace.window_fs(period_fs)
+        self.history = trace.history * period_fs if trace.mode == "failure" else None
+
+        self.names = SignalDict()  # signal -> set of (scope, name)
+        for fragment_info in simulator._design.fragments.values():
+            for signal, name in fragment_info.signal_names.items():
+                if len(signal) == 0 or not trace.selects(".".join((*fragment_info.name[1:], name)), signal):
+                    continue
+                self.names.setdefault(signal, set()).add((".".join(("bench", *fragment_info.name)), name))
+        if not self.names:
+            raise ValueError("no signal of the design is selected for tracing")
+
+        self.values = SignalDict((signal, signal.init & ((1 << len(signal)) - 1)) for signal in self.names)
+        self.changes = deque()  # (timestamp, signal, value) of the changes in the history
+        self.writer = None
+        self.variables = SignalDict()
+
+    def _open(self, timestamp, values):
+        import vcd
+        self.file = open(self.path, "w")
+        self.writer = vcd.VCDWriter(self.file, timescale="1 fs", comment="Generated by naps", init_timestamp=timestamp)
+        for signal, names in self.names.items():
+            self.variables[signal] = [
+                self.writer.register_var(scope, name, "wire", size=len(signal), init=values[signal])
+                for scope, name in sorted(names)
+            ]
+
+    def _write(self, timestamp, signal, value):
+        for variable in self.variables[signal]:
+            self.writer.change(variable, timestamp, value)
+
+    def update_signal(self, timestamp, signal):
+        if signal not in self.names or (self.stop is not None and timestamp > self.stop):
+            return
+        value = self.state.slots[self.state.get_signal(signal)].curr & ((1 << len(signal)) - 1)
+        if timestamp < self.start:
+            self.values[signal] = value
+            return
+        if self.history is None:
+            if self.writer is None:
+                self._open(timestamp, self.values)
+            self._write(timestamp, signal, value)
+            return
+        changes = self.changes
+        changes.append((timestamp, signal, value))
+        while changes[0][0] < timestamp - self.history:
+            _, old_signal, old_value = changes.popleft()
+            self.values[old_signal] = old_value
+
+    def update_memory(self, timestamp, memory, addr):
+        pass  # memories are not traced
+
+    def dump(self):
+        """Writes the recorded history to the vcd file"""
+        self._open(self.changes[0][0] if self.changes else 0, self.values)
+        for timestamp, signal, value in self.changes:
+            self._write(timestamp, signal, value)
+        self.close(self.changes[-1][0] if self.changes else 0)
+
+    def close(self, timestamp):
+        if self.writer is not None:
+            if self.stop is not None:
+                timestamp = min(timestamp, self.stop)
+            self.writer.close(timestamp)
+            self.file.close()
+            self.writer = None
@@ -0,0 +1,94 @@
+import os
+import re
+import unittest
+
+from amaranth import *
+
+from naps import SimPlatform, SimTrace
+from naps.util.sim import do_nothing
+
+
+class Counters(Elaboratable):
+    def __init__(self):
+        self.a = Signal(16)
+        self.b = Signal(16)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.sync += self.a.eq(self.a + 1)
+        m.d.sync += self.b.eq(self.b + 2)
+        return m
+
+
+def read_vcd(path):
+    """:return: the names of the traced variables and the first and last timestamp (in ps) of a vcd file"""
+    with open(path) as f:
+        text = f.read()
+    names = set(re.findall(r"\$var \S+ \d+ \S+ (\S+)", text))
+    unit = 1e-3 if re.search(r"\$timescale\s+1 ?fs", text) else 1  # pysim traces are in fs
+    timestamps = [int(t) * unit for t in re.findall(r"^#(\d+)", text, re.MULTILINE)]
+    return names, timestamps[0], timestamps[-1]
+
+
+class SimTraceTest(unittest.TestCase):
+    engines = ("pysim", "cxxrtl")
+
+    def simulate(self, engine, trace, cycles=100, fail=False):
+        platform = SimPlatform()
+        dut = Counters()
+
+        def testbench():
+            yield from do_nothing(cycles)
+            if fail:
+                raise AssertionError("expected failure")
+
+        platform.add_sim_clock("sync", 100e6)
+        vcd_path = platform.output_filename_base + ".vcd"
+        if os.path.exists(vcd_path):
+            os.unlink(vcd_path)
+        if fail:
+            with self.assertRaises(AssertionError):
+                platform.sim(dut, testbench, engine=engine, trace=trace)
+        else:
+            platform.sim(dut, testbench, engine=engine, trace=trace)
+        return vcd_path
+
+    def test_none(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                self.assertFalse(os.path.exists(self.simulate(engine, SimTrace("none"), fail=True)))
+
+    def test_failure(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                self.assertFalse(os.path.exists(self.simulate(engine, SimTrace("failure", history=10))))
+                vcd_path = self.simulate(engine, SimTrace("failure", history=10), cycles=1000, fail=True)
+                names, first, last = read_vcd(vcd_path)
+                self.assertIn("a", names)
+                # 10 ns per cycle; only the last few cycles are written
+                self.assertGreater(last, 990 * 10_000)
+                self.assertGreater(first, 950 * 10_000)
+
+    def test_signals(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                names, _, _ = read_vcd(self.simulate(engine, SimTrace("all", signals=["b"])))
+                self.assertEqual(names, {"b"})
+
+    def test_window(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                names, first, last = read_vcd(self.simulate(engine, SimTrace("all", window=(20, 30))))
+                self.assertIn("a", names)
+                self.assertGreaterEqual(first, 20 * 10_000)
+                self.assertLessEqual(last, 30 * 10_000)
+
+    def test_env(self):
+        os.environ.update(NAPS_SIM_TRACE="all", NAPS_SIM_TRACE_SIGNALS="a, b", NAPS_SIM_TRACE_WINDOW="100:")
+        try:
+            self.assertEqual(SimTrace.from_env(), SimTrace("all", signals=("a", "b"), window=(100, None)))
+        finally:
+            for name in ("NAPS_SIM_TRACE", "NAPS_SIM_TRACE_SIGNALS", "NAPS_SIM_TRACE_WINDOW"):
+                del os.environ[name]
+        with self.assertRaises(ValueError):
+            SimTrace("sometimes")